@@ -1,52 +1,207 @@
 from __future__ import annotations
 
+import hmac
+import os
 import uuid
 
-from fastapi import APIRouter, File, UploadFile
-from fastapi.responses import FileResponse, PlainTextResponse
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Request, UploadFile, WebSocket
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 
+from app.core.admission import admission
+from app.core.executors import run_stage, stage_stats
+from app.core.metrics import render_metrics
+from app.core.readiness import readiness
 from app.core.paths import APP_ROOT, SESSIONS_DIR
-from app.core.session_state import SessionState, save_state
-from app.repositories.db_repo import db_add_session, db_get_messages_json
-from app.services.interview import handle_answer_audio
+from app.core.session_state import SessionState
+from app.core.session_store import session_store
+from app.repositories.db_repo import db_add_session, db_get_messages_json, db_sync_messages
+from app.repositories.message_writer import message_writer
+from app.services.asr_cache import get_asr_cache
+from app.services.asr_models import asr_pool_stats
+from app.services.asr_scheduler import get_asr_scheduler
+from app.services.asr_workers import ASR_BACKEND, get_asr_fleet
+from app.services.answer_stream import handle_answer_stream
+from app.services.catalog import reload_catalog
+from app.services.idempotency import idempotency_registry
+from app.services.interview import handle_answer_audio, handle_answer_upload
+from app.services.ollama_client import get_ollama_client
+from app.services.scoring_cache import get_scoring_cache
+from app.services.scoring_queue import get_scoring_queue, poll_session_scores, stream_session_scores
 from app.services.session_bootstrap import create_first_question
 router = APIRouter()
 
+# token per gli endpoint /admin (header X-Admin-Token); senza token gli endpoint sono disabilitati
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# opt-in esplicito: senza token accetta le richieste da localhost
+# (da non usare dietro un reverse proxy locale, dove ogni richiesta arriva da loopback)
+ADMIN_ALLOW_LOOPBACK = os.getenv("ADMIN_ALLOW_LOOPBACK", "0") == "1"
+_LOOPBACK = {"127.0.0.1", "::1", "localhost"}
+
+
+def require_admin(request: Request, x_admin_token: str | None = Header(default=None)) -> None:
+    if ADMIN_TOKEN:
+        if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+            raise HTTPException(status_code=401, detail="Token amministratore mancante o errato.")
+        return
+    if not ADMIN_ALLOW_LOOPBACK:
+        raise HTTPException(status_code=403, detail="Endpoint amministrativi disabilitati: impostare ADMIN_TOKEN.")
+    host = request.client.host if request.client else None
+    if host not in _LOOPBACK:
+        raise HTTPException(status_code=403, detail="Endpoint amministrativo disponibile solo da localhost.")
+
 
 @router.get("/", response_class=PlainTextResponse)
 def healthcheck():
     return "OK"
 
 
+@router.get("/ready")
+def ready():
+    snapshot = readiness.snapshot()
+    snapshot["asr_pools"] = [
+        {k: p[k] for k in ("model_name", "device", "compute_type", "pool_size", "loaded")}
+        for p in asr_pool_stats()
+    ]
+    return JSONResponse(snapshot, status_code=200 if snapshot["ready"] else 503)
+
+
 @router.get("/app")
 def web_app():
     return FileResponse(APP_ROOT / "app" / "web" / "index.html")
 
 
+@router.get("/asr/models")
+def asr_models():
+    return {
+        "pools": asr_pool_stats(),
+        "scheduler": get_asr_scheduler().stats(),
+        "cache": get_asr_cache().stats(),
+        "backend": ASR_BACKEND,
+        "workers": get_asr_fleet().stats() if ASR_BACKEND == "workers" else None,
+    }
+
+
+@router.post("/admin/catalog/reload", dependencies=[Depends(require_admin)])
+def catalog_reload():
+    catalog = reload_catalog()
+    return {
+        "protocols": catalog.protocols(),
+        "steps": len(catalog.by_key),
+    }
+
+
+@router.get("/stages")
+def stages():
+    return {
+        **stage_stats(),
+        "message_writer": message_writer.stats(),
+        "session_store": session_store.stats(),
+        "idempotency": idempotency_registry.stats(),
+        "admission": admission.stats(),
+    }
+
+
+@router.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/llm")
+def llm_stats():
+    return {
+        "client": get_ollama_client().stats(),
+        "scoring_queue": get_scoring_queue().stats(),
+        "scoring_cache": get_scoring_cache().stats(),
+    }
+
+
+
 @router.get("/sessions/{session_id}/messages")
-def get_messages(session_id: str):
-    return db_get_messages_json(session_id)
+async def get_messages(
+    session_id: str,
+    after_id: int | None = None,
+    limit: int | None = None,
+    format: str = "json",
+    if_none_match: str | None = Header(default=None),
+):
+    # letture SQLite (e attesa del write-behind) sullo stage db, con limite e timeout propri
+    return await run_stage(
+        "db",
+        db_get_messages_json,
+        session_id,
+        after_id=after_id,
+        limit=limit,
+        if_none_match=if_none_match,
+        fmt="ndjson" if format == "ndjson" else "json",
+    )
 
 
 @router.post("/sessions")
-def create_session(lang: str = "it"):
+async def create_session(lang: str = "it"):
     protocol = "mmse_v1"
 
-    session_id = uuid.uuid4().hex
-    session_dir = SESSIONS_DIR / session_id
-    session_dir.mkdir(parents=True, exist_ok=True)
+    # le nuove sessioni cedono il passo a quelle già in corso
+    async with admission.admit("create"):
+        session_id = uuid.uuid4().hex
+        session_dir = SESSIONS_DIR / session_id
+        await run_stage("io", session_dir.mkdir, parents=True, exist_ok=True)
+
+        state = SessionState(protocol=protocol, current_step=0, completed=False)
+        await run_stage("io", session_store.create, session_dir, state)
+
+        await db_add_session(session_id, protocol)
 
-    state = SessionState(protocol=protocol, current_step=0, completed=False)
-    save_state(session_dir, state)
+        first = create_first_question(
+            session_id=session_id,
+            lang=lang,
+            session_dir=session_dir,
+        )
+        await run_stage("db", db_sync_messages)
+        return first
 
-    db_add_session(session_id, protocol)
 
-    return create_first_question(
+@router.post("/sessions/{session_id}/answer_audio")
+async def answer_audio(
+    session_id: str,
+    file: UploadFile = File(...),
+    language: str = "it",
+    idempotency_key: str | None = Header(default=None),
+):
+    return await handle_answer_audio(
         session_id=session_id,
-        lang=lang,
-        session_dir=session_dir,
+        file=file,
+        language=language,
+        idempotency_key=idempotency_key,
     )
 
-@router.post("/sessions/{session_id}/answer_audio")
-async def answer_audio(session_id: str, file: UploadFile = File(...), language: str = "it"):
-    return await handle_answer_audio(session_id=session_id, file=file, language=language)
\ No newline at end of file
+
+@router.post("/sessions/{session_id}/answer_audio_raw")
+async def answer_audio_raw(
+    session_id: str,
+    request: Request,
+    language: str = "it",
+    suffix: str | None = None,
+    idempotency_key: str | None = Header(default=None),
+):
+    return await handle_answer_upload(
+        session_id=session_id,
+        request=request,
+        language=language,
+        suffix=suffix,
+        idempotency_key=idempotency_key,
+    )
+
+
+@router.websocket("/sessions/{session_id}/answer_stream")
+async def answer_stream(websocket: WebSocket, session_id: str, language: str = "it", encoding: str = "container"):
+    await handle_answer_stream(websocket, session_id=session_id, language=language, encoding=encoding)
+
+
+@router.get("/sessions/{session_id}/scores")
+async def get_scores(session_id: str, wait: float = 0.0):
+    return await poll_session_scores(session_id, wait=wait)
+
+
+@router.websocket("/sessions/{session_id}/scores/ws")
+async def scores_ws(websocket: WebSocket, session_id: str):
+    await stream_session_scores(websocket, session_id)
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from fastapi import HTTPException
+
+from app.core.executors import get_stage_executor
+from app.core.metrics import REGISTRY
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_MAX_ACTIVE = _env_int("ADMISSION_MAX_ACTIVE", 8)
+ADMISSION_MAX_QUEUE = _env_int("ADMISSION_MAX_QUEUE", 32)
+ADMISSION_QUEUE_TIMEOUT_S = _env_float("ADMISSION_QUEUE_TIMEOUT_S", 10.0)
+
+# classe -> (priorità: più bassa = prima, richieste attive ammesse)
+# answer: sessioni già in corso, hanno la precedenza sulle nuove (create)
+# partial: trascrizioni provvisorie dello streaming, cedono il passo a tutto il resto
+ADMISSION_CLASSES: Dict[str, Tuple[int, int]] = {
+    "answer": (0, _env_int("ADMISSION_ANSWER_MAX_ACTIVE", ADMISSION_MAX_ACTIVE)),
+    "create": (1, _env_int("ADMISSION_CREATE_MAX_ACTIVE", max(1, ADMISSION_MAX_ACTIVE // 2))),
+    "partial": (2, _env_int("ADMISSION_PARTIAL_MAX_ACTIVE", max(1, ADMISSION_MAX_ACTIVE // 4))),
+}
+
+# stage -> massimo di richieste in attesa sull'executor prima di rifiutare subito (503)
+ADMISSION_STAGE_MAX_WAITING: Dict[str, int] = {
+    "asr": _env_int("ADMISSION_ASR_MAX_WAITING", 16),
+}
+
+
+ADMISSION_REJECTED = REGISTRY.counter("screening_admission_rejected_total", "Richieste rifiutate", ("reason",))
+
+
+class _Waiter:
+    __slots__ = ("cls", "fut", "enqueued_at", "active")
+
+    def __init__(self, cls: str, fut: asyncio.Future):
+        self.cls = cls
+        self.fut = fut
+        self.enqueued_at = time.perf_counter()
+        self.active = True
+
+
+class AdmissionController:
+    """
+    Controllo di ammissione davanti alla pipeline delle risposte.
+    - limite globale e per classe di richieste attive
+    - coda d'attesa limitata, ordinata per priorità (sessioni in corso prima delle nuove)
+    - rifiuto immediato con Retry-After: 429 se la coda è piena, 503 se l'attesa
+      scade o uno stage a valle (es. asr) ha già troppo arretrato
+    """
+
+    def __init__(
+        self,
+        max_active: int = ADMISSION_MAX_ACTIVE,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout_s: float = ADMISSION_QUEUE_TIMEOUT_S,
+        classes: Dict[str, Tuple[int, int]] = ADMISSION_CLASSES,
+        stage_max_waiting: Dict[str, int] = ADMISSION_STAGE_MAX_WAITING,
+    ):
+        self.max_active = max(1, max_active)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout_s = queue_timeout_s
+        self.classes = dict(classes)
+        self.stage_max_waiting = dict(stage_max_waiting)
+
+        self._active: Dict[str, int] = {c: 0 for c in self.classes}
+        self._heap: List[Tuple[int, int, _Waiter]] = []
+        self._queued: Dict[str, int] = {c: 0 for c in self.classes}
+        self._seq = itertools.count()
+
+        self.admitted: Dict[str, int] = {c: 0 for c in self.classes}
+        self.rejected: Dict[str, int] = {"queue_full": 0, "queue_timeout": 0, "stage_overload": 0, "preempted": 0}
+        self.wait_s_sum = 0.0
+        self.wait_s_max = 0.0
+        self.service_s_sum = 0.0
+        self.completed = 0
+
+    def _total_active(self) -> int:
+        return sum(self._active.values())
+
+    def _can_run(self, cls: str) -> bool:
+        return self._total_active() < self.max_active and self._active[cls] < self.classes[cls][1]
+
+    def _retry_after(self) -> int:
+        avg_service = (self.service_s_sum / self.completed) if self.completed else 5.0
+        ahead = sum(self._queued.values()) + 1
+        return max(1, math.ceil(avg_service * ahead / self.max_active))
+
+    def _reject(self, status: int, reason: str, detail: str) -> HTTPException:
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.inc(reason=reason)
+        return HTTPException(status_code=status, detail=detail, headers={"Retry-After": str(self._retry_after())})
+
+    def _check_stages(self) -> None:
+        for stage, limit in self.stage_max_waiting.items():
+            if get_stage_executor(stage).stats()["waiting"] >= limit:
+                raise self._reject(503, "stage_overload", f"Stage '{stage}' sovraccarico, riprovare più tardi.")
+
+    def _pop_inactive(self) -> None:
+        while self._heap and not self._heap[0][2].active:
+            heapq.heappop(self._heap)
+
+    def _wake(self) -> None:
+        """Ammette in ordine di priorità i waiter che rientrano nei limiti."""
+        skipped = []
+        while self._heap and self._total_active() < self.max_active:
+            entry = heapq.heappop(self._heap)
+            w = entry[2]
+            if not w.active:
+                continue
+            if self._active[w.cls] >= self.classes[w.cls][1]:
+                skipped.append(entry)
+                continue
+            w.active = False
+            self._queued[w.cls] -= 1
+            self._active[w.cls] += 1
+            w.fut.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+
+    def _preempt_lower(self, priority: int) -> bool:
+        """Coda piena: libera un posto rifiutando il waiter con priorità più bassa (se inferiore)."""
+        victim = None
+        for entry in self._heap:
+            w = entry[2]
+            if w.active and entry[0] > priority and (victim is None or entry[:2] > victim[:2]):
+                victim = entry
+        if victim is None:
+            return False
+        w = victim[2]
+        w.active = False
+        self._queued[w.cls] -= 1
+        w.fut.set_exception(self._reject(503, "preempted", "Server occupato, riprovare più tardi."))
+        return True
+
+    async def _acquire(self, cls: str) -> None:
+        priority = self.classes[cls][0]
+        self._check_stages()
+
+        if not self._heap and self._can_run(cls):
+            self._active[cls] += 1
+            self.admitted[cls] += 1
+            return
+
+        queued = sum(self._queued.values())
+        if queued >= self.max_queue and not self._preempt_lower(priority):
+            raise self._reject(429, "queue_full", "Troppe richieste in coda, riprovare più tardi.")
+
+        w = _Waiter(cls, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, (priority, next(self._seq), w))
+        self._queued[cls] += 1
+        self._wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(w.fut), timeout=self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            if w.active:
+                w.active = False
+                self._queued[cls] -= 1
+                self._pop_inactive()
+                raise self._reject(503, "queue_timeout", "Server occupato, riprovare più tardi.")
+            if w.fut.exception() is not None:
+                raise w.fut.exception()
+            # ammesso proprio allo scadere: si procede
+        except asyncio.CancelledError:
+            if w.active:
+                w.active = False
+                self._queued[cls] -= 1
+                self._pop_inactive()
+            elif w.fut.done() and w.fut.exception() is None:
+                self._release(cls)
+            raise
+
+        waited = time.perf_counter() - w.enqueued_at
+        self.wait_s_sum += waited
+        self.wait_s_max = max(self.wait_s_max, waited)
+        self.admitted[cls] += 1
+
+    def _release(self, cls: str) -> None:
+        self._active[cls] -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def admit(self, cls: str) -> AsyncIterator[None]:
+        if not ADMISSION_ENABLED:
+            yield
+            return
+        await self._acquire(cls)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.service_s_sum += time.perf_counter() - t0
+            self.completed += 1
+            self._release(cls)
+
+    def stats(self) -> Dict[str, Any]:
+        admitted = sum(self.admitted.values())
+        return {
+            "enabled": ADMISSION_ENABLED,
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "queue_timeout_s": self.queue_timeout_s,
+            "active": dict(self._active),
+            "queued": dict(self._queued),
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected),
+            "queue_wait_avg_s": (self.wait_s_sum / admitted) if admitted else 0.0,
+            "queue_wait_max_s": self.wait_s_max,
+            "service_avg_s": (self.service_s_sum / self.completed) if self.completed else 0.0,
+            "retry_after_s": self._retry_after(),
+        }
+
+
+admission = AdmissionController()
+
+REGISTRY.gauge("screening_admission_active", "Richieste ammesse in corso", lambda: sum(admission._active.values()))
+REGISTRY.gauge("screening_admission_queued", "Richieste in coda di ammissione", lambda: sum(admission._queued.values()))
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, TypeVar
+
+from fastapi import HTTPException
+
+from app.core.metrics import REGISTRY
+
+T = TypeVar("T")
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+# stage -> (thread, richieste concorrenti ammesse, timeout in secondi)
+# asr: CPU-bound (ctranslate2 rilascia il GIL), pochi thread
+#      (con ASR_BATCH_ENABLED=1 almeno un batch pieno per istanza del pool, vedi asr_whisper)
+# db: letture SQLite (GET /messages) e attese del write-behind dei messaggi
+# io: file di sessione; db e io sono I/O-bound, più thread
+# (l'LLM usa il client HTTP asincrono in ollama_client, senza thread)
+STAGE_DEFAULTS: Dict[str, tuple] = {
+    "asr": (2, 2, 300.0),
+    "decode": (4, 4, 120.0),  # decodifica in streaming durante l'upload
+    "db": (4, 16, 30.0),
+    "io": (4, 16, 30.0),
+}
+
+EXECUTOR_WAIT_SECONDS = REGISTRY.histogram(
+    "screening_executor_wait_seconds", "Attesa di uno slot dello stage executor", ("stage",)
+)
+EXECUTOR_RUN_SECONDS = REGISTRY.histogram(
+    "screening_executor_run_seconds", "Esecuzione nel thread pool dello stage", ("stage",)
+)
+EXECUTOR_TIMEOUTS = REGISTRY.counter("screening_executor_timeouts_total", "Timeout per stage", ("stage",))
+
+
+class StageExecutor:
+    """
+    Thread pool dedicato a uno stage della pipeline, con limite di concorrenza e timeout.
+    Le chiamate bloccanti non occupano mai l'event loop.
+    """
+
+    def __init__(self, name: str, workers: int, max_concurrency: int, timeout_s: float):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout_s = timeout_s
+
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"stage-{name}")
+        self._sem = asyncio.Semaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiting = 0
+        self._completed = 0
+        self._timeouts = 0
+        self._errors = 0
+        self._started = 0
+        self._wait_s_sum = 0.0
+        self._run_s_sum = 0.0
+
+    async def run(self, fn: Callable[..., T], *args: Any, timeout: float | None = None, **kwargs: Any) -> T:
+        timeout = self.timeout_s if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+
+        t_wait = time.perf_counter()
+        with self._lock:
+            self._waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        t_run = time.perf_counter()
+        EXECUTOR_WAIT_SECONDS.observe(t_run - t_wait, stage=self.name)
+        with self._lock:
+            self._in_flight += 1
+            self._wait_s_sum += t_run - t_wait
+        try:
+            # il contesto (trace id, tempi della richiesta) segue la chiamata nel thread
+            ctx = contextvars.copy_context()
+            fut = loop.run_in_executor(self._pool, functools.partial(ctx.run, fn, *args, **kwargs))
+            # nota: allo scadere del timeout il thread termina comunque il suo lavoro,
+            # ma la richiesta viene liberata subito
+            result = await asyncio.wait_for(fut, timeout=timeout)
+        except asyncio.TimeoutError:
+            EXECUTOR_TIMEOUTS.inc(stage=self.name)
+            with self._lock:
+                self._timeouts += 1
+            raise HTTPException(status_code=504, detail=f"Timeout nello stage '{self.name}' ({timeout}s)")
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            ran = time.perf_counter() - t_run
+            EXECUTOR_RUN_SECONDS.observe(ran, stage=self.name)
+            with self._lock:
+                self._in_flight -= 1
+                self._run_s_sum += ran
+                self._started += 1
+            self._sem.release()
+
+        with self._lock:
+            self._completed += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_concurrency": self.max_concurrency,
+                "timeout_s": self.timeout_s,
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+                "completed": self._completed,
+                "timeouts": self._timeouts,
+                "errors": self._errors,
+                # dove va il tempo: attesa del semaforo vs esecuzione nel pool
+                "wait_avg_s": (self._wait_s_sum / self._started) if self._started else 0.0,
+                "run_avg_s": (self._run_s_sum / self._started) if self._started else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_executors: Dict[str, StageExecutor] = {}
+_executors_lock = threading.Lock()
+# minimo di thread e richieste concorrenti imposto da chi usa lo stage (prevale sull'env)
+_stage_min_slots: Dict[str, int] = {}
+
+
+def require_stage_slots(name: str, slots: int) -> None:
+    """
+    Garantisce almeno `slots` thread e richieste concorrenti allo stage.
+    Da chiamare all'import, prima che l'executor venga creato.
+    """
+    with _executors_lock:
+        if name in _executors:
+            raise RuntimeError(f"Stage '{name}' già avviato: require_stage_slots va chiamata prima del primo uso")
+        _stage_min_slots[name] = max(_stage_min_slots.get(name, 0), slots)
+
+
+def get_stage_executor(name: str) -> StageExecutor:
+    """Config via env, es. STAGE_ASR_WORKERS, STAGE_ASR_CONCURRENCY, STAGE_ASR_TIMEOUT_S."""
+    with _executors_lock:
+        ex = _executors.get(name)
+        if ex is None:
+            workers, concurrency, timeout_s = STAGE_DEFAULTS[name]
+            prefix = f"STAGE_{name.upper()}"
+            min_slots = _stage_min_slots.get(name, 0)
+            ex = StageExecutor(
+                name,
+                workers=max(min_slots, _env_int(f"{prefix}_WORKERS", workers)),
+                max_concurrency=max(min_slots, _env_int(f"{prefix}_CONCURRENCY", concurrency)),
+                timeout_s=_env_float(f"{prefix}_TIMEOUT_S", timeout_s),
+            )
+            _executors[name] = ex
+    return ex
+
+
+async def run_stage(name: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    return await get_stage_executor(name).run(fn, *args, **kwargs)
+
+
+def stage_stats() -> Dict[str, Dict[str, Any]]:
+    with _executors_lock:
+        return {name: ex.stats() for name, ex in _executors.items()}
+
+
+def shutdown_executors() -> None:
+    with _executors_lock:
+        for ex in _executors.values():
+            ex.shutdown()
+        _executors.clear()
@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+import json
+from typing import Any
+
+try:  # opzionale: encoder nativo molto più veloce
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Serializzazione JSON compatta in un solo passaggio (orjson se disponibile)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: niente fork, un solo processo
+    fcntl = None
+
+# impostato da app.serve quando avvia più worker sullo stesso DATA_ROOT
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "1"))
+MULTIPROCESS = SERVE_WORKERS > 1
+# intervallo di polling per i lock tenuti a lungo (un turno intero) senza bloccare l'event loop
+FILE_LOCK_POLL_S = float(os.getenv("FILE_LOCK_POLL_S", "0.05"))
+
+
+@contextmanager
+def file_lock(path: Path, shared: bool = False) -> Iterator[None]:
+    """
+    Lock consultivo tra processi (flock) su un file di lock dedicato.
+    Serializza le sezioni critiche su file condivisi tra worker (es. state.json).
+    """
+    if fcntl is None:
+        yield
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def try_file_lock(path: Path) -> int | None:
+    """
+    flock esclusivo non bloccante. Ritorna il fd da passare a release_file_lock,
+    oppure None se il lock è tenuto da un altro processo (o da un altro fd dello
+    stesso processo). Il kernel lo rilascia se il processo muore.
+    La directory deve esistere (FileNotFoundError altrimenti).
+    """
+    fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is None:
+        return fd
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def release_file_lock(fd: int) -> None:
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+async def acquire_file_lock(path: Path, timeout_s: float, poll_s: float = FILE_LOCK_POLL_S) -> int | None:
+    """Come try_file_lock ma riprova fino a timeout_s; None se non acquisito in tempo."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max(0.0, timeout_s)
+    while True:
+        fd = try_file_lock(path)
+        if fd is not None:
+            return fd
+        if loop.time() >= deadline:
+            return None
+        await asyncio.sleep(poll_s)
+
+
+def file_version(path: Path) -> tuple | None:
+    """(mtime_ns, size) del file, per validare cache in-process rispetto agli altri worker."""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
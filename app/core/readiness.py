@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# background: il worker accetta connessioni subito e carica i modelli in parallelo
+# sync: carica tutto prima di servire (comportamento precedente); off: al primo uso
+WARMUP_MODE = os.getenv("WARMUP_MODE", "background")
+
+
+class Readiness:
+    """
+    Stato dei componenti pesanti (modelli ASR, ...) per /ready.
+    Liveness (/) risponde sempre; readiness solo quando tutti i componenti
+    richiesti sono caricati.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._components: Dict[str, Dict[str, Any]] = {}
+        self._thread: threading.Thread | None = None
+
+    def register(self, name: str, required: bool = True) -> None:
+        with self._lock:
+            self._components.setdefault(
+                name, {"status": "pending", "required": required, "load_s": None, "error": None}
+            )
+
+    def _set(self, name: str, **fields: Any) -> None:
+        with self._lock:
+            self._components.setdefault(
+                name, {"status": "pending", "required": True, "load_s": None, "error": None}
+            ).update(fields)
+
+    def mark_ready(self, name: str, load_s: float | None = None) -> None:
+        self._set(name, status="ready", load_s=None if load_s is None else round(load_s, 3), error=None)
+
+    def run_task(self, name: str, fn: Callable[[], Any]) -> bool:
+        self._set(name, status="loading")
+        t0 = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            logger.exception("warm-up di %s fallito", name)
+            self._set(name, status="failed", error=str(e), load_s=round(time.perf_counter() - t0, 3))
+            return False
+        self.mark_ready(name, time.perf_counter() - t0)
+        return True
+
+    def warmup(self, tasks: List[Tuple[str, Callable[[], Any]]], mode: str = WARMUP_MODE) -> None:
+        for name, _ in tasks:
+            self.register(name)
+
+        if mode == "off":
+            # caricamento al primo uso: il worker è pronto subito
+            for name, _ in tasks:
+                self._set(name, status="lazy")
+            return
+
+        def _run() -> None:
+            for name, fn in tasks:
+                self.run_task(name, fn)
+
+        if mode == "sync":
+            _run()
+            return
+
+        self._thread = threading.Thread(target=_run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def is_ready(self) -> bool:
+        with self._lock:
+            return all(
+                c["status"] in ("ready", "lazy") for c in self._components.values() if c["required"]
+            )
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            components = {k: dict(v) for k, v in self._components.items()}
+        return {
+            "ready": all(c["status"] in ("ready", "lazy") for c in components.values() if c["required"]),
+            "components": components,
+        }
+
+
+readiness = Readiness()
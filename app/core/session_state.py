@@ -1,10 +1,15 @@
 from __future__ import annotations
 
 import json
+import os
+import threading
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List
+
+# fsync dopo ogni append del turn log (durabilità vs latenza)
+TURN_LOG_FSYNC = os.getenv("TURN_LOG_FSYNC", "0") == "1"
 
 
 def utc_now_iso() -> str:
@@ -16,12 +21,14 @@ class SessionState:
     protocol: str
     current_step: int
     completed: bool
+    version: int = 0  # incrementata a ogni scrittura (compare-and-swap)
 
     def to_dict(self) -> Dict[str, Any]:
         return {
             "protocol": self.protocol,
             "current_step": self.current_step,
             "completed": self.completed,
+            "version": self.version,
         }
 
     @staticmethod
@@ -30,6 +37,7 @@ class SessionState:
             protocol=str(d.get("protocol", "mmse_v1")),
             current_step=int(d.get("current_step", 0)),
             completed=bool(d.get("completed", False)),
+            version=int(d.get("version", 0)),
         )
 
 
@@ -38,9 +46,15 @@ def state_path(session_dir: Path) -> Path:
 
 
 def turns_path(session_dir: Path) -> Path:
+    # formato legacy: array JSON riscritto a ogni turno
     return session_dir / "turns.json"
 
 
+def turns_log_path(session_dir: Path) -> Path:
+    # append-only, un turno per riga (JSON Lines)
+    return session_dir / "turns.jsonl"
+
+
 def load_state(session_dir: Path) -> SessionState:
     p = state_path(session_dir)
     if not p.exists():
@@ -49,26 +63,65 @@ def load_state(session_dir: Path) -> SessionState:
 
 
 def save_state(session_dir: Path, state: SessionState) -> None:
-    state_path(session_dir).write_text(
+    # write + rename atomico: un lettore non vede mai un file a metà
+    p = state_path(session_dir)
+    tmp = p.with_suffix(f".json.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(
         json.dumps(state.to_dict(), ensure_ascii=False, indent=2),
         encoding="utf-8",
     )
+    os.replace(tmp, p)
+
+
+# lock a strisce: numero fisso indipendente dalle sessioni viste (collisioni solo serializzano)
+TURN_LOG_LOCK_STRIPES = max(1, int(os.getenv("TURN_LOG_LOCK_STRIPES", "64")))
+_append_locks: List[threading.Lock] = [threading.Lock() for _ in range(TURN_LOG_LOCK_STRIPES)]
+
+
+def _append_lock(path: Path) -> threading.Lock:
+    return _append_locks[hash(str(path)) % len(_append_locks)]
+
+
+def iter_turns(session_dir: Path) -> Iterator[Dict[str, Any]]:
+    """Lettura in streaming: eventuale turns.json legacy, poi il log turns.jsonl."""
+    legacy = turns_path(session_dir)
+    if legacy.exists():
+        yield from json.loads(legacy.read_text(encoding="utf-8"))
+
+    log = turns_log_path(session_dir)
+    if not log.exists():
+        return
+    with log.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # riga finale troncata da un crash durante l'append
+                continue
 
 
 def load_turns(session_dir: Path) -> List[Dict[str, Any]]:
-    p = turns_path(session_dir)
-    if not p.exists():
-        return []
-    return json.loads(p.read_text(encoding="utf-8"))
+    return list(iter_turns(session_dir))
 
 
 def append_turn(session_dir: Path, turn: Dict[str, Any]) -> None:
-    turns = load_turns(session_dir)
-    turns.append(turn)
-    turns_path(session_dir).write_text(
-        json.dumps(turns, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    """Append atomico di una riga (O_APPEND, una sola write), O(1) per turno."""
+    path = turns_log_path(session_dir)
+    data = (json.dumps(turn, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+    with _append_lock(path):
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            written = os.write(fd, data)
+            while written < len(data):
+                written += os.write(fd, data[written:])
+            if TURN_LOG_FSYNC:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
 
 
 def basic_text_features(text: str) -> Dict[str, Any]:
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager, nullcontext
+from dataclasses import replace
+from pathlib import Path
+from typing import AsyncIterator, Dict, Tuple
+
+from fastapi import HTTPException
+
+from app.core.interprocess import MULTIPROCESS, acquire_file_lock, file_lock, file_version, release_file_lock
+from app.core.session_state import SessionState, load_state, save_state, state_path
+
+SESSION_CACHE_MAX = int(os.getenv("SESSION_CACHE_MAX", "10000"))
+# quanto una seconda risposta per la stessa sessione attende la prima prima del 409
+SESSION_TURN_WAIT_S = float(os.getenv("SESSION_TURN_WAIT_S", "30"))
+
+
+class StateConflict(Exception):
+    pass
+
+
+class SessionStore:
+    """
+    Cache in-process di state.json con versione ottimistica.
+    Le letture sul percorso caldo non toccano il filesystem; le scritture sono
+    compare-and-swap sulla versione e persistite con write+rename atomico.
+    Con più worker (multiprocess) la cache è validata con uno stat di state.json
+    e il compare-and-swap rilegge il file sotto flock, così qualsiasi worker può
+    servire qualsiasi sessione.
+    """
+
+    def __init__(self, max_entries: int = SESSION_CACHE_MAX, multiprocess: bool = MULTIPROCESS):
+        self.max_entries = max_entries
+        self.multiprocess = multiprocess
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, SessionState]" = OrderedDict()
+        self._file_versions: Dict[str, tuple | None] = {}
+        self._turn_locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+
+    def _remember(self, key: str, state: SessionState, session_dir: Path | None = None) -> None:
+        self._cache[key] = state
+        self._cache.move_to_end(key)
+        if self.multiprocess and session_dir is not None:
+            self._file_versions[key] = file_version(state_path(session_dir))
+        while len(self._cache) > self.max_entries:
+            old_key, _ = self._cache.popitem(last=False)
+            self._file_versions.pop(old_key, None)
+
+    def _fresh(self, key: str, session_dir: Path) -> bool:
+        if not self.multiprocess:
+            return True
+        return self._file_versions.get(key) == file_version(state_path(session_dir))
+
+    def is_cached(self, session_dir: Path) -> bool:
+        with self._lock:
+            return str(session_dir) in self._cache
+
+    def get(self, session_dir: Path) -> SessionState:
+        """Copia dello stato corrente (le modifiche vanno salvate con compare_and_swap)."""
+        key = str(session_dir)
+        with self._lock:
+            state = self._cache.get(key)
+            if state is not None and self._fresh(key, session_dir):
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return replace(state)
+            self.misses += 1
+            state = load_state(session_dir)
+            self._remember(key, state, session_dir)
+            return replace(state)
+
+    def create(self, session_dir: Path, state: SessionState) -> SessionState:
+        with self._lock:
+            state = replace(state, version=0)
+            save_state(session_dir, state)
+            self._remember(str(session_dir), state, session_dir)
+            return replace(state)
+
+    def compare_and_swap(self, session_dir: Path, expected_version: int, new_state: SessionState) -> SessionState:
+        """Scrive new_state solo se la versione corrente è expected_version; altrimenti StateConflict."""
+        key = str(session_dir)
+        with self._lock, self._state_lock(session_dir):
+            current = self._cache.get(key)
+            if current is None or self.multiprocess:
+                # un altro worker può aver scritto: si confronta con il file
+                current = load_state(session_dir)
+            if current.version != expected_version:
+                self.conflicts += 1
+                self._remember(key, current, session_dir)
+                raise StateConflict(
+                    f"state version {current.version} != expected {expected_version}"
+                )
+            stored = replace(new_state, version=expected_version + 1)
+            save_state(session_dir, stored)
+            self._remember(key, stored, session_dir)
+            return replace(stored)
+
+    def _state_lock(self, session_dir: Path):
+        if not self.multiprocess:
+            return nullcontext()
+        return file_lock(session_dir / "state.lock")
+
+    @asynccontextmanager
+    async def turn(self, session_dir: Path, wait_s: float = SESSION_TURN_WAIT_S) -> AsyncIterator[None]:
+        """
+        Serializza i turni della stessa sessione: una seconda risposta concorrente
+        attende (in coda) fino a wait_s, poi viene rifiutata con 409.
+        Oltre al lock in-process si tiene un flock su sessions/<id>/turn.lock per
+        tutto il turno, così due worker non elaborano la stessa sessione insieme
+        (file raw/out dello step, ASR, scoring).
+        """
+        key = str(session_dir)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait_s
+        with self._lock:
+            lock, refs = self._turn_locks.get(key, (None, 0))
+            if lock is None:
+                lock = asyncio.Lock()
+            self._turn_locks[key] = (lock, refs + 1)
+
+        busy = HTTPException(
+            status_code=409,
+            detail="Un'altra risposta per questa sessione è ancora in elaborazione.",
+        )
+        try:
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout=wait_s)
+            except asyncio.TimeoutError:
+                raise busy
+            try:
+                try:
+                    fd = await acquire_file_lock(session_dir / "turn.lock", deadline - loop.time())
+                except FileNotFoundError:
+                    raise HTTPException(status_code=404, detail="Session not found. Create session first.")
+                if fd is None:
+                    raise busy
+                try:
+                    yield
+                finally:
+                    release_file_lock(fd)
+            finally:
+                lock.release()
+        finally:
+            with self._lock:
+                lock, refs = self._turn_locks[key]
+                if refs <= 1:
+                    del self._turn_locks[key]
+                else:
+                    self._turn_locks[key] = (lock, refs - 1)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "cached": len(self._cache),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "conflicts": self.conflicts,
+                "active_turns": len(self._turn_locks),
+                "multiprocess": self.multiprocess,
+            }
+
+
+session_store = SessionStore()
@@ -1,11 +1,24 @@
 from __future__ import annotations
 
-from fastapi import FastAPI
+import os
+import re
+import time
+
+from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 
 from app.api.routes import router
+from app.core.executors import shutdown_executors
+from app.core.metrics import REGISTRY, start_trace
 from app.core.paths import DATA_ROOT, SESSIONS_DIR, ensure_dirs
-from app.db import init_db
+from app.core.readiness import readiness
+from app.db import dispose_engines, init_db
+from app.repositories.message_writer import message_writer
+from app.services.asr_models import warmup_asr_models
+from app.services.asr_workers import ASR_BACKEND, shutdown_asr_fleet, warmup_asr_fleet
+from app.services.catalog import reload_catalog
+from app.services.ollama_client import close_ollama_client
+from app.services.scoring_queue import get_scoring_queue
 
 app = FastAPI(title="AI Cognitive Screening Backend (MVP)")
 
@@ -16,9 +29,54 @@ app.mount("/files", StaticFiles(directory=str(SESSIONS_DIR)), name="files")
 
 app.include_router(router)
 
+HTTP_REQUESTS = REGISTRY.counter("screening_http_requests_total", "Richieste HTTP", ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram("screening_http_request_seconds", "Durata richieste HTTP", ("route",))
+_TRACE_ID_RE = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # trace id dal client (se valido) o generato; lega tempi, meta.json e log della richiesta
+    incoming = request.headers.get("x-trace-id", "")
+    trace_id = start_trace(incoming if _TRACE_ID_RE.fullmatch(incoming) else None)
+
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        # template del path (non il path concreto) per non esplodere la cardinalità
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_REQUESTS.inc(method=request.method, route=route, status=str(status))
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - t0, route=route)
+    response.headers["X-Trace-Id"] = trace_id
+    return response
+
 
 @app.on_event("startup")
 def on_startup():
     init_db()
+    reload_catalog()
+    readiness.mark_ready("catalog")
+    # modelli in background (WARMUP_MODE): "/" risponde subito, "/ready" quando sono caricati
+    readiness.warmup([("asr", warmup_asr_fleet if ASR_BACKEND == "workers" else warmup_asr_models)])
+
+
+@app.on_event("startup")
+async def start_background_scoring():
+    queue = get_scoring_queue()
+    queue.start()
+    # con più worker solo uno riprende i job pending (vedi app.serve)
+    if os.getenv("SCORING_RECOVER", "1") == "1":
+        await queue.recover()
+
 
-    
\ No newline at end of file
+@app.on_event("shutdown")
+async def on_shutdown():
+    await get_scoring_queue().stop()
+    await close_ollama_client()
+    message_writer.stop()
+    await dispose_engines()
+    shutdown_executors()
+    shutdown_asr_fleet()
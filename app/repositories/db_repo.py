@@ -1,92 +1,171 @@
 from __future__ import annotations
 
+import hashlib
+import logging
+import os
+from typing import Iterator
+
 from fastapi import HTTPException
-from fastapi.responses import JSONResponse
-import json
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import func, select
+
+from app.core.fastjson import dumps_bytes
+from app.core.interprocess import MULTIPROCESS
+from app.core.metrics import timed
 
-from app.db import SessionLocal
+from app.db import SessionLocal, get_async_sessionmaker
 from app.models import SessionDB, MessageDB, PromptAssetDB
+from app.repositories.message_writer import message_writer
 
+logger = logging.getLogger(__name__)
 
-def db_add_session(session_id: str, protocol: str) -> None:
-    db = SessionLocal()
-    try:
+
+async def db_add_session(session_id: str, protocol: str) -> None:
+    # sessione asincrona (aiosqlite / asyncpg): il commit non occupa un thread dello stage db
+    async with get_async_sessionmaker()() as db:
         db.add(SessionDB(id=session_id, protocol=protocol))
-        db.commit()
-    finally:
-        db.close()
+        with timed("db.commit_session"):
+            await db.commit()
 
 
 def db_add_message(session_id: str, role: str, text: str, audio_url: str | None = None) -> None:
-    db = SessionLocal()
-    try:
-        db.add(MessageDB(session_id=session_id, role=role, text=text, audio_url=audio_url))
-        db.commit()
-    finally:
-        db.close()
-
+    # write-behind: scritto a batch dal message_writer
+    message_writer.enqueue(session_id, role, text, audio_url)
+
+
+MESSAGES_MAX_LIMIT = 1000
+# attesa massima del write-behind prima di leggere i messaggi (poi 503, lo slot dello stage db viene liberato)
+MESSAGES_FLUSH_TIMEOUT_S = float(os.getenv("MESSAGES_FLUSH_TIMEOUT_S", "5"))
+
+
+def db_sync_messages() -> bool:
+    """
+    Con più worker (SERVE_WORKERS>1) il GET /messages può arrivare a un processo che
+    non vede la coda del write-behind di questo: i messaggi accodati vengono
+    committati prima di rispondere. Con un solo processo basta il flush in lettura.
+    """
+    if not MULTIPROCESS:
+        return True
+    with timed("db.flush_wait"):
+        flushed = message_writer.flush(timeout=MESSAGES_FLUSH_TIMEOUT_S)
+    if not flushed:
+        # il turno è già registrato: non si fallisce la risposta, i messaggi arrivano a breve
+        logger.warning("messaggi non committati entro %.1fs", MESSAGES_FLUSH_TIMEOUT_S)
+    return flushed
+
+_MESSAGE_COLUMNS = (
+    MessageDB.id,
+    MessageDB.role,
+    MessageDB.text,
+    MessageDB.audio_url,
+    MessageDB.created_at,
+)
+
+
+def _message_row_to_dict(r) -> dict:
+    return {
+        "id": r.id,
+        "role": r.role,
+        "text": r.text,
+        "audio_url": r.audio_url,
+        "created_at": r.created_at.isoformat(),
+    }
+
+
+def _messages_query(session_id: str, after_id: int | None, limit: int | None):
+    stmt = select(*_MESSAGE_COLUMNS).where(MessageDB.session_id == session_id)
+    if after_id is not None:
+        stmt = stmt.where(MessageDB.id > after_id)
+    stmt = stmt.order_by(MessageDB.id.asc())
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def _messages_etag(db, session_id: str, after_id: int | None, limit: int | None, fmt: str) -> str:
+    # i messaggi sono append-only: max(id) + count identificano il contenuto
+    max_id, count = db.execute(
+        select(func.max(MessageDB.id), func.count(MessageDB.id)).where(MessageDB.session_id == session_id)
+    ).one()
+    raw = f"{session_id}:{after_id}:{limit}:{fmt}:{max_id}:{count}"
+    return 'W/"' + hashlib.sha1(raw.encode("utf-8")).hexdigest() + '"'
+
+
+def db_get_messages_json(
+    session_id: str,
+    after_id: int | None = None,
+    limit: int | None = None,
+    if_none_match: str | None = None,
+    fmt: str = "json",
+) -> Response:
+    """
+    Messaggi della sessione, con paginazione a cursore (after_id, limit),
+    ETag / If-None-Match (304) e modalità NDJSON in streaming (fmt="ndjson").
+    """
+    # read-your-writes: prima scrive i messaggi ancora in coda per questa sessione
+    # (solo la coda di questo processo; con più worker ci pensa db_sync_messages a fine turno)
+    if message_writer.has_pending(session_id):
+        with timed("db.flush_wait"):
+            flushed = message_writer.flush(timeout=MESSAGES_FLUSH_TIMEOUT_S)
+        if not flushed:
+            raise HTTPException(
+                status_code=503,
+                detail="Messaggi in corso di scrittura, riprovare.",
+                headers={"Retry-After": "1"},
+            )
+
+    if limit is not None:
+        limit = max(1, min(limit, MESSAGES_MAX_LIMIT))
 
-def db_get_messages_json(session_id: str) -> JSONResponse:
     db = SessionLocal()
     try:
-        rows = (
-            db.query(MessageDB)
-            .filter(MessageDB.session_id == session_id)
-            .order_by(MessageDB.id.asc())
-            .all()
-        )
-
-        data = {
-            "session_id": session_id,
-            "messages": [
-                {
-                    "id": r.id,
-                    "role": r.role,
-                    "text": r.text,
-                    "audio_url": r.audio_url,
-                    "created_at": r.created_at.isoformat(),
-                }
-                for r in rows
-            ],
-        }
-
-        # JSON leggibile (indentato), stesso comportamento di prima
-        return JSONResponse(content=json.loads(json.dumps(data, indent=2)))
+        etag = _messages_etag(db, session_id, after_id, limit, fmt)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        if fmt == "ndjson":
+            return StreamingResponse(
+                _iter_messages_ndjson(session_id, after_id, limit),
+                media_type="application/x-ndjson",
+                headers=headers,
+            )
+
+        with timed("db.messages_query"):
+            rows = db.execute(_messages_query(session_id, after_id, limit)).all()
     finally:
         db.close()
 
+    messages = [_message_row_to_dict(r) for r in rows]
+    data = {
+        "session_id": session_id,
+        "messages": messages,
+        "next_after_id": messages[-1]["id"] if (limit is not None and len(messages) == limit) else None,
+    }
+    return Response(content=dumps_bytes(data), media_type="application/json", headers=headers)
+
 
-def db_get_mmse_prompt(protocol: str, lang: str, step: int) -> PromptAssetDB:
+def _iter_messages_ndjson(session_id: str, after_id: int | None, limit: int | None) -> Iterator[bytes]:
     db = SessionLocal()
     try:
-        row = (
-            db.query(PromptAssetDB)
-            .filter_by(protocol=protocol, lang=lang, step=step)
-            .one()
+        result = db.execute(
+            _messages_query(session_id, after_id, limit),
+            execution_options={"yield_per": 500},
         )
-        return row
+        for r in result:
+            yield dumps_bytes(_message_row_to_dict(r)) + b"\n"
     finally:
         db.close()
 
 
-def db_list_mmse_prompts(protocol: str, lang: str) -> list[PromptAssetDB]:
+def db_list_all_prompts() -> list[PromptAssetDB]:
     db = SessionLocal()
     try:
         rows = (
             db.query(PromptAssetDB)
-            .filter_by(protocol=protocol, lang=lang)
-            .order_by(PromptAssetDB.step.asc())
+            .order_by(PromptAssetDB.protocol.asc(), PromptAssetDB.lang.asc(), PromptAssetDB.step.asc())
             .all()
         )
         return rows
     finally:
         db.close()
-
-
-def ensure_mmse_prompts_exist(protocol: str, lang: str) -> None:
-    rows = db_list_mmse_prompts(protocol=protocol, lang=lang)
-    if not rows:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Nessun prompt MMSE trovato nel DB: protocol={protocol} lang={lang}",
-        )
\ No newline at end of file
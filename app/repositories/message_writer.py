@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app.core.metrics import REGISTRY, record_timing
+from app.core.paths import DATA_ROOT
+from app.db import SessionLocal
+from app.models import MessageDB
+
+MESSAGE_FLUSH_INTERVAL_MS = float(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", "50"))
+MESSAGE_FLUSH_MAX_BATCH = int(os.getenv("MESSAGE_FLUSH_MAX_BATCH", "256"))
+MESSAGE_FLUSH_RETRY_S = 0.5
+# dopo questi tentativi falliti lo stesso batch viene scritto riga per riga:
+# le righe rifiutate dal DB (vincoli, dati) finiscono nel dead-letter invece di bloccare la coda
+MESSAGE_WRITE_MAX_ATTEMPTS = int(os.getenv("MESSAGE_WRITE_MAX_ATTEMPTS", "3"))
+MESSAGE_DEAD_LETTER_PATH = Path(os.getenv("MESSAGE_DEAD_LETTER_PATH", str(DATA_ROOT / "messages_deadletter.jsonl")))
+
+MESSAGE_BATCH_SIZE = REGISTRY.histogram(
+    "screening_message_batch_size", "Messaggi per commit del write-behind", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+MESSAGE_WRITE_ERRORS = REGISTRY.counter("screening_message_write_errors_total", "Commit falliti del write-behind")
+MESSAGE_DEAD_LETTERS = REGISTRY.counter("screening_message_dead_letters_total", "Messaggi rifiutati dal DB e spostati nel dead-letter")
+
+
+class MessageWriter:
+    """
+    Write-behind per MessageDB: gli insert vengono accodati e scritti a batch
+    (ogni MESSAGE_FLUSH_INTERVAL_MS o al raggiungimento di MESSAGE_FLUSH_MAX_BATCH)
+    in un'unica transazione. flush() garantisce read-your-writes.
+    Un batch che fallisce MESSAGE_WRITE_MAX_ATTEMPTS volte viene riscritto riga
+    per riga: una riga "avvelenata" va nel dead-letter e non blocca le successive.
+    """
+
+    def __init__(
+        self,
+        interval_ms: float = MESSAGE_FLUSH_INTERVAL_MS,
+        max_batch: int = MESSAGE_FLUSH_MAX_BATCH,
+        max_attempts: int = MESSAGE_WRITE_MAX_ATTEMPTS,
+        dead_letter_path: Path = MESSAGE_DEAD_LETTER_PATH,
+    ):
+        self.interval_s = interval_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.max_attempts = max(1, max_attempts)
+        self.dead_letter_path = dead_letter_path
+
+        self._cond = threading.Condition()
+        self._pending: List[Dict[str, Any]] = []
+        self._pending_by_session: Counter = Counter()
+        self._enqueued_seq = 0
+        self._committed_seq = 0
+        self._flush_requested = False
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+
+        self.commits = 0
+        self.messages_written = 0
+        self.errors = 0
+        self.dead_lettered = 0
+        self.batch_size_max = 0
+        self.flush_latency_sum_s = 0.0
+        self.flush_latency_max_s = 0.0
+
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, session_id: str, role: str, text: str, audio_url: str | None = None) -> None:
+        self.start()
+        row = {
+            "session_id": session_id,
+            "role": role,
+            "text": text,
+            "audio_url": audio_url,
+            "created_at": datetime.utcnow(),
+        }
+        with self._cond:
+            self._pending.append(row)
+            self._pending_by_session[session_id] += 1
+            self._enqueued_seq += 1
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+
+    def has_pending(self, session_id: str) -> bool:
+        with self._cond:
+            return self._pending_by_session.get(session_id, 0) > 0
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Attende che tutto ciò che è stato accodato finora sia committato."""
+        with self._cond:
+            if self._thread is None:
+                return True
+            target = self._enqueued_seq
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._committed_seq >= target, timeout=timeout)
+
+    def stop(self, timeout: float | None = 10.0) -> None:
+        self.flush(timeout=timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            t = self._thread
+        if t is not None:
+            t.join(timeout=timeout)
+        with self._cond:
+            self._thread = None
+
+    def _run(self) -> None:
+        attempts = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopping or self._flush_requested or len(self._pending) >= self.max_batch,
+                    timeout=self.interval_s,
+                )
+                if self._stopping and not self._pending:
+                    return
+                batch = self._pending[: self.max_batch]
+                self._flush_requested = False
+                if not batch:
+                    continue
+
+            t0 = time.perf_counter()
+            if attempts < self.max_attempts:
+                try:
+                    self._write(batch)
+                except Exception:
+                    MESSAGE_WRITE_ERRORS.inc()
+                    attempts += 1
+                    with self._cond:
+                        self.errors += 1
+                    # restano in coda: riprova al prossimo giro
+                    if attempts < self.max_attempts:
+                        time.sleep(MESSAGE_FLUSH_RETRY_S)
+                    continue
+                done = written = len(batch)
+            else:
+                done, written = self._write_rows(batch)
+                if done == 0:
+                    # errore non legato alle righe (es. DB non raggiungibile): si riprova
+                    time.sleep(MESSAGE_FLUSH_RETRY_S)
+                    continue
+            if done == len(batch):
+                attempts = 0
+            latency = time.perf_counter() - t0
+            record_timing("db.commit_messages", latency)
+            MESSAGE_BATCH_SIZE.observe(written)
+
+            with self._cond:
+                del self._pending[:done]
+                for row in batch[:done]:
+                    self._pending_by_session[row["session_id"]] -= 1
+                    if self._pending_by_session[row["session_id"]] <= 0:
+                        del self._pending_by_session[row["session_id"]]
+                self._committed_seq += done
+                if self._pending:
+                    # altro lavoro (o flush in attesa): prossimo giro subito
+                    self._flush_requested = True
+
+                self.commits += 1
+                self.messages_written += written
+                self.batch_size_max = max(self.batch_size_max, written)
+                self.flush_latency_sum_s += latency
+                self.flush_latency_max_s = max(self.flush_latency_max_s, latency)
+                self._cond.notify_all()
+            if done < len(batch):
+                time.sleep(MESSAGE_FLUSH_RETRY_S)
+
+    def _write_rows(self, batch: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        Scrittura riga per riga di un batch fallito più volte.
+        Ritorna (righe gestite, righe scritte): le righe rifiutate dal DB vanno nel
+        dead-letter; a un errore di altro tipo si ferma e il resto resta in coda.
+        """
+        written = 0
+        for i, row in enumerate(batch):
+            try:
+                self._write([row])
+                written += 1
+            except (IntegrityError, DataError) as e:
+                self._dead_letter(row, e)
+            except Exception:
+                MESSAGE_WRITE_ERRORS.inc()
+                with self._cond:
+                    self.errors += 1
+                return i, written
+        return len(batch), written
+
+    def _dead_letter(self, row: Dict[str, Any], error: Exception) -> None:
+        record = {**row, "created_at": row["created_at"].isoformat(), "error": str(error.orig or error)}
+        self.dead_letter_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.dead_letter_path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        MESSAGE_DEAD_LETTERS.inc()
+        with self._cond:
+            self.dead_lettered += 1
+
+    @staticmethod
+    def _write(batch: List[Dict[str, Any]]) -> None:
+        db = SessionLocal()
+        try:
+            db.execute(insert(MessageDB), batch)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "queue_depth": len(self._pending),
+                "commits": self.commits,
+                "messages_written": self.messages_written,
+                "errors": self.errors,
+                "dead_lettered": self.dead_lettered,
+                "batch_size_avg": (self.messages_written / self.commits) if self.commits else 0.0,
+                "batch_size_max": self.batch_size_max,
+                "flush_latency_avg_s": (self.flush_latency_sum_s / self.commits) if self.commits else 0.0,
+                "flush_latency_max_s": self.flush_latency_max_s,
+            }
+
+
+message_writer = MessageWriter()
+
+REGISTRY.gauge("screening_message_queue_depth", "Messaggi in attesa di commit", lambda: len(message_writer._pending))
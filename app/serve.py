@@ -0,0 +1,201 @@
+"""
+Avvio multi-worker (prefork, solo POSIX).
+
+  python -m app.serve --workers 4 --host 0.0.0.0 --port 8000
+
+Il processo padre:
+  - importa una volta sola app, numpy, PyAV, CTranslate2 e faster-whisper e
+    congela il GC (gc.freeze), così le pagine restano condivise copy-on-write
+  - crea le tabelle SQLite e scarica/risolve i pesi Whisper una volta sola
+    (i worker li caricano dalla cache locale, local_files_only) e li porta
+    nella page cache del kernel, condivisa tra i processi
+  - apre il socket in ascolto e fa fork dei worker, che lo condividono
+  - riavvia i worker che terminano in modo anomalo
+
+Nota: un modello CTranslate2 non si può creare prima del fork (i suoi thread
+pool non sopravvivono al fork), quindi ogni worker istanzia il proprio modello
+dai file già in cache; ASR_CPU_THREADS viene diviso tra i worker.
+Con ASR_BACKEND=workers l'inferenza gira invece in processi ASR dedicati
+(app.services.asr_workers), uno o più per worker HTTP: dimensionare
+ASR_WORKERS/ASR_WORKER_THREADS sul totale dei core.
+
+Stato condiviso tra worker: state.json con compare-and-swap sotto flock,
+turns.jsonl in O_APPEND, SQLite in WAL con busy_timeout, catalogo ricaricato
+tramite data/catalog.version. Un solo worker riprende i job di scoring pending.
+I messaggi (write-behind in coda per processo) vengono committati prima della
+risposta del turno, così GET /messages su un altro worker li vede subito.
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+
+def log(msg: str) -> None:
+    print(f"[serve {os.getpid()}] {msg}", file=sys.stderr, flush=True)
+
+
+def preload_model_files() -> None:
+    """Scarica (se serve) il modello Whisper e ne legge i file: page cache calda per tutti i worker."""
+    from faster_whisper.utils import download_model
+
+    from app.services import asr_models
+    from app.services.asr_models import ASR_MODEL_NAME
+
+    model_dir = Path(download_model(ASR_MODEL_NAME)) if not os.path.isdir(ASR_MODEL_NAME) else Path(ASR_MODEL_NAME)
+    total = 0
+    for p in model_dir.rglob("*"):
+        if p.is_file():
+            with open(p, "rb") as f:
+                while chunk := f.read(16 * 1024 * 1024):
+                    total += len(chunk)
+    log(f"modello {ASR_MODEL_NAME} in page cache ({total / 2**20:.0f} MiB da {model_dir})")
+    # i worker (fork) ereditano il flag: caricano dalla cache senza contattare l'hub
+    asr_models.ASR_LOCAL_FILES_ONLY = True
+
+
+def preload(args) -> object:
+    # librerie pesanti importate nel padre: condivise copy-on-write dai worker
+    for mod in ("numpy", "av", "ctranslate2", "faster_whisper"):
+        try:
+            __import__(mod)
+        except ImportError:
+            log(f"preload: {mod} non disponibile")
+
+    if args.preload_model:
+        try:
+            preload_model_files()
+        except Exception as e:
+            log(f"preload modello fallito ({e}): i worker lo caricheranno da sé")
+
+    from app.db import engine, init_db
+    from app.main import app
+
+    init_db()
+    # nessuna connessione deve attraversare il fork
+    engine.dispose()
+    return app
+
+
+def make_socket(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def cpu_slices(workers: int) -> List[set]:
+    cpus = sorted(os.sched_getaffinity(0))
+    per = max(1, len(cpus) // workers)
+    return [set(cpus[i * per:(i + 1) * per]) or set(cpus) for i in range(workers)]
+
+
+def run_worker(app, sock: socket.socket, index: int, recover: bool, args, cpus: set | None) -> None:
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    os.environ["SERVE_WORKER_INDEX"] = str(index)
+    # i job di scoring pending vanno ripresi da un solo worker, solo al primo avvio
+    os.environ["SCORING_RECOVER"] = "1" if recover else "0"
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+
+    config = uvicorn.Config(app, log_level=args.log_level, timeout_keep_alive=args.keep_alive_s)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server multi-worker con preload condiviso")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--keep-alive-s", type=int, default=5)
+    parser.add_argument("--no-preload-model", dest="preload_model", action="store_false")
+    parser.add_argument("--pin-cpus", action="store_true", help="assegna a ogni worker una fetta dei core")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        raise SystemExit("app.serve richiede fork (Linux/macOS); su Windows usare uvicorn app.main:app")
+
+    workers = max(1, args.workers)
+    # da impostare prima di importare app.*: abilita il coordinamento tra processi
+    os.environ["SERVE_WORKERS"] = str(workers)
+    if "ASR_CPU_THREADS" not in os.environ:
+        os.environ["ASR_CPU_THREADS"] = str(max(1, (os.cpu_count() or 1) // workers))
+
+    app = preload(args)
+    sock = make_socket(args.host, args.port, args.backlog)
+    slices = cpu_slices(workers) if args.pin_cpus else [None] * workers
+
+    gc.collect()
+    gc.freeze()  # oggetti del padre fuori dal GC: meno pagine sporcate dopo il fork
+
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(index: int, recover: bool) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(app, sock, index, recover, args, slices[index])
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = index
+        log(f"worker {index} avviato (pid {pid})")
+
+    def stop(signum, _frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    log(f"{workers} worker su http://{args.host}:{args.port}")
+    for i in range(workers):
+        spawn(i, recover=(i == 0))
+
+    last_restart: Dict[int, float] = {}
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        log(f"worker {index} (pid {pid}) terminato con stato {status}: riavvio")
+        # evita un ciclo di crash troppo rapido
+        since = time.monotonic() - last_restart.get(index, 0.0)
+        if since < 1.0:
+            time.sleep(1.0 - since)
+        last_restart[index] = time.monotonic()
+        spawn(index, recover=False)
+
+    sock.close()
+    log("arrestato")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import io
+import json
+import os
+import re
+import threading
+import time
+import wave
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+
+from app.core.admission import admission
+from app.core.executors import run_stage
+from app.core.metrics import start_trace, timed
+from app.core.paths import SESSIONS_DIR
+from app.core.session_store import session_store
+from app.services.asr_whisper import transcribe_pcm
+from app.services.audio_decode import SAMPLE_RATE, iter_decode_stream
+from app.services.interview import begin_turn, finish_turn, save_raw_audio
+from app.services.upload_stream import ChunkPipe
+
+STREAM_PARTIAL_INTERVAL_S = float(os.getenv("STREAM_PARTIAL_INTERVAL_S", "1.0"))
+STREAM_MAX_BYTES = int(os.getenv("STREAM_MAX_BYTES", str(25 * 1024 * 1024)))
+# segmenti che finiscono entro questo margine dalla fine dell'audio restano provvisori
+STREAM_COMMIT_MARGIN_S = float(os.getenv("STREAM_COMMIT_MARGIN_S", "1.0"))
+# decoder incrementali (un thread dedicato ciascuno) per gli stream "container"
+STREAM_MAX_DECODERS = int(os.getenv("STREAM_MAX_DECODERS", "32"))
+
+# "container": chunk di un file compresso (es. MediaRecorder webm/ogg), decodificati in streaming
+# "pcm16": PCM s16le mono 16 kHz grezzo
+ENCODINGS = ("container", "pcm16")
+
+_decoder_slots = threading.BoundedSemaphore(STREAM_MAX_DECODERS)
+
+
+def _pcm16_to_float(data: bytes) -> np.ndarray:
+    usable = len(data) - (len(data) % 2)
+    return np.frombuffer(data[:usable], dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def _pcm16_to_wav(data: bytes) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(data[: len(data) - (len(data) % 2)])
+    return buf.getvalue()
+
+
+class StreamDecoder:
+    """
+    PCM decodificato incrementalmente dai chunk del WebSocket: ogni byte viene
+    decodificato una sola volta e since(offset) restituisce solo la coda.
+    pcm16 si converte sul posto; un container è letto da un thread dedicato
+    (non dagli stage executor) che attende i chunk su una ChunkPipe.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self.error: Exception | None = None
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._chunks: List[np.ndarray] = []
+        self._starts: List[int] = []
+        self._carry = b""
+        self._pipe: ChunkPipe | None = None
+        self._thread: threading.Thread | None = None
+        self._slot = False
+
+        if encoding == "container":
+            self._slot = _decoder_slots.acquire(blocking=False)
+            if not self._slot:
+                # troppi stream attivi: niente parziali, trascrizione completa a fine turno
+                self.error = RuntimeError("decoder in streaming non disponibili")
+                return
+            self._pipe = ChunkPipe()
+            self._thread = threading.Thread(target=self._run, name="stream-decode", daemon=True)
+            self._thread.start()
+
+    def _append(self, pcm: np.ndarray) -> None:
+        if pcm.size == 0:
+            return
+        with self._lock:
+            self._starts.append(self.samples)
+            self._chunks.append(pcm)
+            self.samples += pcm.size
+
+    def _run(self) -> None:
+        try:
+            for pcm in iter_decode_stream(self._pipe):
+                self._append(pcm)
+        except Exception as e:
+            self.error = e
+        finally:
+            _decoder_slots.release()
+
+    def feed(self, data: bytes) -> None:
+        if self.encoding == "pcm16":
+            data = self._carry + data
+            usable = len(data) - (len(data) % 2)
+            self._carry = data[usable:]
+            self._append(_pcm16_to_float(data[:usable]))
+        elif self.error is None and self._pipe is not None:
+            self._pipe.feed(data)
+
+    def abort(self) -> None:
+        """Stream interrotto: il thread del decoder termina senza attendere altri chunk."""
+        if self._pipe is not None:
+            self._pipe.close_writer()
+
+    def close(self, timeout: float = 30.0) -> bool:
+        """Fine dello stream: attende la coda della decodifica. True se il PCM è completo."""
+        if self._pipe is not None:
+            self._pipe.close_writer()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                return False
+        return self.error is None and self.samples > 0
+
+    def since(self, offset: int) -> np.ndarray:
+        with self._lock:
+            i = max(0, bisect.bisect_right(self._starts, offset) - 1)
+            chunks = self._chunks[i:]
+            first = self._starts[i] if chunks else 0
+        if not chunks:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(chunks)[offset - first:]
+
+
+@dataclass(frozen=True)
+class Committed:
+    """Segmenti già confermati (tempi assoluti) e campioni coperti."""
+
+    segments: Tuple[Dict, ...] = ()
+    samples: int = 0
+
+    @property
+    def text(self) -> str:
+        return " ".join(t for t in (s["text"].strip() for s in self.segments) if t)
+
+
+def _transcribe_tail(decoder: StreamDecoder, committed: Committed, language: str) -> Tuple[List[Dict], Dict, float]:
+    """Trascrive solo l'audio dopo committed.samples; segmenti con tempi assoluti."""
+    tail = decoder.since(committed.samples)
+    if tail.size == 0:
+        return [], {"language": language}, 0.0
+    _, segs, meta = transcribe_pcm(tail, language=language)
+    base_s = committed.samples / SAMPLE_RATE
+    shifted = [{**s, "start": s["start"] + base_s, "end": s["end"] + base_s} for s in segs]
+    return shifted, meta, tail.size / SAMPLE_RATE
+
+
+def _partial_transcript(decoder: StreamDecoder, committed: Committed, language: str) -> Tuple[Committed, str]:
+    """
+    Parziale: trascrive la coda non confermata e conferma i segmenti già chiusi
+    (che finiscono prima di STREAM_COMMIT_MARGIN_S dalla fine), che non verranno
+    più ritrascritti. Ritorna il nuovo stato confermato e il testo provvisorio.
+    """
+    segs, _, tail_s = _transcribe_tail(decoder, committed, language)
+    limit_s = committed.samples / SAMPLE_RATE + tail_s - STREAM_COMMIT_MARGIN_S
+    n = 0
+    while n < len(segs) and segs[n]["end"] <= limit_s:
+        n += 1
+    if n:
+        committed = Committed(
+            segments=committed.segments + tuple(segs[:n]),
+            samples=int(segs[n - 1]["end"] * SAMPLE_RATE),
+        )
+    pending = " ".join(t for t in (s["text"].strip() for s in segs[n:]) if t)
+    return committed, " ".join(t for t in (committed.text, pending) if t)
+
+
+def _final_transcript(decoder: StreamDecoder, committed: Committed, language: str) -> Tuple[str, List[Dict], Dict]:
+    """A fine stream resta da trascrivere solo la coda dopo l'ultimo segmento confermato."""
+    segs, meta, tail_s = _transcribe_tail(decoder, committed, language)
+    segments = list(committed.segments) + segs
+    transcript_text = " ".join(t for t in (s["text"].strip() for s in segments) if t)
+    meta = {
+        **meta,
+        "decoder": "stream",
+        "streamed": {"committed_segments": len(committed.segments), "tail_s": round(tail_s, 3)},
+    }
+    return transcript_text, segments, meta
+
+
+async def handle_answer_stream(websocket: WebSocket, session_id: str, language: str = "it", encoding: str = "container") -> None:
+    """
+    Protocollo:
+      client -> messaggi binari con i chunk audio, poi testo {"type": "end", "suffix": ".webm"}
+      server -> {"type": "partial", "text": ...} durante la registrazione
+                {"type": "final", ...risposta di answer_audio...} a fine turno
+                {"type": "error", "detail": ...} in caso di errore
+    """
+    await websocket.accept()
+    start_trace()
+
+    if encoding not in ENCODINGS:
+        await websocket.send_json({"type": "error", "detail": f"encoding non supportato: {encoding}"})
+        await websocket.close(code=1003)
+        return
+
+    try:
+        ctx = await run_stage("io", begin_turn, session_id, language=language)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "status_code": e.status_code, "detail": e.detail})
+        await websocket.close(code=1008)
+        return
+
+    if isinstance(ctx, dict):
+        await websocket.send_json({"type": "final", **ctx})
+        await websocket.close()
+        return
+
+    buf = bytearray()
+    suffix = ".wav" if encoding == "pcm16" else ".webm"
+    decoder = StreamDecoder(encoding)
+    committed = Committed()
+    partial_task: asyncio.Task | None = None
+    last_partial_at = time.monotonic()
+
+    async def _send_partial() -> None:
+        nonlocal committed
+        try:
+            # priorità più bassa: con il server carico i parziali vengono saltati, le risposte no
+            async with admission.admit("partial"):
+                committed, text = await run_stage("asr", _partial_transcript, decoder, committed, language)
+        except Exception:
+            # sovraccarico o audio non ancora decodificabile: si riprova al chunk successivo
+            return
+        await websocket.send_json({"type": "partial", "text": text})
+
+    try:
+        while True:
+            msg = await websocket.receive()
+            if msg["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(msg.get("code", 1000))
+
+            if msg.get("bytes"):
+                buf.extend(msg["bytes"])
+                if len(buf) > STREAM_MAX_BYTES:
+                    decoder.abort()
+                    await websocket.send_json({"type": "error", "status_code": 413, "detail": "Audio troppo lungo."})
+                    await websocket.close(code=1009)
+                    return
+                decoder.feed(msg["bytes"])
+
+                now = time.monotonic()
+                idle = partial_task is None or partial_task.done()
+                if idle and decoder.error is None and now - last_partial_at >= STREAM_PARTIAL_INTERVAL_S:
+                    last_partial_at = now
+                    partial_task = asyncio.create_task(_send_partial())
+                continue
+
+            if msg.get("text"):
+                try:
+                    control = json.loads(msg["text"])
+                except ValueError:
+                    continue
+                if control.get("type") == "end":
+                    requested = str(control.get("suffix") or "").lower()
+                    if encoding == "container" and re.fullmatch(r"\.[a-z0-9]{1,8}", requested):
+                        suffix = requested
+                    break
+    except WebSocketDisconnect:
+        if partial_task is not None:
+            partial_task.cancel()
+        decoder.abort()
+        return
+
+    # fine parlato: un parziale in corso non serve più (il suo risultato viene scartato)
+    if partial_task is not None and not partial_task.done():
+        partial_task.cancel()
+
+    audio_bytes = _pcm16_to_wav(bytes(buf)) if encoding == "pcm16" else bytes(buf)
+    decoded = await run_stage("io", decoder.close)
+
+    try:
+        async with admission.admit("answer"), session_store.turn(SESSIONS_DIR / session_id):
+            # lo stato può essere avanzato da un altro turno durante la registrazione
+            started_version = ctx.state.version
+            ctx = await run_stage("io", begin_turn, session_id, language=language)
+            if isinstance(ctx, dict) or ctx.state.version != started_version:
+                raise HTTPException(
+                    status_code=409,
+                    detail="Lo stato della sessione è cambiato durante la registrazione.",
+                )
+            transcribed = None
+            if decoded:
+                # i segmenti confermati dai parziali non si ritrascrivono: solo la coda
+                with timed("asr.transcribe"):
+                    transcribed = await run_stage("asr", _final_transcript, decoder, committed, language)
+            input_path = await run_stage("io", save_raw_audio, ctx, audio_bytes, suffix)
+            result = await finish_turn(ctx, input_path, audio_bytes, transcribed=transcribed)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "status_code": e.status_code, "detail": e.detail})
+        await websocket.close(code=1011)
+        return
+
+    await websocket.send_json({"type": "final", **result})
+    await websocket.close()
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.core.paths import DATA_ROOT
+
+ASR_CACHE_ENABLED = os.getenv("ASR_CACHE_ENABLED", "1") == "1"
+ASR_CACHE_DIR = Path(os.getenv("ASR_CACHE_DIR", str(DATA_ROOT / "cache" / "asr")))
+# limite per processo: con app.serve il disco può arrivare a SERVE_WORKERS volte questo valore
+ASR_CACHE_MAX_BYTES = int(os.getenv("ASR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+CachedAsr = Tuple[str, List[Dict], Dict]
+
+
+def asr_cache_key(audio_bytes: bytes, language: str, model_name: str, compute_type: str) -> str:
+    h = hashlib.sha256(audio_bytes).hexdigest()
+    return hashlib.sha256(f"{h}|{language}|{model_name}|{compute_type}".encode("utf-8")).hexdigest()
+
+
+class AsrResultCache:
+    """
+    Cache su disco dei risultati ASR (transcript, segments, meta), con eviction LRU
+    limitata in byte. Un file JSON per entry; l'ordine LRU vive in memoria ed è
+    ricostruito dagli mtime all'avvio.
+    La directory è condivisa tra i worker di app.serve: un'entry assente dall'indice
+    viene cercata su disco e adottata (scritta da un altro worker). Indice e conteggio
+    dei byte restano per processo, quindi max_bytes vale per ciascun worker.
+    """
+
+    def __init__(self, root: Path = ASR_CACHE_DIR, max_bytes: int = ASR_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.adopted = 0
+        self._load_index()
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    def _load_index(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        files = sorted(self.root.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for p in files:
+            size = p.stat().st_size
+            self._entries[p.stem] = size
+            self._total_bytes += size
+
+    def get(self, key: str) -> Optional[CachedAsr]:
+        with self._lock:
+            path = self._path(key)
+            try:
+                raw = path.read_bytes()
+                data = json.loads(raw)
+                os.utime(path)
+            except (OSError, ValueError):
+                # entry assente, rimossa (anche da un altro worker) o corrotta: miss
+                if key in self._entries:
+                    self._total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                # scritta da un altro worker: entra nell'indice (e nel conteggio) di questo processo
+                self._entries[key] = len(raw)
+                self._total_bytes += len(raw)
+                self.adopted += 1
+                self._evict_locked()
+            self.hits += 1
+        return data["transcript"], data["segments"], data["meta"]
+
+    def put(self, key: str, transcript_text: str, segments: List[Dict], meta: Dict) -> None:
+        body = json.dumps(
+            {"transcript": transcript_text, "segments": segments, "meta": meta},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        if len(body) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")  # unico per processo: più worker, stessa chiave
+        with self._lock:
+            tmp.write_bytes(body)
+            os.replace(tmp, path)
+
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(body)
+            self._total_bytes += len(body)
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        while self._total_bytes > self.max_bytes and self._entries:
+            old_key, old_size = self._entries.popitem(last=False)
+            self._total_bytes -= old_size
+            self._path(old_key).unlink(missing_ok=True)
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": ASR_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "adopted": self.adopted,
+            }
+
+
+_cache: AsrResultCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_asr_cache() -> AsrResultCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AsrResultCache()
+    return _cache
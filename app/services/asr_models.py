@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List, Tuple
+
+if TYPE_CHECKING:
+    from faster_whisper import WhisperModel
+
+# Configurazione modelli ASR (sovrascrivibile via env)
+ASR_MODEL_NAME = os.getenv("ASR_MODEL_NAME", "small")
+ASR_DEVICE = os.getenv("ASR_DEVICE", "cpu")
+ASR_COMPUTE_TYPE = os.getenv("ASR_COMPUTE_TYPE", "int8")
+ASR_POOL_SIZE = int(os.getenv("ASR_POOL_SIZE", "1"))
+ASR_CHECKOUT_TIMEOUT_S = float(os.getenv("ASR_CHECKOUT_TIMEOUT_S", "120"))
+# thread CTranslate2 per istanza (0 = default della libreria); con più worker va diviso tra i core
+ASR_CPU_THREADS = int(os.getenv("ASR_CPU_THREADS", "0"))
+# solo file già in cache locale (niente richieste all'hub), es. dopo il preload di app.serve
+ASR_LOCAL_FILES_ONLY = os.getenv("ASR_LOCAL_FILES_ONLY", "0") == "1"
+
+ModelKey = Tuple[str, str, str]
+
+
+class WhisperModelPool:
+    """
+    N istanze "calde" dello stesso WhisperModel, caricate una sola volta.
+    Ogni richiesta prende in prestito un'istanza (checkout) e la restituisce a fine uso.
+    """
+
+    def __init__(self, model_name: str, device: str, compute_type: str, size: int = 1):
+        self.model_name = model_name
+        self.device = device
+        self.compute_type = compute_type
+        self.size = max(1, size)
+
+        self._idle: "queue.Queue[WhisperModel]" = queue.Queue()
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._loaded = 0
+        self._load_times_s: List[float] = []
+        self._checkouts = 0
+        self._in_use = 0
+        self._wait_total_s = 0.0
+        self._wait_max_s = 0.0
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded >= self.size
+
+    def load(self) -> None:
+        # import pesante (ctranslate2, tokenizers...): solo quando serve davvero un modello
+        from faster_whisper import WhisperModel
+
+        with self._load_lock:
+            while self._loaded < self.size:
+                t0 = time.perf_counter()
+                model = WhisperModel(
+                    self.model_name,
+                    device=self.device,
+                    compute_type=self.compute_type,
+                    cpu_threads=ASR_CPU_THREADS,
+                    local_files_only=ASR_LOCAL_FILES_ONLY,
+                )
+                self._load_times_s.append(time.perf_counter() - t0)
+                self._loaded += 1
+                self._idle.put(model)
+
+    def checkout(self, timeout: float | None = ASR_CHECKOUT_TIMEOUT_S) -> WhisperModel:
+        if not self.loaded:
+            self.load()
+
+        t0 = time.perf_counter()
+        try:
+            model = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(
+                f"Nessun modello Whisper libero entro {timeout}s "
+                f"(model={self.model_name}, pool_size={self.size})"
+            )
+        waited = time.perf_counter() - t0
+
+        with self._stats_lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._wait_total_s += waited
+            self._wait_max_s = max(self._wait_max_s, waited)
+        return model
+
+    def checkin(self, model: WhisperModel) -> None:
+        with self._stats_lock:
+            self._in_use -= 1
+        self._idle.put(model)
+
+    @contextmanager
+    def model(self, timeout: float | None = ASR_CHECKOUT_TIMEOUT_S) -> Iterator[WhisperModel]:
+        m = self.checkout(timeout=timeout)
+        try:
+            yield m
+        finally:
+            self.checkin(m)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "model_name": self.model_name,
+                "device": self.device,
+                "compute_type": self.compute_type,
+                "pool_size": self.size,
+                "loaded": self._loaded,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "load_time_s": list(self._load_times_s),
+                "checkouts": self._checkouts,
+                "wait_total_s": self._wait_total_s,
+                "wait_avg_s": (self._wait_total_s / self._checkouts) if self._checkouts else 0.0,
+                "wait_max_s": self._wait_max_s,
+            }
+
+
+_pools: Dict[ModelKey, WhisperModelPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_model_pool(
+    model_name: str = ASR_MODEL_NAME,
+    device: str = ASR_DEVICE,
+    compute_type: str = ASR_COMPUTE_TYPE,
+    size: int = ASR_POOL_SIZE,
+) -> WhisperModelPool:
+    """Registry process-wide: un pool per (modello, device, compute_type)."""
+    key = (model_name, device, compute_type)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = WhisperModelPool(model_name, device, compute_type, size=size)
+            _pools[key] = pool
+    return pool
+
+
+def warmup_asr_models() -> None:
+    """Carica i modelli configurati (chiamato allo startup)."""
+    get_model_pool().load()
+
+
+def asr_pool_stats() -> List[Dict]:
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [p.stats() for p in pools]
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import bisect
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from app.services.asr_models import get_model_pool
+from app.services.audio_decode import SAMPLE_RATE
+
+ASR_BATCH_ENABLED = os.getenv("ASR_BATCH_ENABLED", "0") == "1"
+ASR_BATCH_WINDOW_MS = float(os.getenv("ASR_BATCH_WINDOW_MS", "50"))
+ASR_BATCH_MAX_SIZE = int(os.getenv("ASR_BATCH_MAX_SIZE", "8"))
+
+# Limite di faster-whisper per ciascuna clip di un batch
+CHUNK_S = 30.0
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+@dataclass
+class _AsrJob:
+    audio: np.ndarray
+    language: str
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class AsrBatchScheduler:
+    """
+    Raccoglie le trascrizioni pendenti di sessioni diverse per una finestra breve
+    (o fino a max_batch_size) e le esegue in un'unica inferenza batched.
+
+    Gli audio del batch vengono concatenati e passati al BatchedInferencePipeline
+    come clip_timestamps: ogni clip (<= 30 s) diventa un elemento del batch e i
+    segmenti risultanti vengono riassegnati al job di origine.
+    """
+
+    def __init__(self, window_ms: float = ASR_BATCH_WINDOW_MS, max_batch_size: int = ASR_BATCH_MAX_SIZE):
+        self.window_s = window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.pool = get_model_pool()
+
+        self._queue: "queue.Queue[_AsrJob]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._started = False
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batch_sizes: Counter = Counter()
+        self._latency_buckets: Counter = Counter()
+        self._latency_sum_ms = 0.0
+        self._latency_max_ms = 0.0
+        self._jobs_done = 0
+        self._jobs_failed = 0
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._started:
+                return
+            # un dispatcher per ogni istanza del pool: batch diversi girano in parallelo
+            for i in range(self.pool.size):
+                t = threading.Thread(target=self._run, name=f"asr-batch-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._started = True
+
+    def submit(self, audio: np.ndarray, language: str = "it") -> Future:
+        self.start()
+        job = _AsrJob(audio=audio, language=language)
+        self._queue.put(job)
+        return job.future
+
+    def _collect(self) -> List[_AsrJob]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+
+            by_lang: Dict[str, List[_AsrJob]] = {}
+            for job in batch:
+                by_lang.setdefault(job.language, []).append(job)
+
+            for language, jobs in by_lang.items():
+                self._record_start(jobs)
+                try:
+                    results = self._transcribe_batch(jobs, language)
+                except Exception as e:
+                    with self._stats_lock:
+                        self._jobs_failed += len(jobs)
+                    for job in jobs:
+                        job.future.set_exception(e)
+                    continue
+
+                with self._stats_lock:
+                    self._jobs_done += len(jobs)
+                for job, result in zip(jobs, results):
+                    job.future.set_result(result)
+
+    def _transcribe_batch(self, jobs: List[_AsrJob], language: str) -> List[Tuple[str, List[Dict], Dict]]:
+        offsets: List[float] = []
+        clips: List[Dict[str, float]] = []
+        cursor = 0.0
+        for job in jobs:
+            duration = len(job.audio) / SAMPLE_RATE
+            offsets.append(cursor)
+            start = 0.0
+            while start < duration:
+                end = min(start + CHUNK_S, duration)
+                clips.append({"start": cursor + start, "end": cursor + end})
+                start = end
+            cursor += duration
+
+        audio = np.concatenate([job.audio for job in jobs]).astype(np.float32, copy=False)
+
+        per_job: List[List[Dict]] = [[] for _ in jobs]
+        with self.pool.model() as model:
+            from faster_whisper import BatchedInferencePipeline
+
+            pipeline = BatchedInferencePipeline(model=model)
+            segments, info = pipeline.transcribe(
+                audio,
+                language=language,
+                batch_size=max(1, len(clips)),
+                clip_timestamps=clips,
+                vad_filter=False,
+            )
+            for s in segments:
+                idx = max(0, bisect.bisect_right(offsets, float(s.start)) - 1)
+                per_job[idx].append(
+                    {
+                        "start": float(s.start) - offsets[idx],
+                        "end": float(s.end) - offsets[idx],
+                        "text": s.text,
+                    }
+                )
+
+        results = []
+        for segs in per_job:
+            transcript_text = " ".join([t for t in (s["text"].strip() for s in segs) if t])
+            meta = {
+                "language": info.language,
+                "model_name": self.pool.model_name,
+                "device": self.pool.device,
+                "compute_type": self.pool.compute_type,
+                "batched": True,
+                "batch_size": len(jobs),
+            }
+            results.append((transcript_text, segs, meta))
+        return results
+
+    def _record_start(self, jobs: List[_AsrJob]) -> None:
+        now = time.perf_counter()
+        with self._stats_lock:
+            self._batch_sizes[len(jobs)] += 1
+            for job in jobs:
+                waited_ms = (now - job.enqueued_at) * 1000.0
+                self._latency_sum_ms += waited_ms
+                self._latency_max_ms = max(self._latency_max_ms, waited_ms)
+                bucket = next((b for b in LATENCY_BUCKETS_MS if waited_ms <= b), "+Inf")
+                self._latency_buckets[bucket] += 1
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            started = sum(self._latency_buckets.values())
+            return {
+                "enabled": ASR_BATCH_ENABLED,
+                "window_ms": self.window_s * 1000.0,
+                "max_batch_size": self.max_batch_size,
+                "queue_depth": self._queue.qsize(),
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                "added_latency_ms": {
+                    "count": started,
+                    "avg": (self._latency_sum_ms / started) if started else 0.0,
+                    "max": self._latency_max_ms,
+                    "buckets": {str(k): v for k, v in self._latency_buckets.items()},
+                },
+                "jobs_done": self._jobs_done,
+                "jobs_failed": self._jobs_failed,
+            }
+
+
+_scheduler: AsrBatchScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_asr_scheduler() -> AsrBatchScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = AsrBatchScheduler()
+    return _scheduler
+
+
+def transcribe_batched(audio: np.ndarray, language: str = "it") -> Tuple[str, List[Dict], Dict]:
+    """
+    Accoda l'audio nello scheduler e attende il risultato del proprio batch.
+    Il chiamante (thread dello stage asr) resta bloccato fino al risultato: in modalità
+    batch asr_whisper porta lo stage ad almeno ASR_BATCH_MAX_SIZE slot per istanza del pool.
+    """
+    return get_asr_scheduler().submit(audio, language=language).result()
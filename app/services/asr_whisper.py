@@ -1,71 +1,65 @@
 from __future__ import annotations
 
 import json
-import os
-import subprocess
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, Union
 
-from faster_whisper import WhisperModel
+import numpy as np
+
+from app.core.executors import require_stage_slots
+from app.core.metrics import current_timings, timed
+from app.services.asr_cache import ASR_CACHE_ENABLED, asr_cache_key, get_asr_cache
+from app.services.asr_models import ASR_COMPUTE_TYPE, ASR_DEVICE, ASR_MODEL_NAME, ASR_POOL_SIZE, get_model_pool
+from app.services.asr_scheduler import ASR_BATCH_ENABLED, ASR_BATCH_MAX_SIZE, transcribe_batched
+from app.services.asr_workers import ASR_BACKEND, get_asr_fleet
+from app.services.audio_decode import decode_audio_to_pcm
+
+if ASR_BATCH_ENABLED and ASR_BACKEND != "workers":
+    # asr_pipeline gira sullo stage "asr" e il thread resta in attesa del proprio batch:
+    # con meno slot di un batch pieno per dispatcher (uno per istanza del pool)
+    # lo scheduler non riceverebbe mai più di STAGE_ASR_CONCURRENCY job insieme
+    require_stage_slots("asr", ASR_BATCH_MAX_SIZE * ASR_POOL_SIZE)
 
 
 def ensure_dir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
 
-def run_ffmpeg_to_wav(input_path: Path, output_wav: Path) -> None:
-    """
-    Convert input audio to WAV mono 16kHz (best for ASR).
-    Requires ffmpeg available in PATH.
-    """
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-i",
-        str(input_path),
-        "-ac",
-        "1",
-        "-ar",
-        "16000",
-        str(output_wav),
-    ]
-    proc = subprocess.run(cmd, capture_output=True, text=True)
-    if proc.returncode != 0:
-        raise RuntimeError(
-            "FFmpeg conversion failed.\n"
-            f"Command: {' '.join(cmd)}\n"
-            f"STDERR:\n{proc.stderr}"
-        )
-
-
-def transcribe_wav(
-    wav_path: Path,
+def transcribe_audio(
+    audio: Union[np.ndarray, Path],
     language: str = "it",
-    model_name: str = "small",
-    device: str = "cpu",
-    compute_type: str = "int8",
+    model_name: str = ASR_MODEL_NAME,
+    device: str = ASR_DEVICE,
+    compute_type: str = ASR_COMPUTE_TYPE,
 ) -> Tuple[str, List[Dict], Dict]:
     """
+    audio: buffer PCM 16 kHz mono float32 oppure path di un file audio.
     Returns:
       transcript_text: concatenated text
       segments_list: list of segments with start/end/text
       meta: language + some info
     """
-    model = WhisperModel(model_name, device=device, compute_type=compute_type)
-
-    segments, info = model.transcribe(str(wav_path), language=language)
+    pool = get_model_pool(model_name, device, compute_type)
+    source = audio if isinstance(audio, np.ndarray) else str(audio)
 
     segs: List[Dict] = []
     texts: List[str] = []
-    for s in segments:
-        segs.append(
-            {
-                "start": float(s.start),
-                "end": float(s.end),
-                "text": s.text,
-            }
-        )
-        texts.append(s.text.strip())
+    with timed("asr.model_checkout"):
+        model = pool.checkout()
+    try:
+        # segments è un generatore: va consumato mentre il modello è in prestito
+        segments, info = model.transcribe(source, language=language)
+        for s in segments:
+            segs.append(
+                {
+                    "start": float(s.start),
+                    "end": float(s.end),
+                    "text": s.text,
+                }
+            )
+            texts.append(s.text.strip())
+    finally:
+        pool.checkin(model)
 
     transcript_text = " ".join([t for t in texts if t])
 
@@ -74,11 +68,19 @@ def transcribe_wav(
         "model_name": model_name,
         "device": device,
         "compute_type": compute_type,
-        "wav_path": str(wav_path),
     }
     return transcript_text, segs, meta
 
 
+def transcribe_pcm(audio: np.ndarray, language: str = "it") -> Tuple[str, List[Dict], Dict]:
+    """Trascrive PCM già decodificato col backend configurato (worker dedicati, micro-batch o pool)."""
+    if ASR_BACKEND == "workers":
+        return get_asr_fleet().transcribe(audio, language=language)
+    if ASR_BATCH_ENABLED:
+        return transcribe_batched(audio, language=language)
+    return transcribe_audio(audio, language=language)
+
+
 def save_outputs(out_dir: Path, transcript_text: str, segments: List[Dict], meta: Dict) -> None:
     ensure_dir(out_dir)
 
@@ -87,29 +89,67 @@ def save_outputs(out_dir: Path, transcript_text: str, segments: List[Dict], meta
     (out_dir / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
 
 
-def asr_pipeline(input_audio_path: Path, session_dir: Path, language: str = "it", out_subdir: str = "out") -> Path:
-
+def asr_pipeline(
+    input_audio_path: Path,
+    session_dir: Path,
+    language: str = "it",
+    out_subdir: str = "out",
+    audio_bytes: bytes | None = None,
+    audio: np.ndarray | None = None,
+    decoder: str | None = None,
+    transcribed: Tuple[str, List[Dict], Dict] | None = None,
+) -> Path:
     """
     Full pipeline:
       - create session folders
-      - convert to wav
+      - lookup content-hash cache
+      - decode audio in memory (ffmpeg only as fallback)
       - transcribe
       - save out/transcript.txt (+ json files)
+    transcribed: trascrizione già pronta (es. streaming), si salvano solo gli output.
     Returns path to transcript.txt
     """
-    raw_dir = session_dir / "raw"
-    wav_dir = session_dir / "wav"
     out_dir = session_dir / out_subdir
-    ensure_dir(raw_dir)
-    ensure_dir(wav_dir)
     ensure_dir(out_dir)
 
-    # Convert to wav
-    wav_path = wav_dir / "input.wav"
-    run_ffmpeg_to_wav(input_audio_path, wav_path)
-
-    # Transcribe
-    transcript_text, segments, meta = transcribe_wav(wav_path, language=language)
+    if transcribed is not None:
+        transcript_text, segments, meta = transcribed
+        meta["audio_path"] = str(input_audio_path)
+        meta["timings"] = current_timings()
+        save_outputs(out_dir, transcript_text, segments, meta)
+        return out_dir / "transcript.txt"
+
+    if audio_bytes is None:
+        audio_bytes = input_audio_path.read_bytes()
+
+    # Cache (hash contenuto + lingua + modello + compute type)
+    cache_key = None
+    if ASR_CACHE_ENABLED:
+        cache_key = asr_cache_key(audio_bytes, language, ASR_MODEL_NAME, ASR_COMPUTE_TYPE)
+        with timed("asr.cache_lookup"):
+            cached = get_asr_cache().get(cache_key)
+        if cached is not None:
+            transcript_text, segments, meta = cached
+            meta["audio_path"] = str(input_audio_path)
+            meta["timings"] = current_timings()
+            save_outputs(out_dir, transcript_text, segments, meta)
+            return out_dir / "transcript.txt"
+
+    # Decode (16 kHz mono float32, nessun WAV intermedio); salta se già decodificato durante l'upload
+    if audio is None:
+        with timed("asr.decode"):
+            audio, decoder = decode_audio_to_pcm(audio_bytes, input_audio_path)
+
+    # Transcribe (worker ASR dedicati o micro-batch cross-sessione se abilitati)
+    with timed("asr.transcribe"):
+        transcript_text, segments, meta = transcribe_pcm(audio, language=language)
+    meta["decoder"] = decoder
+
+    if cache_key is not None:
+        get_asr_cache().put(cache_key, transcript_text, segments, meta)
+    meta["audio_path"] = str(input_audio_path)
+    # tempi fin qui (upload, decode, transcribe...); finish_turn li completa con llm/db
+    meta["timings"] = current_timings()
 
     # Save
     save_outputs(out_dir, transcript_text, segments, meta)
@@ -0,0 +1,397 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import uuid
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+
+from app.services.asr_models import ASR_COMPUTE_TYPE, ASR_DEVICE, ASR_LOCAL_FILES_ONLY, ASR_MODEL_NAME
+
+logger = logging.getLogger(__name__)
+
+# inprocess: modelli nel processo API (pool / scheduler); workers: flotta di processi dedicati
+ASR_BACKEND = os.getenv("ASR_BACKEND", "inprocess")
+ASR_WORKERS = int(os.getenv("ASR_WORKERS", "2"))
+# thread CTranslate2 per worker (0 = default della libreria)
+ASR_WORKER_THREADS = int(os.getenv("ASR_WORKER_THREADS", "0"))
+# "auto" = core divisi in parti uguali; "0-3,4-7" = un gruppo per worker; "" = nessun pinning
+ASR_WORKER_CPUS = os.getenv("ASR_WORKER_CPUS", "")
+ASR_WORKER_RETRIES = int(os.getenv("ASR_WORKER_RETRIES", "1"))
+ASR_WORKER_TIMEOUT_S = float(os.getenv("ASR_WORKER_TIMEOUT_S", "300"))
+ASR_WORKER_START_TIMEOUT_S = float(os.getenv("ASR_WORKER_START_TIMEOUT_S", "600"))
+# attesa massima di un worker libero prima di rispondere 503
+ASR_WORKER_CHECKOUT_TIMEOUT_S = float(os.getenv("ASR_WORKER_CHECKOUT_TIMEOUT_S", "30"))
+# backoff dei riavvii falliti (in background): raddoppia fino al massimo
+ASR_WORKER_RESPAWN_BACKOFF_S = float(os.getenv("ASR_WORKER_RESPAWN_BACKOFF_S", "1"))
+ASR_WORKER_RESPAWN_BACKOFF_MAX_S = float(os.getenv("ASR_WORKER_RESPAWN_BACKOFF_MAX_S", "30"))
+
+
+class WorkerDied(Exception):
+    pass
+
+
+def parse_cpu_sets(spec: str, workers: int) -> List[Optional[set]]:
+    if not spec or not hasattr(os, "sched_getaffinity"):
+        return [None] * workers
+    if spec == "auto":
+        cpus = sorted(os.sched_getaffinity(0))
+        per = max(1, len(cpus) // workers)
+        return [set(cpus[i * per:(i + 1) * per]) or set(cpus) for i in range(workers)]
+
+    groups: List[Optional[set]] = []
+    for group in spec.split(","):
+        cpus: set = set()
+        for part in group.split("+"):
+            if "-" in part:
+                a, b = part.split("-")
+                cpus.update(range(int(a), int(b) + 1))
+            elif part.strip():
+                cpus.add(int(part))
+        groups.append(cpus or None)
+    return [groups[i % len(groups)] for i in range(workers)]
+
+
+# ---- lato worker (processo separato, avviato con "spawn") ----
+
+def _worker_main(conn: Connection, config: Dict[str, Any]) -> None:
+    cpus = config.get("cpus")
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    from faster_whisper import WhisperModel
+
+    model = WhisperModel(
+        config["model_name"],
+        device=config["device"],
+        compute_type=config["compute_type"],
+        cpu_threads=config["cpu_threads"],
+        local_files_only=config["local_files_only"],
+    )
+    conn.send(("ready", os.getpid()))
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg is None:
+            return
+
+        job_id, shm_name, n_samples, language = msg
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            result = _transcribe_shared(model, shm, n_samples, language)
+            conn.send((job_id, True, result))
+        except Exception as e:
+            conn.send((job_id, False, f"{type(e).__name__}: {e}"))
+        finally:
+            shm.close()
+
+
+def _transcribe_shared(model, shm: shared_memory.SharedMemory, n_samples: int, language: str) -> Tuple[List[Dict], str]:
+    # vista sul segmento condiviso: nessuna copia del PCM; i riferimenti (audio,
+    # generatore dei segmenti) muoiono col frame, così shm.close() può liberare il buffer
+    audio = np.ndarray((n_samples,), dtype=np.float32, buffer=shm.buf)
+    segments, info = model.transcribe(audio, language=language)
+    segs = [{"start": float(s.start), "end": float(s.end), "text": s.text} for s in segments]
+    return segs, info.language
+
+
+# ---- lato API ----
+
+class _WorkerHandle:
+    def __init__(self, index: int, proc: mp.process.BaseProcess, conn: Connection):
+        self.index = index
+        self.proc = proc
+        self.conn = conn
+        self.jobs = 0
+
+
+class AsrWorkerFleet:
+    """
+    Flotta di processi ASR, ognuno con il proprio modello Whisper caldo.
+    Il PCM decodificato passa in shared memory (una sola copia, niente pickle).
+    Un worker morto (es. crash nativo in CTranslate2) viene riavviato in
+    background (con backoff, senza bloccare la richiesta) e il job riprovato su
+    un altro worker fino a ASR_WORKER_RETRIES volte.
+    """
+
+    def __init__(
+        self,
+        workers: int = ASR_WORKERS,
+        threads: int = ASR_WORKER_THREADS,
+        cpu_spec: str = ASR_WORKER_CPUS,
+        model_name: str = ASR_MODEL_NAME,
+        device: str = ASR_DEVICE,
+        compute_type: str = ASR_COMPUTE_TYPE,
+        retries: int = ASR_WORKER_RETRIES,
+        timeout_s: float = ASR_WORKER_TIMEOUT_S,
+        checkout_timeout_s: float = ASR_WORKER_CHECKOUT_TIMEOUT_S,
+    ):
+        self.size = max(1, workers)
+        self.threads = threads
+        self.cpu_sets = parse_cpu_sets(cpu_spec, self.size)
+        self.model_name = model_name
+        self.device = device
+        self.compute_type = compute_type
+        self.retries = max(0, retries)
+        self.timeout_s = timeout_s
+        self.checkout_timeout_s = checkout_timeout_s
+
+        self._ctx = mp.get_context("spawn")
+        self._idle: "queue.Queue[_WorkerHandle]" = queue.Queue()
+        self._handles: Dict[int, _WorkerHandle] = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._stopping = threading.Event()
+        self._respawning = 0
+
+        self.jobs = 0
+        self.failures = 0
+        self.retried = 0
+        self.restarts = 0
+        self.timeouts = 0
+
+    def _config(self, index: int) -> Dict[str, Any]:
+        return {
+            "model_name": self.model_name,
+            "device": self.device,
+            "compute_type": self.compute_type,
+            "cpu_threads": self.threads,
+            "local_files_only": ASR_LOCAL_FILES_ONLY,
+            "cpus": self.cpu_sets[index],
+        }
+
+    def _spawn(self, index: int) -> _WorkerHandle:
+        parent_conn, child_conn = self._ctx.Pipe(duplex=True)
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self._config(index)),
+            name=f"asr-worker-{index}",
+            daemon=True,
+        )
+        proc.start()
+        child_conn.close()
+
+        # attende il caricamento del modello
+        if not parent_conn.poll(ASR_WORKER_START_TIMEOUT_S):
+            proc.kill()
+            parent_conn.close()
+            raise TimeoutError(f"asr-worker-{index} non pronto entro {ASR_WORKER_START_TIMEOUT_S}s")
+        try:
+            parent_conn.recv()
+        except EOFError:
+            parent_conn.close()
+            proc.join(timeout=5)
+            raise WorkerDied(f"asr-worker-{index} terminato durante il caricamento (exit {proc.exitcode})")
+
+        handle = _WorkerHandle(index, proc, parent_conn)
+        with self._lock:
+            self._handles[index] = handle
+        return handle
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._stopping.clear()
+        try:
+            for i in range(self.size):
+                self._idle.put(self._spawn(i))
+        except Exception:
+            # avvio parziale: si riprova da zero alla prossima richiesta
+            self.stop()
+            raise
+
+    def _restart(self, handle: _WorkerHandle) -> None:
+        """Termina il worker e lo ricrea in un thread separato: il chiamante non attende il caricamento."""
+        try:
+            handle.proc.kill()
+        except Exception:
+            pass
+        handle.proc.join(timeout=5)
+        handle.conn.close()
+        with self._lock:
+            self.restarts += 1
+            self._respawning += 1
+            if self._handles.get(handle.index) is handle:
+                del self._handles[handle.index]
+        threading.Thread(
+            target=self._respawn, args=(handle.index,), name=f"asr-respawn-{handle.index}", daemon=True
+        ).start()
+
+    def _respawn(self, index: int) -> None:
+        # lo slot rientra nel pool in ogni caso: si riprova con backoff finché il worker non riparte
+        delay = ASR_WORKER_RESPAWN_BACKOFF_S
+        try:
+            while not self._stopping.is_set():
+                try:
+                    handle = self._spawn(index)
+                except Exception as e:
+                    logger.warning("riavvio di asr-worker-%d fallito (%s), nuovo tentativo tra %.1fs", index, e, delay)
+                    if self._stopping.wait(delay):
+                        return
+                    delay = min(delay * 2, ASR_WORKER_RESPAWN_BACKOFF_MAX_S)
+                    continue
+                if self._stopping.is_set():
+                    with self._lock:
+                        self._handles.pop(index, None)
+                    handle.proc.kill()
+                    handle.conn.close()
+                    return
+                self._idle.put(handle)
+                return
+        finally:
+            with self._lock:
+                self._respawning -= 1
+
+    def _run_on(self, handle: _WorkerHandle, job: Tuple[str, str, int, str]) -> Tuple[bool, Any]:
+        try:
+            handle.conn.send(job)
+            deadline = time.monotonic() + self.timeout_s
+            # poll a intervalli: un worker morto viene rilevato anche senza EOF immediato
+            while not handle.conn.poll(1.0):
+                if not handle.proc.is_alive():
+                    raise WorkerDied(f"asr-worker-{handle.index} terminato (exit {handle.proc.exitcode})")
+                if time.monotonic() > deadline:
+                    with self._lock:
+                        self.timeouts += 1
+                    raise WorkerDied(f"asr-worker-{handle.index} oltre {self.timeout_s}s")
+            job_id, ok, payload = handle.conn.recv()
+        except (EOFError, OSError, BrokenPipeError) as e:
+            raise WorkerDied(f"asr-worker-{handle.index}: {e}")
+        if job_id != job[0]:
+            raise WorkerDied(f"asr-worker-{handle.index}: risposta fuori sequenza")
+        return ok, payload
+
+    def transcribe(self, audio: np.ndarray, language: str = "it") -> Tuple[str, List[Dict], Dict]:
+        self.start()
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, audio.nbytes))
+        try:
+            np.ndarray(audio.shape, dtype=np.float32, buffer=shm.buf)[:] = audio
+            job = (uuid.uuid4().hex, shm.name, int(audio.size), language)
+
+            attempt = 0
+            while True:
+                try:
+                    handle = self._idle.get(timeout=self.checkout_timeout_s)
+                except queue.Empty:
+                    raise HTTPException(
+                        status_code=503,
+                        detail="Nessun worker ASR disponibile, riprovare più tardi.",
+                        headers={"Retry-After": str(max(1, int(self.checkout_timeout_s)))},
+                    )
+                try:
+                    ok, payload = self._run_on(handle, job)
+                except WorkerDied as e:
+                    self._restart(handle)
+                    if attempt >= self.retries:
+                        with self._lock:
+                            self.failures += 1
+                        raise RuntimeError(f"ASR fallito dopo {attempt + 1} tentativi: {e}")
+                    attempt += 1
+                    with self._lock:
+                        self.retried += 1
+                    continue
+
+                handle.jobs += 1
+                self._idle.put(handle)
+                with self._lock:
+                    self.jobs += 1
+                if not ok:
+                    with self._lock:
+                        self.failures += 1
+                    raise RuntimeError(payload)
+                break
+        finally:
+            shm.close()
+            shm.unlink()
+
+        segs, detected = payload
+        transcript_text = " ".join(t for t in (s["text"].strip() for s in segs) if t)
+        meta = {
+            "language": detected,
+            "model_name": self.model_name,
+            "device": self.device,
+            "compute_type": self.compute_type,
+            "backend": "workers",
+        }
+        return transcript_text, segs, meta
+
+    def stop(self) -> None:
+        self._stopping.set()
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+            self._started = False
+        for h in handles:
+            try:
+                h.conn.send(None)
+            except Exception:
+                pass
+        for h in handles:
+            h.proc.join(timeout=5)
+            if h.proc.is_alive():
+                h.proc.kill()
+            h.conn.close()
+        while not self._idle.empty():
+            self._idle.get_nowait()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.size,
+                "threads_per_worker": self.threads,
+                "idle": self._idle.qsize(),
+                "respawning": self._respawning,
+                "jobs": self.jobs,
+                "failures": self.failures,
+                "retried": self.retried,
+                "restarts": self.restarts,
+                "timeouts": self.timeouts,
+                "processes": [
+                    {
+                        "index": h.index,
+                        "pid": h.proc.pid,
+                        "alive": h.proc.is_alive(),
+                        "jobs": h.jobs,
+                        "cpus": sorted(self.cpu_sets[h.index]) if self.cpu_sets[h.index] else None,
+                    }
+                    for h in self._handles.values()
+                ],
+            }
+
+
+_fleet: AsrWorkerFleet | None = None
+_fleet_lock = threading.Lock()
+
+
+def get_asr_fleet() -> AsrWorkerFleet:
+    global _fleet
+    with _fleet_lock:
+        if _fleet is None:
+            _fleet = AsrWorkerFleet()
+    return _fleet
+
+
+def warmup_asr_fleet() -> None:
+    """Avvia i worker e attende il caricamento dei modelli (warm-up allo startup)."""
+    get_asr_fleet().start()
+
+
+def shutdown_asr_fleet() -> None:
+    with _fleet_lock:
+        fleet = _fleet
+    if fleet is not None:
+        fleet.stop()
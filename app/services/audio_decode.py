@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import io
+import subprocess
+from pathlib import Path
+from typing import BinaryIO, Iterator, Tuple
+
+import numpy as np
+
+from app.core.metrics import timed
+
+SAMPLE_RATE = 16000
+
+
+def decode_bytes_in_process(data: bytes, sampling_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Decodifica in-process (PyAV, già dipendenza di faster-whisper).
+    Ritorna PCM mono float32 a sampling_rate, senza file intermedi.
+    """
+    from faster_whisper.audio import decode_audio
+
+    return decode_audio(io.BytesIO(data), sampling_rate=sampling_rate)
+
+
+def decode_stream_in_process(fileobj: BinaryIO, sampling_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Come decode_bytes_in_process ma da un file-like non seekable (solo read()):
+    la decodifica procede man mano che arrivano i byte.
+    """
+    from faster_whisper.audio import decode_audio
+
+    return decode_audio(fileobj, sampling_rate=sampling_rate)
+
+
+def iter_decode_stream(fileobj: BinaryIO, sampling_rate: int = SAMPLE_RATE) -> Iterator[np.ndarray]:
+    """
+    Decodifica incrementale (PyAV) da un file-like non seekable: blocchi PCM mono
+    float32 man mano che il demuxer legge i byte, ogni byte decodificato una sola volta.
+    """
+    import av
+
+    resampler = av.audio.resampler.AudioResampler(format="s16", layout="mono", rate=sampling_rate)
+    with av.open(fileobj, mode="r", metadata_errors="ignore") as container:
+        frames = container.decode(audio=0)
+        while True:
+            try:
+                frame = next(frames)
+            except StopIteration:
+                break
+            except av.error.InvalidDataError:
+                # frame corrotto (es. chunk troncato): si salta come fa faster-whisper
+                continue
+            for out in resampler.resample(frame):
+                yield out.to_ndarray().reshape(-1).astype(np.float32) / 32768.0
+        for out in resampler.resample(None):
+            yield out.to_ndarray().reshape(-1).astype(np.float32) / 32768.0
+
+
+def run_ffmpeg_to_pcm(input_path: Path, sampling_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Fallback: ffmpeg esterno, output float32 mono su stdout (nessun WAV su disco).
+    Requires ffmpeg available in PATH.
+    """
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-i",
+        str(input_path),
+        "-f",
+        "f32le",
+        "-ac",
+        "1",
+        "-ar",
+        str(sampling_rate),
+        "-",
+    ]
+    proc = subprocess.run(cmd, capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(
+            "FFmpeg conversion failed.\n"
+            f"Command: {' '.join(cmd)}\n"
+            f"STDERR:\n{proc.stderr.decode('utf-8', errors='replace')}"
+        )
+    return np.frombuffer(proc.stdout, dtype=np.float32).copy()
+
+
+def decode_audio_to_pcm(data: bytes, input_path: Path) -> Tuple[np.ndarray, str]:
+    """
+    Bytes caricati -> buffer 16 kHz mono float32.
+    Prova prima il decoder in-process; se il codec non è supportato usa ffmpeg
+    sul file raw già salvato.
+    Ritorna (audio, nome_decoder).
+    """
+    try:
+        audio = decode_bytes_in_process(data)
+        if audio.size > 0:
+            return audio, "pyav"
+    except Exception:
+        pass
+
+    # fallback raro ma costoso (processo esterno): tempo registrato a parte
+    with timed("asr.ffmpeg"):
+        return run_ffmpeg_to_pcm(input_path), "ffmpeg"
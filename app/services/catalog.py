@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Tuple
+
+from app.core.interprocess import MULTIPROCESS, file_version
+from app.core.paths import DATA_ROOT
+from app.repositories.db_repo import db_list_all_prompts
+from app.services.llm_ollama import STEP_CONFIG
+
+
+def normalize_lang(lang: str | None) -> str:
+    lang = (lang or "it").lower()
+    if lang.startswith("it"):
+        lang = "it"
+    return lang
+
+
+@dataclass(frozen=True)
+class CatalogStep:
+    protocol: str
+    lang: str
+    step: int
+    step_id: str
+    question: str
+    audio_relpath: str
+    max_score: int
+    rubric: str
+
+    @property
+    def audio_url(self) -> str:
+        return f"/assets/{self.audio_relpath}"
+
+
+@dataclass(frozen=True)
+class ProtocolCatalog:
+    """Catalogo immutabile di protocolli/step/prompt, indicizzato per lookup O(1)."""
+
+    by_key: Mapping[Tuple[str, str, int], CatalogStep]
+    by_protocol: Mapping[Tuple[str, str], Tuple[CatalogStep, ...]]
+
+    def get(self, protocol: str, lang: str, step: int) -> CatalogStep:
+        return self.by_key[(protocol, normalize_lang(lang), step)]
+
+    def steps(self, protocol: str, lang: str) -> Tuple[CatalogStep, ...]:
+        return self.by_protocol.get((protocol, normalize_lang(lang)), ())
+
+    def protocols(self) -> List[str]:
+        return sorted({p for p, _ in self.by_protocol})
+
+
+def build_catalog() -> ProtocolCatalog:
+    by_key: Dict[Tuple[str, str, int], CatalogStep] = {}
+    grouped: Dict[Tuple[str, str], List[CatalogStep]] = {}
+
+    for r in db_list_all_prompts():
+        config = STEP_CONFIG.get(str(r.step), {})
+        s = CatalogStep(
+            protocol=r.protocol,
+            lang=r.lang,
+            step=r.step,
+            step_id=f"mmse_step{r.step:02d}",
+            question=r.text,
+            audio_relpath=r.audio_relpath,
+            max_score=int(config.get("max_score", 0)),
+            rubric=str(config.get("rubric", "")),
+        )
+        by_key[(s.protocol, s.lang, s.step)] = s
+        grouped.setdefault((s.protocol, s.lang), []).append(s)
+
+    by_protocol = {k: tuple(sorted(v, key=lambda x: x.step)) for k, v in grouped.items()}
+    return ProtocolCatalog(by_key=MappingProxyType(by_key), by_protocol=MappingProxyType(by_protocol))
+
+
+# toccato a ogni reload: con più worker gli altri processi ricaricano al prossimo accesso
+CATALOG_VERSION_FILE = DATA_ROOT / "catalog.version"
+
+_catalog: ProtocolCatalog | None = None
+_catalog_version: tuple | None = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> ProtocolCatalog:
+    global _catalog, _catalog_version
+    if MULTIPROCESS and _catalog is not None and file_version(CATALOG_VERSION_FILE) != _catalog_version:
+        with _catalog_lock:
+            _catalog_version = file_version(CATALOG_VERSION_FILE)
+            _catalog = build_catalog()
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog_version = file_version(CATALOG_VERSION_FILE)
+                _catalog = build_catalog()
+    return _catalog
+
+
+def reload_catalog() -> ProtocolCatalog:
+    """Ricostruisce il catalogo dal DB (es. dopo scripts/seed_mmse_prompts_db.py)."""
+    global _catalog, _catalog_version
+    catalog = build_catalog()
+    with _catalog_lock:
+        if MULTIPROCESS:
+            CATALOG_VERSION_FILE.touch()
+        _catalog_version = file_version(CATALOG_VERSION_FILE)
+        _catalog = catalog
+    return catalog
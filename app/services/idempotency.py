@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict
+
+from fastapi import HTTPException
+
+from app.core.executors import run_stage
+from app.core.interprocess import acquire_file_lock, release_file_lock
+
+IDEMPOTENCY_KEY_MAX_LEN = 200
+# quanto un retry attende la richiesta originale ancora in corso (anche su un altro worker)
+IDEMPOTENCY_WAIT_S = float(os.getenv("IDEMPOTENCY_WAIT_S", "120"))
+
+
+def digest_idempotency_key(step_index: int, sha256_hex: str) -> str:
+    return f"audio:{step_index}:{sha256_hex}"
+
+
+def audio_idempotency_key(step_index: int, audio_bytes: bytes) -> str:
+    """
+    Chiave di fallback senza header: stesso step + stesso audio = stesso tentativo.
+    Lo step evita che lo stesso clip usato per due step (es. "casa pane gatto" agli
+    step 2 e 4) rilegga la risposta del primo.
+    """
+    return digest_idempotency_key(step_index, hashlib.sha256(audio_bytes).hexdigest())
+
+
+def _response_path(session_dir: Path, key: str) -> Path:
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return session_dir / "idempotency" / f"{digest}.json"
+
+
+def _inflight_path(session_dir: Path, key: str) -> Path:
+    # marker su disco: flock tenuto da chi sta eseguendo la richiesta, rilasciato dal kernel se il processo muore
+    return _response_path(session_dir, key).with_suffix(".inflight")
+
+
+def _prepare_dir(session_dir: Path) -> None:
+    if not session_dir.is_dir():
+        raise HTTPException(status_code=404, detail="Session not found. Create session first.")
+    (session_dir / "idempotency").mkdir(exist_ok=True)
+
+
+def _load_response(session_dir: Path, key: str) -> Dict[str, Any] | None:
+    p = _response_path(session_dir, key)
+    if not p.exists():
+        return None
+    return json.loads(p.read_text(encoding="utf-8"))
+
+
+def _save_response(session_dir: Path, key: str, response: Dict[str, Any]) -> None:
+    p = _response_path(session_dir, key)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(f".json.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps({"key": key, "response": response}, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(p)
+
+
+class IdempotencyRegistry:
+    """
+    Deduplica i retry di answer_audio.
+    - risposta già completata: riletta da sessions/<id>/idempotency/ senza ricalcolo
+    - richiesta ancora in corso (in questo o in un altro worker): il retry attende
+      il marker <digest>.inflight e poi rilegge la risposta salvata; se l'originale
+      è fallita (nessuna risposta salvata) il retry la esegue
+    """
+
+    def __init__(self, wait_s: float = IDEMPOTENCY_WAIT_S):
+        self.wait_s = wait_s
+        self._inflight = 0
+        self.replayed = 0
+        self.joined = 0
+        self.executed = 0
+
+    async def run(
+        self,
+        session_id: str,
+        session_dir: Path,
+        key: str,
+        fn: Callable[[], Awaitable[Dict[str, Any]]],
+    ) -> Dict[str, Any]:
+        if len(key) > IDEMPOTENCY_KEY_MAX_LEN:
+            raise HTTPException(status_code=400, detail="Idempotency-Key troppo lunga.")
+
+        stored = await run_stage("io", _load_response, session_dir, key)
+        if stored is not None:
+            self.replayed += 1
+            return {**stored["response"], "idempotent_replay": True}
+
+        await run_stage("io", _prepare_dir, session_dir)
+        marker = _inflight_path(session_dir, key)
+        fd = await acquire_file_lock(marker, 0)
+        if fd is None:
+            # stessa richiesta già in corso: si attende che finisca
+            self.joined += 1
+            fd = await acquire_file_lock(marker, self.wait_s)
+            if fd is None:
+                raise HTTPException(
+                    status_code=409,
+                    detail="La stessa risposta è ancora in elaborazione.",
+                    headers={"Retry-After": "5"},
+                )
+
+        self._inflight += 1
+        try:
+            stored = await run_stage("io", _load_response, session_dir, key)
+            if stored is not None:
+                self.replayed += 1
+                return {**stored["response"], "idempotent_replay": True}
+
+            self.executed += 1
+            result = await fn()
+            # si memorizzano solo i turni effettivamente registrati
+            if "step_answered" in result:
+                await run_stage("io", _save_response, session_dir, key, result)
+            return result
+        finally:
+            self._inflight -= 1
+            release_file_lock(fd)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": self._inflight,
+            "executed": self.executed,
+            "joined": self.joined,
+            "replayed": self.replayed,
+        }
+
+
+idempotency_registry = IdempotencyRegistry()
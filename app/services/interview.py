@@ -1,25 +1,53 @@
 from __future__ import annotations
 
 import json
-import shutil
+import os
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Any
 
-from fastapi import UploadFile, HTTPException
+import numpy as np
+from fastapi import HTTPException, Request, UploadFile
 
+from app.core.admission import admission
+from app.core.executors import run_stage
+from app.core.metrics import current_timings, current_trace_id, timed
 from app.core.paths import SESSIONS_DIR
-from app.core.session_state import append_turn, load_state, save_state, make_turn
+from app.core.session_state import SessionState, make_turn
+from app.core.session_store import StateConflict, session_store
 from app.services.asr_whisper import asr_pipeline
-from app.services.llm_ollama import score_with_ollama
-from app.services.protocols import get_protocol_steps
-from app.repositories.db_repo import db_add_message, db_get_mmse_prompt
+from app.services.idempotency import audio_idempotency_key, digest_idempotency_key, idempotency_registry
+from app.services.protocols import get_protocol_step, get_protocol_steps
+from app.services.scoring import score_answer
+from app.services.scoring_queue import SCORING_ASYNC, ScoringJob, get_scoring_queue, write_score_and_turn
+from app.services.upload_stream import MAX_UPLOAD_BYTES, receive_upload, upload_suffix
+from app.repositories.db_repo import db_add_message, db_sync_messages
 
 
-async def handle_answer_audio(session_id: str, file: UploadFile, language: str = "it") -> dict:
+@dataclass
+class TurnContext:
+    session_id: str
+    session_dir: Path
+    language: str
+    state: SessionState
+    steps: list
+    step: Any
+
+    @property
+    def step_prefix(self) -> str:
+        return f"step{self.state.current_step:02d}_{self.step.step_id}"
+
+
+def begin_turn(session_id: str, language: str = "it") -> TurnContext | dict:
+    """
+    Carica sessione e step corrente.
+    Ritorna un dict (risposta finale) se la sessione non accetta altre risposte.
+    """
     session_dir = SESSIONS_DIR / session_id
-    if not session_dir.exists():
+    if not session_store.is_cached(session_dir) and not session_dir.exists():
         raise HTTPException(status_code=404, detail="Session not found. Create session first.")
 
-    state = load_state(session_dir)
+    state = session_store.get(session_dir)
     if state.completed:
         return {"session_id": session_id, "completed": True, "message": "Session already completed."}
 
@@ -27,51 +55,121 @@ async def handle_answer_audio(session_id: str, file: UploadFile, language: str =
 
     if state.current_step >= len(steps):
         state.completed = True
-        save_state(session_dir, state)
+        try:
+            session_store.compare_and_swap(session_dir, state.version, state)
+        except StateConflict:
+            pass  # già aggiornato da un altro turno
         return {"session_id": session_id, "completed": True, "message": "No more steps."}
 
-    step = steps[state.current_step]
+    return TurnContext(
+        session_id=session_id,
+        session_dir=session_dir,
+        language=language,
+        state=state,
+        steps=steps,
+        step=steps[state.current_step],
+    )
+
+
+def current_step_index(session_dir: Path) -> int:
+    """
+    Step a cui risponde la prossima richiesta, per la chiave di idempotenza di fallback.
+    Letto prima della chiave: un retry mentre l'originale è in corso vede lo stesso
+    step e lo raggiunge; dopo l'avanzamento serve l'header Idempotency-Key.
+    """
+    if not session_store.is_cached(session_dir) and not session_dir.exists():
+        raise HTTPException(status_code=404, detail="Session not found. Create session first.")
+    return session_store.get(session_dir).current_step
+
 
-    # 1) Salva audio utente
-    raw_dir = session_dir / "raw"
+def save_raw_audio(ctx: TurnContext, audio_bytes: bytes, suffix: str) -> Path:
+    raw_dir = ctx.session_dir / "raw"
     raw_dir.mkdir(parents=True, exist_ok=True)
 
-    suffix = Path(file.filename).suffix.lower() or ".bin"
-    input_path = raw_dir / f"step{state.current_step:02d}_{step.step_id}{suffix}"
+    input_path = raw_dir / f"{ctx.step_prefix}{suffix}"
+    input_path.write_bytes(audio_bytes)
+    return input_path
+
+
+def adopt_upload(ctx: TurnContext, tmp_path: Path, suffix: str) -> Path:
+    """Rinomina il file ricevuto in streaming con il nome dello step (nessuna copia)."""
+    input_path = ctx.session_dir / "raw" / f"{ctx.step_prefix}{suffix}"
+    os.replace(tmp_path, input_path)
+    return input_path
+
+
+def _advance_state(ctx: TurnContext) -> None:
+    """Avanza lo step con compare-and-swap sulla versione letta in begin_turn."""
+    state = ctx.state
+    new_state = SessionState(
+        protocol=state.protocol,
+        current_step=state.current_step + 1,
+        completed=state.current_step + 1 >= len(ctx.steps),
+        version=state.version,
+    )
     try:
-        with input_path.open("wb") as f:
-            shutil.copyfileobj(file.file, f)
-    finally:
-        await file.close()
+        ctx.state = session_store.compare_and_swap(ctx.session_dir, state.version, new_state)
+    except StateConflict:
+        raise HTTPException(
+            status_code=409,
+            detail="Lo stato della sessione è cambiato durante l'elaborazione della risposta.",
+        )
+
+
+def _write_turn_timings(meta_path: Path, trace_id: str, timings: dict) -> None:
+    if not meta_path.exists():
+        return
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    meta["trace_id"] = trace_id
+    meta["timings"] = timings
+    meta_path.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+async def finish_turn(
+    ctx: TurnContext,
+    input_path: Path,
+    audio_bytes: bytes,
+    audio: np.ndarray | None = None,
+    decoder: str | None = None,
+    transcribed: tuple | None = None,
+) -> dict:
+    """ASR finale, scoring, turno, avanzamento stato e messaggi (stage bloccanti sul proprio executor)."""
+    session_id = ctx.session_id
+    session_dir = ctx.session_dir
+    language = ctx.language
+    state = ctx.state
+    step = ctx.step
+    step_index = state.current_step
 
     # 2) ASR
+    step_out = f"out/{ctx.step_prefix}"
     try:
-        step_out = f"out/step{state.current_step:02d}_{step.step_id}"
-        transcript_path = asr_pipeline(
+        transcript_path = await run_stage(
+            "asr",
+            asr_pipeline,
             input_path,
             session_dir=session_dir,
             language=language,
             out_subdir=step_out,
+            audio_bytes=audio_bytes,
+            audio=audio,
+            decoder=decoder,
+            transcribed=transcribed,
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    transcript_text = transcript_path.read_text(encoding="utf-8").strip()
+    transcript_text = (await run_stage("io", transcript_path.read_text, encoding="utf-8")).strip()
     out_dir = session_dir / step_out
 
-    # 3) Scoring LLM
-    llm_score = score_with_ollama(str(state.current_step), step.question, transcript_text)
-    (out_dir / "llm_score.json").write_text(
-        json.dumps(llm_score, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
-
-    # 4) Salva turno
+    # 3) Turno (scritto insieme allo score)
     segments_path = out_dir / "segments.json"
     meta_path = out_dir / "meta.json"
 
     turn = make_turn(
-        step_index=state.current_step,
+        step_index=step_index,
         step_id=step.step_id,
         question=step.question,
         transcript=transcript_text,
@@ -80,21 +178,43 @@ async def handle_answer_audio(session_id: str, file: UploadFile, language: str =
         segments_path=str(segments_path),
         meta_path=str(meta_path),
     )
-    append_turn(session_dir, turn)
 
-    # 5) Avanza stato
-    state.current_step += 1
-    if state.current_step >= len(steps):
-        state.completed = True
-    save_state(session_dir, state)
+    # 4) Scoring inline (se non in background): calcolato prima, scritto solo a stato avanzato
+    if SCORING_ASYNC:
+        llm_score = None
+        score_status = "pending"
+    else:
+        with timed("scoring"):
+            llm_score = await score_answer(str(step_index), step.question, transcript_text)
+        score_status = "done"
+
+    # 5) Avanza stato: con un 409 qui non va registrato nessun turno né job di scoring
+    await run_stage("io", _advance_state, ctx)
+    state = ctx.state
+
+    if SCORING_ASYNC:
+        await get_scoring_queue().submit(
+            ScoringJob(
+                session_id=session_id,
+                session_dir=str(session_dir),
+                out_dir=str(out_dir),
+                step_index=step_index,
+                step_id=step.step_id,
+                question=step.question,
+                transcript=transcript_text,
+                turn=turn,
+            )
+        )
+    else:
+        await run_stage("io", write_score_and_turn, session_dir, out_dir, llm_score, turn)
 
     next_question = None
     reply_audio_url = None
 
     if not state.completed:
-        nxt = db_get_mmse_prompt(protocol="mmse_v1", lang=language, step=state.current_step)
-        next_question = nxt.text
-        reply_audio_url = f"/assets/{nxt.audio_relpath}"
+        nxt = get_protocol_step(state.protocol, language, state.current_step)
+        next_question = nxt.question
+        reply_audio_url = nxt.audio_url
 
     system_text = next_question if next_question else "Grazie. Il test è terminato."
 
@@ -102,6 +222,12 @@ async def handle_answer_audio(session_id: str, file: UploadFile, language: str =
     user_audio_url = f"/files/{session_id}/raw/{input_path.name}"
     db_add_message(session_id, "user", transcript_text, user_audio_url)
     db_add_message(session_id, "assistant", system_text, reply_audio_url)
+    await run_stage("db", db_sync_messages)
+
+    # 7) Tempi per stage nel meta.json dello step (stesso trace id della risposta)
+    trace_id = current_trace_id()
+    timings = current_timings()
+    await run_stage("io", _write_turn_timings, meta_path, trace_id, timings)
 
     return {
         "session_id": session_id,
@@ -113,4 +239,89 @@ async def handle_answer_audio(session_id: str, file: UploadFile, language: str =
         "system_text": system_text,
         "reply_audio_url": reply_audio_url,
         "llm_score": llm_score,
-    }
\ No newline at end of file
+        "score_status": score_status,
+        "trace_id": trace_id,
+        "timings": timings,
+    }
+
+
+async def handle_answer_audio(
+    session_id: str,
+    file: UploadFile,
+    language: str = "it",
+    idempotency_key: str | None = None,
+) -> dict:
+    try:
+        suffix = Path(file.filename).suffix.lower() or ".bin"
+        with timed("upload"):
+            audio_bytes = await file.read(MAX_UPLOAD_BYTES + 1)
+    finally:
+        await file.close()
+    if len(audio_bytes) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Audio troppo grande.")
+
+    async def _turn() -> dict:
+        # ammissione (backpressure), poi un solo turno alla volta per sessione
+        async with admission.admit("answer"), session_store.turn(SESSIONS_DIR / session_id):
+            ctx = await run_stage("io", begin_turn, session_id, language=language)
+            if isinstance(ctx, dict):
+                return ctx
+
+            # 1) Salva audio utente
+            input_path = await run_stage("io", save_raw_audio, ctx, audio_bytes, suffix)
+            return await finish_turn(ctx, input_path, audio_bytes)
+
+    # un retry (stessa chiave o stesso step + audio) non viene registrato come risposta allo step successivo
+    session_dir = SESSIONS_DIR / session_id
+    key = idempotency_key
+    if not key:
+        step_index = await run_stage("io", current_step_index, session_dir)
+        key = audio_idempotency_key(step_index, audio_bytes)
+    return await idempotency_registry.run(session_id, session_dir, key, _turn)
+
+
+async def handle_answer_upload(
+    session_id: str,
+    request: Request,
+    language: str = "it",
+    suffix: str | None = None,
+    idempotency_key: str | None = None,
+) -> dict:
+    """
+    Come handle_answer_audio ma con body raw in streaming: scrittura su disco,
+    hash e decodifica procedono mentre l'audio arriva.
+    """
+    session_dir = SESSIONS_DIR / session_id
+    if not session_store.is_cached(session_dir) and not session_dir.exists():
+        raise HTTPException(status_code=404, detail="Session not found. Create session first.")
+
+    upload = await receive_upload(
+        request,
+        session_dir / "raw",
+        upload_suffix(suffix, request.headers.get("content-type")),
+    )
+
+    async def _turn() -> dict:
+        async with admission.admit("answer"), session_store.turn(session_dir):
+            ctx = await run_stage("io", begin_turn, session_id, language=language)
+            if isinstance(ctx, dict):
+                return ctx
+
+            input_path = await run_stage("io", adopt_upload, ctx, upload.tmp_path, upload.suffix)
+            return await finish_turn(
+                ctx,
+                input_path,
+                upload.audio_bytes,
+                audio=upload.audio,
+                decoder=upload.decoder,
+            )
+
+    try:
+        key = idempotency_key
+        if not key:
+            step_index = await run_stage("io", current_step_index, session_dir)
+            key = digest_idempotency_key(step_index, upload.sha256)
+        return await idempotency_registry.run(session_id, session_dir, key, _turn)
+    finally:
+        # replay o turno rifiutato: il file temporaneo non è stato adottato
+        await run_stage("io", upload.tmp_path.unlink, missing_ok=True)
@@ -1,11 +1,15 @@
+from __future__ import annotations
+
 import json
-import urllib.request
+import os
 from typing import Dict
 import re
 
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
+from app.services.ollama_client import get_ollama_client
+
 WEEKDAY_IT = {
     0: "lunedì",
     1: "martedì",
@@ -40,8 +44,25 @@ def season_it_meteorological(month: int) -> str:
         return "estate"
     return "autunno"
 
-OLLAMA_URL = "http://localhost:11434/api/chat"
-OLLAMA_MODEL = "llama3.1"
+def temporal_ground_truth(dt: datetime | None = None) -> Dict:
+    """Valori corretti per l'orientamento temporale (step 0), timezone Europe/Rome."""
+    dt = dt or datetime.now(ZoneInfo("Europe/Rome"))
+    return {
+        "day": dt.day,
+        "month": dt.month,
+        "month_name": MONTH_IT[dt.month],
+        "year": dt.year,
+        "weekday": WEEKDAY_IT[dt.weekday()],
+        "season": season_it_meteorological(dt.month),
+    }
+
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/chat")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1")
+
+# Output strutturato: schema JSON come `format`, sampling deterministico,
+# generazione limitata e streaming interrotto appena il JSON è completo
+OLLAMA_STRUCTURED = os.getenv("OLLAMA_STRUCTURED", "1") == "1"
+OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", "128"))
 
 
 STEP_CONFIG: Dict[str, Dict] = {
@@ -116,7 +137,19 @@ def _normalize_step_id(step_id) -> str:
     return s
 
 
-def score_with_ollama(step_id: str, question: str, answer: str) -> dict:
+def score_schema(max_score: int) -> Dict:
+    return {
+        "type": "object",
+        "properties": {
+            "score": {"type": "integer", "minimum": 0, "maximum": max_score},
+            "max_score": {"type": "integer"},
+            "reason": {"type": "string"},
+        },
+        "required": ["score", "max_score", "reason"],
+    }
+
+
+async def score_with_ollama(step_id: str, question: str, answer: str) -> dict:
     step_key = _normalize_step_id(step_id)
     config = STEP_CONFIG.get(step_key)
 
@@ -126,6 +159,7 @@ def score_with_ollama(step_id: str, question: str, answer: str) -> dict:
             "score": 0,
             "max_score": 0,
             "reason": "step non configurato",
+            "error": True,
         }
 
     max_score = config["max_score"]
@@ -134,14 +168,14 @@ def score_with_ollama(step_id: str, question: str, answer: str) -> dict:
 
         # Ground truth per orientamento temporale (step 0)
     if step_key == "0":
-        dt = datetime.now(ZoneInfo("Europe/Rome"))
+        gt = temporal_ground_truth()
         rubric += (
             "\n\nVALORI CORRETTI (ground truth, timezone Europe/Rome):\n"
-            f"- giorno del mese: {dt.day}\n"
-            f"- mese: {MONTH_IT[dt.month]} ({dt.month})\n"
-            f"- anno: {dt.year}\n"
-            f"- giorno della settimana: {WEEKDAY_IT[dt.weekday()]}\n"
-            f"- stagione (meteorologica): {season_it_meteorological(dt.month)}\n"
+            f"- giorno del mese: {gt['day']}\n"
+            f"- mese: {gt['month_name']} ({gt['month']})\n"
+            f"- anno: {gt['year']}\n"
+            f"- giorno della settimana: {gt['weekday']}\n"
+            f"- stagione (meteorologica): {gt['season']}\n"
             "Assegna 1 punto per ciascun elemento correttamente indicato.\n"
             "Se l'utente fornisce più valori, considera corretto se include quello giusto.\n"
         )
@@ -173,24 +207,29 @@ def score_with_ollama(step_id: str, question: str, answer: str) -> dict:
         ],
     }
 
-    req = urllib.request.Request(
-        OLLAMA_URL,
-        data=json.dumps(payload).encode("utf-8"),
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
-
+    gen_stats = None
     try:
-        with urllib.request.urlopen(req, timeout=60) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
+        if OLLAMA_STRUCTURED:
+            payload["format"] = score_schema(max_score)
+            payload["options"] = {
+                "temperature": 0,
+                "top_k": 1,
+                "seed": 0,
+                "num_predict": OLLAMA_NUM_PREDICT,
+            }
+            content, gen_stats = await get_ollama_client().chat_json_stream(OLLAMA_URL, payload, step_key=step_key)
+        else:
+            data = await get_ollama_client().chat(OLLAMA_URL, payload, step_key=step_key)
+            content = (data.get("message") or {}).get("content", "")
     except Exception as e:
         return {
             "score": 0,
             "max_score": max_score,
             "reason": f"Errore chiamata LLM: {str(e)}",
+            "error": True,
         }
 
-    content = (data.get("message") or {}).get("content", "").strip()
+    content = content.strip()
 
     try:
         out = json.loads(content)
@@ -199,6 +238,7 @@ def score_with_ollama(step_id: str, question: str, answer: str) -> dict:
             "score": 0,
             "max_score": max_score,
             "reason": "LLM non ha restituito JSON valido",
+            "error": True,
         }
 
 
@@ -209,6 +249,7 @@ def score_with_ollama(step_id: str, question: str, answer: str) -> dict:
             "score": 0,
             "max_score": max_score,
             "reason": "Output LLM non valido",
+            "error": True,
         }
 
     score = out.get("score", 0)
@@ -220,8 +261,12 @@ def score_with_ollama(step_id: str, question: str, answer: str) -> dict:
     # Clamp sicurezza
     score = max(0, min(score, max_score))
 
-    return {
+    result = {
         "score": score,
         "max_score": max_score,
         "reason": reason,
-    }
\ No newline at end of file
+    }
+    if gen_stats is not None:
+        # token generati, time-to-first-token, durata, stop anticipato
+        result["llm"] = gen_stats
+    return result
\ No newline at end of file
@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, TypeVar
+
+import httpx
+
+from app.core.metrics import REGISTRY, record_timing
+
+T = TypeVar("T")
+
+OLLAMA_MAX_IN_FLIGHT = int(os.getenv("OLLAMA_MAX_IN_FLIGHT", "4"))
+OLLAMA_TIMEOUT_S = float(os.getenv("OLLAMA_TIMEOUT_S", "60"))
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "2"))
+OLLAMA_RETRY_BASE_S = float(os.getenv("OLLAMA_RETRY_BASE_S", "0.25"))
+# tiene il modello caricato in memoria tra un turno e l'altro
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+LLM_REQUESTS = REGISTRY.counter("screening_llm_requests_total", "Chiamate a Ollama per esito", ("step", "outcome"))
+LLM_REQUEST_SECONDS = REGISTRY.histogram("screening_llm_request_seconds", "Durata di un tentativo verso Ollama", ("step",))
+LLM_TTFT_SECONDS = REGISTRY.histogram("screening_llm_ttft_seconds", "Time-to-first-token in streaming", ("step",))
+
+
+class JsonObjectScanner:
+    """Rileva la fine del primo oggetto JSON top-level in un testo ricevuto a pezzi."""
+
+    def __init__(self) -> None:
+        self._buf: List[str] = []
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._done = False
+        self._start = 0
+        self._end = 0
+        self._pos = 0
+
+    def feed(self, piece: str) -> bool:
+        self._buf.append(piece)
+        if self._done:
+            return True
+        for ch in piece:
+            if self._started:
+                if self._in_string:
+                    if self._escape:
+                        self._escape = False
+                    elif ch == "\\":
+                        self._escape = True
+                    elif ch == '"':
+                        self._in_string = False
+                elif ch == '"':
+                    self._in_string = True
+                elif ch == "{":
+                    self._depth += 1
+                elif ch == "}":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._done = True
+                        self._end = self._pos + 1
+                        return True
+            elif ch == "{":
+                self._started = True
+                self._depth = 1
+                self._start = self._pos
+            self._pos += 1
+        return False
+
+    def text(self) -> str:
+        full = "".join(self._buf)
+        if self._done:
+            return full[self._start:self._end]
+        return full.strip()
+
+
+class OllamaClient:
+    """
+    Client HTTP asincrono condiviso verso Ollama: connessioni persistenti,
+    limite di richieste in volo, timeout per richiesta e retry con jitter.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = OLLAMA_MAX_IN_FLIGHT,
+        timeout_s: float = OLLAMA_TIMEOUT_S,
+        retries: int = OLLAMA_RETRIES,
+        retry_base_s: float = OLLAMA_RETRY_BASE_S,
+        keep_alive: str = OLLAMA_KEEP_ALIVE,
+    ):
+        self.max_in_flight = max(1, max_in_flight)
+        self.timeout_s = timeout_s
+        self.retries = max(0, retries)
+        self.retry_base_s = retry_base_s
+        self.keep_alive = keep_alive
+
+        self._client: httpx.AsyncClient | None = None
+        self._sem = asyncio.Semaphore(self.max_in_flight)
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_in_flight,
+                    max_keepalive_connections=self.max_in_flight,
+                ),
+                timeout=self.timeout_s,
+            )
+        return self._client
+
+    def _record(self, step_key: str, latency_s: float | None = None, error: bool = False, retry: bool = False) -> None:
+        outcome = "retry" if retry else ("error" if error else "ok")
+        LLM_REQUESTS.inc(step=step_key, outcome=outcome)
+        if latency_s is not None:
+            LLM_REQUEST_SECONDS.observe(latency_s, step=step_key)
+        with self._stats_lock:
+            st = self._stats.setdefault(
+                step_key,
+                {"requests": 0, "errors": 0, "retries": 0, "latency_sum_s": 0.0, "latency_max_s": 0.0},
+            )
+            if retry:
+                st["retries"] += 1
+                return
+            st["requests"] += 1
+            if error:
+                st["errors"] += 1
+            if latency_s is not None:
+                st["latency_sum_s"] += latency_s
+                st["latency_max_s"] = max(st["latency_max_s"], latency_s)
+
+    async def _with_retries(self, step_key: str, call: Callable[[], Awaitable[T]]) -> T:
+        t_queue = time.perf_counter()
+        async with self._sem:
+            t_start = time.perf_counter()
+            record_timing("llm.queue", t_start - t_queue)
+            try:
+                return await self._attempts(step_key, call)
+            finally:
+                record_timing("llm", time.perf_counter() - t_start)
+
+    async def _attempts(self, step_key: str, call: Callable[[], Awaitable[T]]) -> T:
+        attempt = 0
+        while True:
+            t0 = time.perf_counter()
+            try:
+                result = await call()
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                # 4xx (modello inesistente, payload errato) non si ritenta
+                retryable = not (
+                    isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500
+                )
+                if not retryable or attempt >= self.retries:
+                    self._record(step_key, time.perf_counter() - t0, error=True)
+                    raise
+                self._record(step_key, retry=True)
+                delay = self.retry_base_s * (2 ** attempt)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                attempt += 1
+                continue
+
+            self._record(step_key, time.perf_counter() - t0)
+            return result
+
+    async def chat(self, url: str, payload: Dict[str, Any], step_key: str = "-", timeout: float | None = None) -> Dict[str, Any]:
+        payload = {**payload, "keep_alive": self.keep_alive}
+        timeout = self.timeout_s if timeout is None else timeout
+
+        async def _call() -> Dict[str, Any]:
+            resp = await self._http().post(url, json=payload, timeout=timeout)
+            resp.raise_for_status()
+            return resp.json()
+
+        return await self._with_retries(step_key, _call)
+
+    async def chat_json_stream(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        step_key: str = "-",
+        timeout: float | None = None,
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        /api/chat in streaming: accumula il contenuto e chiude la risposta non appena
+        è arrivato un oggetto JSON completo, senza attendere la fine della generazione.
+        Ritorna (json_text, stats) con token generati e time-to-first-token.
+        """
+        payload = {**payload, "stream": True, "keep_alive": self.keep_alive}
+        timeout = self.timeout_s if timeout is None else timeout
+
+        async def _call() -> Tuple[str, Dict[str, Any]]:
+            scanner = JsonObjectScanner()
+            t0 = time.perf_counter()
+            ttft_s = None
+            tokens = 0
+            eval_count = None
+            stopped_early = False
+            async with self._http().stream("POST", url, json=payload, timeout=timeout) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    piece = (chunk.get("message") or {}).get("content", "")
+                    if piece:
+                        if ttft_s is None:
+                            ttft_s = time.perf_counter() - t0
+                        tokens += 1
+                        if scanner.feed(piece):
+                            stopped_early = not chunk.get("done", False)
+                            break
+                    if chunk.get("done"):
+                        eval_count = chunk.get("eval_count")
+                        break
+
+            stats = {
+                "tokens": eval_count if eval_count is not None else tokens,
+                "ttft_ms": round(ttft_s * 1000.0, 1) if ttft_s is not None else None,
+                "total_ms": round((time.perf_counter() - t0) * 1000.0, 1),
+                "stopped_early": stopped_early,
+            }
+            self._record_generation(step_key, stats)
+            return scanner.text(), stats
+
+        return await self._with_retries(step_key, _call)
+
+    def _record_generation(self, step_key: str, gen: Dict[str, Any]) -> None:
+        if gen["ttft_ms"] is not None:
+            LLM_TTFT_SECONDS.observe(gen["ttft_ms"] / 1000.0, step=step_key)
+        with self._stats_lock:
+            st = self._stats.setdefault(
+                step_key,
+                {"requests": 0, "errors": 0, "retries": 0, "latency_sum_s": 0.0, "latency_max_s": 0.0},
+            )
+            st["generations"] = st.get("generations", 0) + 1
+            st["tokens_sum"] = st.get("tokens_sum", 0) + int(gen["tokens"] or 0)
+            if gen["ttft_ms"] is not None:
+                st["ttft_sum_ms"] = st.get("ttft_sum_ms", 0.0) + gen["ttft_ms"]
+            if gen["stopped_early"]:
+                st["stopped_early"] = st.get("stopped_early", 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            per_step = {
+                k: {
+                    **v,
+                    "latency_avg_s": (v["latency_sum_s"] / v["requests"]) if v["requests"] else 0.0,
+                }
+                for k, v in self._stats.items()
+            }
+        return {
+            "max_in_flight": self.max_in_flight,
+            "timeout_s": self.timeout_s,
+            "retries": self.retries,
+            "keep_alive": self.keep_alive,
+            "steps": per_step,
+        }
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_client: OllamaClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_ollama_client() -> OllamaClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OllamaClient()
+    return _client
+
+
+async def close_ollama_client() -> None:
+    if _client is not None:
+        await _client.aclose()
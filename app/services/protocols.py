@@ -1,24 +1,32 @@
 from __future__ import annotations
 
+from typing import Tuple
+
 from fastapi import HTTPException
 
-from app.repositories.db_repo import db_list_mmse_prompts, ensure_mmse_prompts_exist
+from app.services.catalog import CatalogStep, get_catalog, normalize_lang
 
 
-def get_protocol_steps(protocol: str, lang: str = "it"):
-    lang = (lang or "it").lower()
-    if lang.startswith("it"):
-        lang = "it"
+def get_protocol_steps(protocol: str, lang: str = "it") -> Tuple[CatalogStep, ...]:
+    lang = normalize_lang(lang)
 
     if protocol != "mmse_v1":
         raise HTTPException(status_code=400, detail="Unknown protocol. Use protocol=mmse_v1")
 
-    ensure_mmse_prompts_exist(protocol="mmse_v1", lang=lang)
-    rows = db_list_mmse_prompts(protocol="mmse_v1", lang=lang)
-
-    class _Step:
-        def __init__(self, step_id: str, question: str):
-            self.step_id = step_id
-            self.question = question
-
-    return [_Step(step_id=f"mmse_step{r.step:02d}", question=r.text) for r in rows]
\ No newline at end of file
+    steps = get_catalog().steps(protocol, lang)
+    if not steps:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Nessun prompt MMSE trovato nel DB: protocol={protocol} lang={lang}",
+        )
+    return steps
+
+
+def get_protocol_step(protocol: str, lang: str, step: int) -> CatalogStep:
+    try:
+        return get_catalog().get(protocol, lang, step)
+    except KeyError:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Prompt MMSE mancante: protocol={protocol} lang={lang} step={step}",
+        )
@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+from app.services.scoring_cache import score_with_ollama_cached
+from app.services.scoring_rules import SCORING_RULES_MIN_CONFIDENCE, score_with_rules
+
+
+async def score_answer(step_id: str, question: str, answer: str) -> dict:
+    """
+    Scoring di una risposta: prima lo scorer deterministico (se esiste per lo step),
+    poi l'LLM (con cache dei risultati) solo quando la confidenza delle regole è bassa.
+    Stesso formato di score_with_ollama: {score, max_score, reason}.
+    """
+    rule = score_with_rules(step_id, answer)
+    if rule is not None and rule.confidence >= SCORING_RULES_MIN_CONFIDENCE:
+        return rule.to_dict()
+
+    return await score_with_ollama_cached(step_id, question, answer)
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from app.core.executors import run_stage
+from app.core.paths import DATA_ROOT
+from app.services.llm_ollama import (
+    OLLAMA_MODEL,
+    STEP_CONFIG,
+    _normalize_step_id,
+    score_with_ollama,
+    temporal_ground_truth,
+)
+from app.services.scoring_rules import normalize_text
+
+SCORING_CACHE_ENABLED = os.getenv("SCORING_CACHE_ENABLED", "1") == "1"
+SCORING_CACHE_PATH = Path(os.getenv("SCORING_CACHE_PATH", str(DATA_ROOT / "cache" / "scoring.sqlite")))
+SCORING_CACHE_TTL_S = float(os.getenv("SCORING_CACHE_TTL_S", str(30 * 24 * 3600)))
+SCORING_CACHE_MAX_ENTRIES = int(os.getenv("SCORING_CACHE_MAX_ENTRIES", "10000"))
+
+
+def rubric_hash(step_key: str) -> str:
+    config = STEP_CONFIG.get(step_key, {})
+    return hashlib.sha256(json.dumps(config, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def scoring_cache_key(step_key: str, answer: str) -> str:
+    parts: Dict[str, Any] = {
+        "step": step_key,
+        "answer": normalize_text(answer),
+        "model": OLLAMA_MODEL,
+        "rubric": rubric_hash(step_key),
+    }
+    if step_key == "0":
+        # la risposta corretta dipende dalla data
+        parts["ground_truth"] = temporal_ground_truth()
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ScoringCache:
+    """
+    Memoization persistente (SQLite) degli score LLM, con TTL ed eviction LRU.
+    La chiave include l'hash della rubric: se STEP_CONFIG cambia le vecchie entry
+    non vengono più trovate e vengono eliminate all'avvio.
+    """
+
+    def __init__(
+        self,
+        path: Path = SCORING_CACHE_PATH,
+        ttl_s: float = SCORING_CACHE_TTL_S,
+        max_entries: int = SCORING_CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scoring_cache ("
+            " key TEXT PRIMARY KEY,"
+            " step TEXT NOT NULL,"
+            " rubric_hash TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_scoring_cache_last_used ON scoring_cache(last_used)")
+        self.invalidate_stale()
+
+    def invalidate_stale(self) -> int:
+        """Elimina entry scadute o calcolate con una rubric diversa da quella attuale."""
+        removed = 0
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM scoring_cache WHERE created_at < ?", (time.time() - self.ttl_s,))
+            removed += cur.rowcount
+            for step_key in STEP_CONFIG:
+                cur = self._conn.execute(
+                    "DELETE FROM scoring_cache WHERE step = ? AND rubric_hash != ?",
+                    (step_key, rubric_hash(step_key)),
+                )
+                removed += cur.rowcount
+        return removed
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM scoring_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now - self.ttl_s:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE scoring_cache SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, step_key: str, value: dict) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scoring_cache (key, step, rubric_hash, value, created_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, step_key, rubric_hash(step_key), json.dumps(value, ensure_ascii=False), now, now),
+            )
+            # LRU: tiene solo le max_entries usate più di recente
+            self._conn.execute(
+                "DELETE FROM scoring_cache WHERE key IN ("
+                " SELECT key FROM scoring_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM scoring_cache").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "enabled": SCORING_CACHE_ENABLED,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+_cache: ScoringCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_scoring_cache() -> ScoringCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ScoringCache()
+    return _cache
+
+
+async def score_with_ollama_cached(step_id: str, question: str, answer: str) -> dict:
+    """score_with_ollama con memoization; gli errori LLM non vengono messi in cache."""
+    if not SCORING_CACHE_ENABLED:
+        return await score_with_ollama(step_id, question, answer)
+
+    step_key = _normalize_step_id(step_id)
+    key = scoring_cache_key(step_key, answer)
+    cache = get_scoring_cache()
+
+    cached = await run_stage("io", cache.get, key)
+    if cached is not None:
+        return {**cached, "cached": True}
+
+    result = await score_with_ollama(step_id, question, answer)
+    if not result.get("error"):
+        # le statistiche di generazione riguardano solo questa chiamata
+        value = {k: v for k, v in result.items() if k != "llm"}
+        await run_stage("io", cache.put, key, step_key, value)
+    return result
@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+
+from app.core.executors import run_stage
+from app.core.paths import SESSIONS_DIR
+from app.core.session_state import append_turn
+from app.core.session_store import session_store
+from app.services.llm_ollama import STEP_CONFIG
+from app.services.scoring import score_answer
+
+SCORING_ASYNC = os.getenv("SCORING_ASYNC", "1") == "1"
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "4"))
+SCORING_DRAIN_TIMEOUT_S = float(os.getenv("SCORING_DRAIN_TIMEOUT_S", "30"))
+
+PENDING_FILE = "pending_score.json"
+SCORE_FILE = "llm_score.json"
+
+_STEP_DIR_RE = re.compile(r"step(\d+)_(.+)")
+
+
+@dataclass
+class ScoringJob:
+    session_id: str
+    session_dir: str
+    out_dir: str
+    step_index: int
+    step_id: str
+    question: str
+    transcript: str
+    turn: Dict[str, Any]
+
+
+def write_score_and_turn(session_dir: Path, out_dir: Path, llm_score: dict, turn: dict) -> None:
+    (out_dir / SCORE_FILE).write_text(
+        json.dumps(llm_score, ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+    append_turn(session_dir, {**turn, "llm_score": llm_score})
+
+
+def _write_pending(job: ScoringJob) -> None:
+    (Path(job.out_dir) / PENDING_FILE).write_text(
+        json.dumps(asdict(job), ensure_ascii=False),
+        encoding="utf-8",
+    )
+
+
+def _complete_job(job: ScoringJob, llm_score: dict) -> None:
+    out_dir = Path(job.out_dir)
+    write_score_and_turn(Path(job.session_dir), out_dir, llm_score, job.turn)
+    (out_dir / PENDING_FILE).unlink(missing_ok=True)
+
+
+def max_total_score() -> int:
+    return sum(int(c["max_score"]) for c in STEP_CONFIG.values())
+
+
+def read_session_scores(session_dir: Path) -> List[Dict[str, Any]]:
+    """Stato degli score per step, letto dai file in out/ (sopravvive ai riavvii)."""
+    out_root = session_dir / "out"
+    if not out_root.exists():
+        return []
+
+    items = []
+    for d in sorted(p for p in out_root.iterdir() if p.is_dir()):
+        m = _STEP_DIR_RE.fullmatch(d.name)
+        if not m:
+            continue
+        item: Dict[str, Any] = {"step_index": int(m.group(1)), "step_id": m.group(2)}
+        score_path = d / SCORE_FILE
+        if score_path.exists():
+            item["status"] = "done"
+            item["llm_score"] = json.loads(score_path.read_text(encoding="utf-8"))
+        elif (d / PENDING_FILE).exists():
+            item["status"] = "pending"
+            item["llm_score"] = None
+        else:
+            continue
+        items.append(item)
+    return items
+
+
+class ScoringQueue:
+    """
+    Scoring in background: l'endpoint di risposta restituisce subito la prossima domanda,
+    lo score (regole o LLM) viene calcolato qui e scritto in llm_score.json + turno.
+    I job in sospeso sono marcati su disco (pending_score.json) e ripresi al riavvio.
+    """
+
+    def __init__(self, workers: int = SCORING_WORKERS):
+        self.workers = max(1, workers)
+        self._queue: "asyncio.Queue[ScoringJob]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._pending: Dict[str, Set[int]] = {}
+        # eventi solo per le sessioni con almeno un waiter registrato
+        self._events: Dict[str, asyncio.Event] = {}
+        self._waiters: Dict[str, int] = {}
+        self.completed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"scoring-{i}"))
+
+    async def stop(self, drain_timeout: float = SCORING_DRAIN_TIMEOUT_S) -> None:
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            # i job rimasti restano marcati pending su disco
+            pass
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def submit(self, job: ScoringJob) -> None:
+        await run_stage("io", _write_pending, job)
+        self._enqueue(job)
+
+    def _enqueue(self, job: ScoringJob) -> None:
+        self._pending.setdefault(job.session_id, set()).add(job.step_index)
+        self._queue.put_nowait(job)
+
+    async def recover(self) -> int:
+        """Riaccoda i job rimasti pending da un'esecuzione precedente."""
+        paths = await run_stage("io", lambda: list(SESSIONS_DIR.glob(f"*/out/*/{PENDING_FILE}")))
+        for p in paths:
+            try:
+                data = json.loads(p.read_text(encoding="utf-8"))
+                self._enqueue(ScoringJob(**data))
+            except (OSError, ValueError, TypeError):
+                continue
+        return len(paths)
+
+    def is_pending(self, session_id: str) -> bool:
+        return bool(self._pending.get(session_id))
+
+    def _notify(self, session_id: str) -> None:
+        ev = self._events.pop(session_id, None)
+        if ev is not None:
+            ev.set()
+
+    def update_event(self, session_id: str) -> asyncio.Event:
+        """
+        Evento segnalato al prossimo score completato della sessione (da prendere prima di leggere lo stato).
+        Ogni chiamata registra un waiter: va sempre chiusa con release_event().
+        """
+        self._waiters[session_id] = self._waiters.get(session_id, 0) + 1
+        return self._events.setdefault(session_id, asyncio.Event())
+
+    def release_event(self, session_id: str) -> None:
+        n = self._waiters.get(session_id, 0) - 1
+        if n > 0:
+            self._waiters[session_id] = n
+            return
+        self._waiters.pop(session_id, None)
+        self._events.pop(session_id, None)
+
+    @staticmethod
+    async def wait_for_update(ev: asyncio.Event, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(ev.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                llm_score = await score_answer(str(job.step_index), job.question, job.transcript)
+                await run_stage("io", _complete_job, job, llm_score)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                max_score = STEP_CONFIG.get(str(job.step_index), {}).get("max_score", 0)
+                fallback = {"score": 0, "max_score": max_score, "reason": f"Errore scoring: {e}"}
+                try:
+                    await run_stage("io", _complete_job, job, fallback)
+                except Exception:
+                    pass
+            finally:
+                steps = self._pending.get(job.session_id)
+                if steps is not None:
+                    steps.discard(job.step_index)
+                    if not steps:
+                        del self._pending[job.session_id]
+                self._notify(job.session_id)
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": SCORING_ASYNC,
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize(),
+            "pending_sessions": len(self._pending),
+            "waiters": sum(self._waiters.values()),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+_queue: ScoringQueue | None = None
+
+
+def get_scoring_queue() -> ScoringQueue:
+    global _queue
+    if _queue is None:
+        _queue = ScoringQueue()
+    return _queue
+
+
+async def session_scores(session_id: str, session_dir: Path) -> Dict[str, Any]:
+    items = await run_stage("io", read_session_scores, session_dir)
+    done = [i["llm_score"] for i in items if i["status"] == "done"]
+    return {
+        "session_id": session_id,
+        "steps": items,
+        "total": sum(int(s.get("score", 0)) for s in done),
+        "max_total": max_total_score(),
+        "pending": [i["step_index"] for i in items if i["status"] == "pending"],
+    }
+
+
+async def poll_session_scores(session_id: str, wait: float = 0.0) -> Dict[str, Any]:
+    """Snapshot degli score; con wait > 0 attende (long-poll) il prossimo score se ce ne sono in corso."""
+    session_dir = SESSIONS_DIR / session_id
+    if not session_dir.exists():
+        raise HTTPException(status_code=404, detail="Session not found.")
+
+    queue = get_scoring_queue()
+    if wait > 0 and queue.is_pending(session_id):
+        ev = queue.update_event(session_id)
+        try:
+            await queue.wait_for_update(ev, timeout=min(wait, 60.0))
+        finally:
+            queue.release_event(session_id)
+    return await session_scores(session_id, session_dir)
+
+
+async def stream_session_scores(websocket: WebSocket, session_id: str) -> None:
+    """Invia uno snapshot a ogni score completato; chiude quando la sessione è finita e tutto è valutato."""
+    await websocket.accept()
+    session_dir = SESSIONS_DIR / session_id
+    if not session_dir.exists():
+        await websocket.send_json({"type": "error", "status_code": 404, "detail": "Session not found."})
+        await websocket.close(code=1008)
+        return
+
+    queue = get_scoring_queue()
+    try:
+        while True:
+            ev = queue.update_event(session_id)
+            try:
+                snapshot = await session_scores(session_id, session_dir)
+                await websocket.send_json({"type": "scores", **snapshot})
+
+                state = await run_stage("io", session_store.get, session_dir)
+                if state.completed and not snapshot["pending"]:
+                    break
+                await queue.wait_for_update(ev, timeout=30.0)
+            finally:
+                queue.release_event(session_id)
+    except WebSocketDisconnect:
+        return
+    await websocket.close()
@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.services.llm_ollama import (
+    MONTH_IT,
+    STEP_CONFIG,
+    WEEKDAY_IT,
+    _normalize_step_id,
+    temporal_ground_truth,
+)
+
+# Sotto questa confidenza si delega a score_with_ollama
+SCORING_RULES_MIN_CONFIDENCE = float(os.getenv("SCORING_RULES_MIN_CONFIDENCE", "0.9"))
+
+# Soglie fuzzy (SequenceMatcher.ratio) per errori ASR
+FUZZY_MATCH = 0.8
+FUZZY_REJECT = 0.6
+
+HIGH = 1.0
+LOW = 0.5
+
+
+# ---------------------------------------------------------------------------
+# Normalizzazione testo italiano
+# ---------------------------------------------------------------------------
+
+def strip_accents(text: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def normalize_text(text: str) -> str:
+    """minuscolo, senza accenti, solo lettere/cifre separate da un singolo spazio"""
+    text = strip_accents(text.lower())
+    text = re.sub(r"[^a-z0-9]+", " ", text)
+    return text.strip()
+
+
+_UNITS = ["zero", "uno", "due", "tre", "quattro", "cinque", "sei", "sette", "otto", "nove"]
+_TEENS = ["dieci", "undici", "dodici", "tredici", "quattordici", "quindici", "sedici",
+          "diciassette", "diciotto", "diciannove"]
+_TENS = {2: "venti", 3: "trenta", 4: "quaranta", 5: "cinquanta",
+         6: "sessanta", 7: "settanta", 8: "ottanta", 9: "novanta"}
+
+
+def _words_below_100(n: int) -> List[str]:
+    if n < 10:
+        return [_UNITS[n]]
+    if n < 20:
+        return [_TEENS[n - 10]]
+    tens, unit = divmod(n, 10)
+    word = _TENS[tens]
+    if unit == 0:
+        return [word]
+    if unit in (1, 8):
+        # elisione: ventuno, trentotto (ASR a volte scrive anche "ventiuno")
+        return [word[:-1] + _UNITS[unit], word + _UNITS[unit]]
+    return [word + _UNITS[unit]]
+
+
+def _words_below_1000(n: int) -> List[str]:
+    if n < 100:
+        return _words_below_100(n)
+    hundreds, rest = divmod(n, 100)
+    head = "cento" if hundreds == 1 else _UNITS[hundreds] + "cento"
+    if rest == 0:
+        return [head]
+    out = []
+    for tail in _words_below_100(rest):
+        out.append(head + tail)
+        if tail.startswith("o"):
+            # centotto, centottanta
+            out.append(head[:-1] + tail)
+    return out
+
+
+def _build_number_words(limit: int = 3000) -> Dict[str, int]:
+    words: Dict[str, int] = {}
+    for n in range(limit):
+        thousands, rest = divmod(n, 1000)
+        if thousands == 0:
+            heads = [""]
+        elif thousands == 1:
+            heads = ["mille"]
+        else:
+            heads = [_UNITS[thousands] + "mila"]
+        tails = [""] if (rest == 0 and thousands) else _words_below_1000(rest)
+        for head in heads:
+            for tail in tails:
+                words.setdefault(head + tail, n)
+    words.update({"un": 1, "una": 1, "primo": 1})
+    return words
+
+
+NUMBER_WORDS = _build_number_words()
+
+
+def _is_tens(n: int) -> bool:
+    # ...20, ...30, ... ...90: può essere seguito da un'unità scritta a parte ("venti sei")
+    return n % 10 == 0 and n % 100 >= 20
+
+
+def parse_numbers(text: str, merge_compound: bool = False) -> Tuple[List[int], int]:
+    """
+    Come extract_numbers, ma ritorna anche quante decine + unità separate
+    ("settanta due" -> 72) sono state unite: l'ASR le spezza spesso, ma la
+    lettura resta ambigua (72 oppure 70, 2).
+    """
+    out: List[int] = []
+    splits = 0
+    prev_token_was_number = False
+    for tok in normalize_text(text).split():
+        if tok.isdigit():
+            value: Optional[int] = int(tok)
+        else:
+            value = NUMBER_WORDS.get(tok)
+        if value is None:
+            prev_token_was_number = False
+            continue
+
+        if prev_token_was_number and out:
+            left = out[-1]
+            if 1 <= value <= 9 and _is_tens(left) and (left < 100 or merge_compound):
+                out[-1] = left + value
+                splits += 1
+                prev_token_was_number = False
+                continue
+            if merge_compound and (
+                (left % 1000 == 0 and value < 1000) or (left % 100 == 0 and left < 1000 and value < 100)
+            ):
+                out[-1] = left + value
+                continue
+        out.append(value)
+        prev_token_was_number = True
+    return out, splits
+
+
+def extract_numbers(text: str, merge_compound: bool = False) -> List[int]:
+    """
+    Numeri in cifre o in lettere ("novantatré", "duemilaventisei").
+    Decine e unità separate ("venti sei") vengono sempre unite;
+    merge_compound unisce anche token tipo "duemila ventisei" -> 2026.
+    """
+    return parse_numbers(text, merge_compound)[0]
+
+
+def best_fuzzy(target: str, tokens: List[str]) -> float:
+    if not tokens:
+        return 0.0
+    return max(SequenceMatcher(None, target, t).ratio() for t in tokens)
+
+
+# ---------------------------------------------------------------------------
+# Scorer per step
+# ---------------------------------------------------------------------------
+
+@dataclass
+class RuleScore:
+    score: int
+    max_score: int
+    reason: str
+    confidence: float
+
+    def to_dict(self) -> Dict:
+        return {
+            "score": self.score,
+            "max_score": self.max_score,
+            "reason": self.reason,
+            "scorer": "rules",
+        }
+
+
+_MONTHS = {strip_accents(v): k for k, v in MONTH_IT.items()}
+_WEEKDAYS = {strip_accents(v) for v in WEEKDAY_IT.values()}
+_SEASONS = {"inverno", "primavera", "estate", "autunno"}
+
+WORDS_TARGET = ["casa", "pane", "gatto"]
+PHRASE_TARGET = "tigre contro tigre"
+
+
+def score_temporal_orientation(answer: str, max_score: int) -> RuleScore:
+    gt = temporal_ground_truth()
+    tokens = normalize_text(answer).split()
+    numbers, splits = parse_numbers(answer, merge_compound=True)
+
+    days = [n for n in numbers if 1 <= n <= 31]
+    years = [n for n in numbers if 1900 <= n <= 2100]
+    months = [_MONTHS[t] for t in tokens if t in _MONTHS]
+    weekdays = [t for t in tokens if t in _WEEKDAYS]
+    seasons = [t for t in tokens if t in _SEASONS]
+
+    checks = {
+        "giorno del mese": (bool(days), gt["day"] in days),
+        "mese": (bool(months), gt["month"] in months),
+        "anno": (bool(years), gt["year"] in years),
+        "giorno della settimana": (bool(weekdays), strip_accents(gt["weekday"]) in weekdays),
+        "stagione": (bool(seasons), gt["season"] in seasons),
+    }
+    score = sum(1 for _, ok in checks.values() if ok)
+    found = sum(1 for present, _ in checks.values() if present)
+
+    wrong = [k for k, (_, ok) in checks.items() if not ok]
+    reason = "Tutte le informazioni temporali corrette." if not wrong else "Errate o mancanti: " + ", ".join(wrong) + "."
+    # se un elemento manca del tutto potrebbe essere un errore ASR: decide l'LLM
+    confidence = HIGH if (score == max_score or found == len(checks)) and not splits else LOW
+    return RuleScore(score, max_score, reason, confidence)
+
+
+def score_word_list(answer: str, max_score: int) -> RuleScore:
+    tokens = normalize_text(answer).split()
+    matched, ambiguous = [], []
+    for target in WORDS_TARGET:
+        r = best_fuzzy(target, tokens)
+        if r >= FUZZY_MATCH:
+            matched.append(target)
+        elif r >= FUZZY_REJECT:
+            ambiguous.append(target)
+
+    score = min(len(matched), max_score)
+    reason = f"Parole riconosciute: {', '.join(matched) if matched else 'nessuna'}."
+    confidence = LOW if ambiguous else HIGH
+    return RuleScore(score, max_score, reason, confidence)
+
+
+def score_serial_sevens(answer: str, max_score: int) -> RuleScore:
+    # 100 e 7 sono quasi sempre la ripetizione della consegna ("cento meno sette")
+    parsed, splits = parse_numbers(answer)
+    numbers = [n for n in parsed if n < 100 and n != 7][:max_score]
+
+    prev = 100
+    score = 0
+    for n in numbers:
+        if n == prev - 7:
+            score += 1
+        prev = n
+
+    reason = f"Risultati: {', '.join(map(str, numbers)) if numbers else 'nessuno'}; sottrazioni corrette: {score}."
+    # con meno di 5 numeri riconosciuti la risposta è probabilmente incompleta o mal trascritta;
+    # decine e unità separate ("settanta due") sono ambigue: decide l'LLM
+    confidence = HIGH if len(numbers) >= max_score and not splits else LOW
+    return RuleScore(score, max_score, reason, confidence)
+
+
+def score_phrase_repetition(answer: str, max_score: int) -> RuleScore:
+    norm = normalize_text(answer)
+    if PHRASE_TARGET in norm:
+        return RuleScore(max_score, max_score, "Frase ripetuta correttamente.", HIGH)
+
+    r = SequenceMatcher(None, PHRASE_TARGET, norm).ratio()
+    if r >= 0.85:
+        return RuleScore(max_score, max_score, "Frase ripetuta con piccoli errori ASR.", HIGH)
+    if r <= 0.5:
+        return RuleScore(0, max_score, "Frase non ripetuta correttamente.", HIGH)
+    return RuleScore(0, max_score, "Frase parzialmente simile.", LOW)
+
+
+RULE_SCORERS: Dict[str, Callable[[str, int], RuleScore]] = {
+    "0": score_temporal_orientation,
+    "2": score_word_list,
+    "3": score_serial_sevens,
+    "4": score_word_list,
+    "5": score_phrase_repetition,
+}
+
+
+def score_with_rules(step_id: str, answer: str) -> Optional[RuleScore]:
+    """None se lo step non ha uno scorer deterministico."""
+    step_key = _normalize_step_id(step_id)
+    scorer = RULE_SCORERS.get(step_key)
+    config = STEP_CONFIG.get(step_key)
+    if scorer is None or config is None:
+        return None
+    return scorer(answer, config["max_score"])
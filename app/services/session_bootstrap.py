@@ -2,15 +2,16 @@ from __future__ import annotations
 
 from pathlib import Path
 
-from app.repositories.db_repo import db_add_message, db_get_mmse_prompt
+from app.repositories.db_repo import db_add_message
+from app.services.protocols import get_protocol_step
 
 
 def create_first_question(session_id: str, lang: str, session_dir: Path) -> dict:
-    # MMSE: prima domanda da DB + audio pre-generato
-    p0 = db_get_mmse_prompt(protocol="mmse_v1", lang=lang, step=0)
+    # MMSE: prima domanda dal catalogo (caricato dal DB) + audio pre-generato
+    p0 = get_protocol_step("mmse_v1", lang, 0)
 
-    first_question = p0.text
-    question_audio_url = f"/assets/{p0.audio_relpath}"
+    first_question = p0.question
+    question_audio_url = p0.audio_url
 
     db_add_message(session_id, "assistant", first_question, question_audio_url)
 
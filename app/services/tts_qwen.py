@@ -3,11 +3,10 @@ from __future__ import annotations
 from dataclasses import dataclass
 from pathlib import Path
 from threading import Lock
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-import soundfile as sf
-import torch
-from qwen_tts import Qwen3TTSModel
+if TYPE_CHECKING:
+    from qwen_tts import Qwen3TTSModel
 
 
 @dataclass
@@ -15,7 +14,7 @@ class TTSConfig:
     # modello più leggero per CPU (puoi cambiare dopo)
     model_id: str = "Qwen/Qwen3-TTS-12Hz-0.6B-CustomVoice"
     device_map: str = "cpu"
-    dtype: torch.dtype = torch.float32
+    dtype: str = "float32"  # nome di un dtype torch, risolto al caricamento
 
     # voce: puoi cambiarla in base a quelle disponibili
     speaker: str = "Ryan"
@@ -30,11 +29,15 @@ class QwenTTSService:
 
     def _load(self) -> Qwen3TTSModel:
         if self._model is None:
+            # torch / qwen_tts importati solo al primo uso
+            import torch
+            from qwen_tts import Qwen3TTSModel
+
             self._model = Qwen3TTSModel.from_pretrained(
                 self.cfg.model_id,
                 device_map=self.cfg.device_map,
-                dtype=self.cfg.dtype,
-            )  
+                dtype=getattr(torch, self.cfg.dtype),
+            )
         return self._model
 
     def synthesize_to_wav(self, text: str, out_wav_path: Path, language: Optional[str] = None, speaker: Optional[str] = None) -> Path:
@@ -51,6 +54,8 @@ class QwenTTSService:
                 speaker=spk,
                 instruct="",
             )
+            import soundfile as sf
+
             sf.write(str(out_wav_path), wavs[0], sr)
 
         return out_wav_path
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import queue
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from fastapi import HTTPException, Request
+
+from app.core.executors import run_stage
+from app.core.metrics import record_timing, timed
+from app.services.audio_decode import decode_stream_in_process
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+# un upload fermo per più di così viene interrotto (408)
+UPLOAD_IDLE_TIMEOUT_S = float(os.getenv("UPLOAD_IDLE_TIMEOUT_S", "30"))
+UPLOAD_STREAM_DECODE = os.getenv("UPLOAD_STREAM_DECODE", "1") == "1"
+# il decoder parte quando, alla velocità osservata, mancano al più questi secondi di upload:
+# un client lento non tiene occupato un thread dello stage "decode" per tutto il trasferimento
+UPLOAD_DECODE_LEAD_S = float(os.getenv("UPLOAD_DECODE_LEAD_S", "0.5"))
+
+CONTENT_TYPE_SUFFIX = {
+    "audio/webm": ".webm",
+    "audio/ogg": ".ogg",
+    "audio/wav": ".wav",
+    "audio/x-wav": ".wav",
+    "audio/wave": ".wav",
+    "audio/mpeg": ".mp3",
+    "audio/mp4": ".m4a",
+    "audio/aac": ".aac",
+    "audio/flac": ".flac",
+}
+
+
+class UploadStalled(Exception):
+    pass
+
+
+class ChunkPipe:
+    """
+    File-like non seekable (solo read()) alimentato dall'event loop con i chunk
+    della richiesta e letto dal thread del decoder.
+    """
+
+    def __init__(self, idle_timeout_s: float = UPLOAD_IDLE_TIMEOUT_S):
+        self.idle_timeout_s = idle_timeout_s
+        self._q: "queue.Queue[bytes | None]" = queue.Queue()
+        self._buf = b""
+        self._eof = False
+
+    def feed(self, chunk: bytes) -> None:
+        self._q.put(chunk)
+
+    def close_writer(self) -> None:
+        self._q.put(None)
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buf) < size):
+            try:
+                item = self._q.get(timeout=self.idle_timeout_s)
+            except queue.Empty:
+                raise UploadStalled("nessun dato ricevuto dal client")
+            if item is None:
+                self._eof = True
+            else:
+                self._buf += item
+            if size >= 0 and self._buf:
+                break
+        if size < 0 or size >= len(self._buf):
+            out, self._buf = self._buf, b""
+        else:
+            out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+
+@dataclass
+class ReceivedUpload:
+    tmp_path: Path
+    suffix: str
+    audio_bytes: bytes
+    sha256: str
+    audio: Optional[np.ndarray]
+    decoder: Optional[str]
+
+
+def upload_suffix(requested: str | None, content_type: str | None) -> str:
+    requested = (requested or "").lower()
+    if re.fullmatch(r"\.[a-z0-9]{1,8}", requested):
+        return requested
+    ctype = (content_type or "").split(";")[0].strip().lower()
+    return CONTENT_TYPE_SUFFIX.get(ctype, ".bin")
+
+
+def _decode_pipe(pipe: ChunkPipe) -> np.ndarray:
+    audio = decode_stream_in_process(pipe)
+    # il decoder può fermarsi prima dell'EOF: svuota la pipe per non bloccare nulla
+    pipe.read()
+    return audio
+
+
+def _decoder_due(total: int, expected: int | None, elapsed_s: float) -> bool:
+    """True se il resto del body (expected - total) arriverà entro UPLOAD_DECODE_LEAD_S."""
+    if expected is None or elapsed_s <= 0:
+        return False
+    rate = total / elapsed_s
+    return expected - total <= rate * UPLOAD_DECODE_LEAD_S
+
+
+async def receive_upload(request: Request, raw_dir: Path, suffix: str) -> ReceivedUpload:
+    """
+    Riceve il body della richiesta a chunk: ogni chunk viene scritto su disco
+    (raw/.upload-*.part), aggiunto all'hash e tenuto in memoria sull'event loop.
+    Il decoder (thread dello stage "decode") parte solo verso la fine del
+    trasferimento, quando il resto del body è atteso entro UPLOAD_DECODE_LEAD_S,
+    oppure a body completo se la lunghezza non è nota: decodifica il prefisso
+    già ricevuto in parallelo alla coda. Se la decodifica in streaming fallisce
+    (es. mp4 con moov in coda) resta il fallback in asr_pipeline sui byte completi.
+    """
+    declared = request.headers.get("content-length")
+    expected = int(declared) if declared and declared.isdigit() else None
+    if expected is not None and expected > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Audio troppo grande.")
+
+    await run_stage("io", raw_dir.mkdir, parents=True, exist_ok=True)
+    tmp_path = raw_dir / f".upload-{uuid.uuid4().hex}.part"
+    f = await run_stage("io", open, tmp_path, "wb")
+
+    pipe = ChunkPipe()
+    decode_task: asyncio.Task | None = None
+    chunks = []
+
+    def start_decoder() -> asyncio.Task:
+        for c in chunks:
+            pipe.feed(c)
+        return asyncio.create_task(run_stage("decode", _decode_pipe, pipe))
+
+    t0 = time.perf_counter()
+    hasher = hashlib.sha256()
+    total = 0
+    ok = False
+    try:
+        body = request.stream().__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(body.__anext__(), timeout=UPLOAD_IDLE_TIMEOUT_S)
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=408, detail="Upload interrotto: nessun dato ricevuto.")
+            if not chunk:
+                continue
+            total += len(chunk)
+            if total > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail="Audio troppo grande.")
+
+            hasher.update(chunk)
+            chunks.append(chunk)
+            if decode_task is not None:
+                pipe.feed(chunk)
+            elif UPLOAD_STREAM_DECODE and _decoder_due(total, expected, time.perf_counter() - t0):
+                decode_task = start_decoder()
+            await run_stage("io", f.write, chunk)
+
+        if total == 0:
+            raise HTTPException(status_code=400, detail="Body vuoto.")
+        if UPLOAD_STREAM_DECODE and decode_task is None:
+            decode_task = start_decoder()
+        ok = True
+    finally:
+        pipe.close_writer()
+        await run_stage("io", f.close)
+        if not ok:
+            if decode_task is not None:
+                decode_task.cancel()
+            await run_stage("io", tmp_path.unlink, missing_ok=True)
+
+    record_timing("upload", time.perf_counter() - t0)
+
+    audio = None
+    decoder = None
+    if decode_task is not None:
+        try:
+            with timed("decode_tail"):
+                # resto della decodifica dopo l'ultimo byte ricevuto
+                audio = await decode_task
+            decoder = "pyav-stream"
+        except Exception:
+            audio = None
+        if audio is not None and audio.size == 0:
+            audio = None
+
+    return ReceivedUpload(
+        tmp_path=tmp_path,
+        suffix=suffix,
+        audio_bytes=b"".join(chunks),
+        sha256=hasher.hexdigest(),
+        audio=audio,
+        decoder=decoder if audio is not None else None,
+    )
@@ -0,0 +1,361 @@
+"""
+Benchmark end-to-end: sessioni complete (POST /sessions + answer_audio fino a
+fine protocollo) a diversi livelli di concorrenza, contro un Ollama finto.
+
+Esempi:
+  # avvia da sé fake Ollama + server, scrive la baseline
+  python scripts/bench_load.py --spawn --concurrency 1,4,16 --out bench/baseline.json
+
+  # server già in esecuzione, confronto con la baseline (exit 1 se peggiora)
+  python scripts/bench_load.py --base-url http://127.0.0.1:8000 --compare bench/baseline.json
+
+Report per livello: throughput, p50/p95/p99 per endpoint e per stage (dai
+"timings" della risposta) e RSS di picco del server (da /metrics).
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import random
+import re
+import socket
+import struct
+import subprocess
+import sys
+import time
+import wave
+from array import array
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+PROMPTS_DIR = ROOT / "data" / "prompts" / "mmse_v1" / "it"
+MAX_STEPS = 32
+
+
+# ---- audio delle risposte ----
+
+def load_prompt_answers() -> List[bytes]:
+    files = sorted(PROMPTS_DIR.glob("*.wav"))
+    if not files:
+        raise SystemExit(f"Nessun wav in {PROMPTS_DIR}: usare --audio synthetic")
+    return [f.read_bytes() for f in files]
+
+
+def synthetic_answer(seed: int, seconds: float = 3.0, rate: int = 16000) -> bytes:
+    """Tono + rumore, PCM16 mono: abbastanza per esercitare decode e Whisper."""
+    rnd = random.Random(seed)
+    freq = 180.0 + 40.0 * seed
+    samples = array(
+        "h",
+        (
+            int(6000 * math.sin(2 * math.pi * freq * i / rate) + rnd.uniform(-800, 800))
+            for i in range(int(seconds * rate))
+        ),
+    )
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes())
+    return buf.getvalue()
+
+
+def make_unique(wav_bytes: bytes) -> bytes:
+    """Altera l'ultimo campione: evita hit della cache ASR e dell'idempotenza tra richieste."""
+    if len(wav_bytes) < 48:
+        return wav_bytes
+    return wav_bytes[:-2] + struct.pack("<h", random.randint(-32768, 32767))
+
+
+# ---- statistiche ----
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = max(0, min(len(s) - 1, math.ceil(p / 100.0 * len(s)) - 1))
+    return s[k]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "n": len(values),
+        "mean": round(sum(values) / len(values), 4) if values else 0.0,
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "max": round(max(values), 4) if values else 0.0,
+    }
+
+
+class LevelRecorder:
+    def __init__(self):
+        self.latency: Dict[str, List[float]] = {"create": [], "answer": []}
+        self.stages: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.sessions_done = 0
+
+    def error(self, what: str, status) -> None:
+        key = f"{what}:{status}"
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+
+# ---- carico ----
+
+async def run_session(client: httpx.AsyncClient, answers: List[bytes], rec: LevelRecorder, unique: bool) -> None:
+    t0 = time.perf_counter()
+    r = await client.post("/sessions", params={"lang": "it"})
+    rec.latency["create"].append(time.perf_counter() - t0)
+    if r.status_code != 200:
+        rec.error("create", r.status_code)
+        return
+    session_id = r.json()["session_id"]
+
+    for step in range(MAX_STEPS):
+        audio = answers[step % len(answers)]
+        if unique:
+            audio = make_unique(audio)
+        t0 = time.perf_counter()
+        try:
+            r = await client.post(
+                f"/sessions/{session_id}/answer_audio",
+                files={"file": (f"answer{step:02d}.wav", audio, "audio/wav")},
+            )
+        except httpx.HTTPError as e:
+            rec.error("answer", type(e).__name__)
+            return
+        rec.latency["answer"].append(time.perf_counter() - t0)
+        if r.status_code != 200:
+            rec.error("answer", r.status_code)
+            return
+        data = r.json()
+        for stage, seconds in (data.get("timings") or {}).items():
+            rec.stages.setdefault(stage, []).append(float(seconds))
+        if data.get("completed"):
+            rec.sessions_done += 1
+            return
+
+
+async def peak_rss_bytes(client: httpx.AsyncClient) -> Optional[int]:
+    try:
+        r = await client.get("/metrics")
+    except httpx.HTTPError:
+        return None
+    m = re.search(r"^process_peak_rss_bytes (\d+)", r.text, re.MULTILINE)
+    return int(m.group(1)) if m else None
+
+
+async def run_level(base_url: str, concurrency: int, sessions: int, answers: List[bytes], unique: bool, timeout: float) -> Dict:
+    rec = LevelRecorder()
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(sessions):
+        queue.put_nowait(i)
+
+    limits = httpx.Limits(max_connections=concurrency + 2, max_keepalive_connections=concurrency + 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+
+        async def worker() -> None:
+            while True:
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await run_session(client, answers, rec, unique)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        duration = time.perf_counter() - t0
+        rss = await peak_rss_bytes(client)
+
+    answered = len(rec.latency["answer"])
+    return {
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "sessions_completed": rec.sessions_done,
+        "answers": answered,
+        "errors": rec.errors,
+        "duration_s": round(duration, 3),
+        "throughput_answers_s": round(answered / duration, 4) if duration else 0.0,
+        "throughput_sessions_s": round(rec.sessions_done / duration, 4) if duration else 0.0,
+        "latency_s": {k: summarize(v) for k, v in rec.latency.items()},
+        "stages_s": {k: summarize(v) for k, v in sorted(rec.stages.items())},
+        "peak_rss_bytes": rss,
+    }
+
+
+# ---- processi locali (--spawn) ----
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_http(url: str, timeout_s: float) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"{url} non risponde entro {timeout_s}s")
+
+
+def spawn_stack(args) -> List[subprocess.Popen]:
+    ollama_port = free_port()
+    server_port = free_port()
+    procs = [
+        subprocess.Popen(
+            [
+                sys.executable, str(ROOT / "scripts" / "fake_ollama.py"),
+                "--port", str(ollama_port),
+                "--latency-ms", str(args.ollama_latency_ms),
+                "--jitter-ms", str(args.ollama_jitter_ms),
+            ],
+            cwd=str(ROOT),
+        )
+    ]
+    env = {**os.environ, "OLLAMA_URL": f"http://127.0.0.1:{ollama_port}/api/chat"}
+    procs.append(
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(server_port), "--log-level", "warning"],
+            cwd=str(ROOT),
+            env=env,
+        )
+    )
+    args.base_url = f"http://127.0.0.1:{server_port}"
+    wait_http(f"http://127.0.0.1:{ollama_port}/api/tags", 30)
+    # /ready risponde 503 finché i modelli non sono caricati
+    wait_http(args.base_url + "/ready", args.startup_timeout_s)
+    return procs
+
+
+# ---- baseline ----
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Regressioni: throughput sotto (1 - tol) o p95 di answer sopra (1 + tol) rispetto alla baseline."""
+    regressions = []
+    base_levels = {lv["concurrency"]: lv for lv in baseline.get("levels", [])}
+    for lv in current["levels"]:
+        base = base_levels.get(lv["concurrency"])
+        if base is None:
+            continue
+        c = lv["concurrency"]
+        if lv["throughput_answers_s"] < base["throughput_answers_s"] * (1 - tolerance):
+            regressions.append(
+                f"c={c}: throughput {lv['throughput_answers_s']} < baseline {base['throughput_answers_s']}"
+            )
+        p95, base_p95 = lv["latency_s"]["answer"]["p95"], base["latency_s"]["answer"]["p95"]
+        if base_p95 and p95 > base_p95 * (1 + tolerance):
+            regressions.append(f"c={c}: answer p95 {p95}s > baseline {base_p95}s")
+        if sum(lv["errors"].values()) > sum(base["errors"].values()):
+            regressions.append(f"c={c}: errori {lv['errors']} (baseline {base['errors']})")
+    return regressions
+
+
+def print_level(lv: Dict) -> None:
+    ans = lv["latency_s"]["answer"]
+    rss = lv["peak_rss_bytes"]
+    print(
+        f"c={lv['concurrency']:<3} sessions={lv['sessions_completed']}/{lv['sessions']} answers={lv['answers']} "
+        f"thr={lv['throughput_answers_s']}/s p50={ans['p50']}s p95={ans['p95']}s p99={ans['p99']}s "
+        f"rss_peak={(rss / 2**20) if rss else float('nan'):.0f}MiB errors={lv['errors']}"
+    )
+    for stage, st in lv["stages_s"].items():
+        print(f"      {stage:<22} p50={st['p50']:<8} p95={st['p95']:<8} p99={st['p99']}")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=str(ROOT), capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test end-to-end delle sessioni MMSE")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true", help="avvia fake Ollama + uvicorn su porte libere")
+    parser.add_argument("--concurrency", default="1,4,16", help="livelli separati da virgola")
+    parser.add_argument("--sessions", type=int, default=0, help="sessioni per livello (default: 2 x concorrenza)")
+    parser.add_argument("--audio", choices=["prompts", "synthetic"], default="prompts")
+    parser.add_argument("--allow-cache", action="store_true", help="invia audio identici (cache ASR attiva)")
+    parser.add_argument("--request-timeout-s", type=float, default=600.0)
+    parser.add_argument("--startup-timeout-s", type=float, default=300.0)
+    parser.add_argument("--ollama-latency-ms", type=float, default=800.0)
+    parser.add_argument("--ollama-jitter-ms", type=float, default=200.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="file JSON del risultato (baseline)")
+    parser.add_argument("--compare", help="baseline JSON con cui confrontare")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    answers = load_prompt_answers() if args.audio == "prompts" else [synthetic_answer(i) for i in range(6)]
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    procs: List[subprocess.Popen] = []
+    try:
+        if args.spawn:
+            procs = spawn_stack(args)
+
+        result = {
+            "meta": {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "git_revision": git_revision(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+                "audio": args.audio,
+                "allow_cache": args.allow_cache,
+                "ollama_latency_ms": args.ollama_latency_ms if args.spawn else None,
+            },
+            "levels": [],
+        }
+        for c in levels:
+            sessions = args.sessions or 2 * c
+            lv = asyncio.run(
+                run_level(args.base_url, c, sessions, answers, not args.allow_cache, args.request_timeout_s)
+            )
+            print_level(lv)
+            result["levels"].append(lv)
+    finally:
+        for p in reversed(procs):
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+    if args.out:
+        out = Path(args.out)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+        print(f"Risultato scritto in {out}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print("REGRESSIONI:")
+            for r in regressions:
+                print(f"  - {r}")
+            sys.exit(1)
+        print(f"Nessuna regressione rispetto a {args.compare} (tolleranza {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Stand-in locale di Ollama per i benchmark: risponde a /api/chat (anche in
+streaming) con uno score JSON valido dopo una latenza configurabile.
+
+Uso:
+  python scripts/fake_ollama.py --port 11435 --latency-ms 800 --jitter-ms 200
+  OLLAMA_URL=http://127.0.0.1:11435/api/chat uvicorn app.main:app
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STATS = {"requests": 0, "streamed": 0}
+STATS_LOCK = threading.Lock()
+
+
+def _max_score(payload: dict) -> int:
+    # schema strutturato (format) se presente, altrimenti dal prompt
+    fmt = payload.get("format")
+    if isinstance(fmt, dict):
+        maximum = fmt.get("properties", {}).get("score", {}).get("maximum")
+        if isinstance(maximum, int):
+            return maximum
+    for m in payload.get("messages", []):
+        found = re.search(r"max_score\D{0,20}(\d+)", str(m.get("content", "")))
+        if found:
+            return int(found.group(1))
+    return 1
+
+
+def make_handler(args):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *a):
+            if args.verbose:
+                super().log_message(*a)
+
+        def _send_json(self, status: int, obj: dict) -> None:
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json(200, {"models": [{"name": args.model}]})
+            elif self.path == "/stats":
+                with STATS_LOCK:
+                    self._send_json(200, dict(STATS))
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/api/chat":
+                self._send_json(404, {"error": "not found"})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+
+            if args.error_rate and random.random() < args.error_rate:
+                self._send_json(503, {"error": "fake overload"})
+                return
+
+            max_score = _max_score(payload)
+            answer = json.dumps(
+                {"score": random.randint(0, max_score), "max_score": max_score, "reason": "risposta simulata"},
+                ensure_ascii=False,
+            )
+            latency_s = max(0.0, args.latency_ms + random.uniform(-args.jitter_ms, args.jitter_ms)) / 1000.0
+            stream = bool(payload.get("stream", False))
+
+            with STATS_LOCK:
+                STATS["requests"] += 1
+                STATS["streamed"] += int(stream)
+
+            if not stream:
+                time.sleep(latency_s)
+                self._send_json(
+                    200,
+                    {
+                        "model": payload.get("model", args.model),
+                        "message": {"role": "assistant", "content": answer},
+                        "done": True,
+                        "eval_count": len(answer) // 4,
+                    },
+                )
+                return
+
+            # streaming NDJSON: ttft, poi un "token" ogni 4 caratteri
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            ttft_s = min(latency_s, args.ttft_ms / 1000.0)
+            pieces = [answer[i:i + 4] for i in range(0, len(answer), 4)]
+            per_piece_s = (latency_s - ttft_s) / max(1, len(pieces))
+            time.sleep(ttft_s)
+            try:
+                for i, piece in enumerate(pieces):
+                    if i:
+                        time.sleep(per_piece_s)
+                    self._chunk({"message": {"role": "assistant", "content": piece}, "done": False})
+                self._chunk({"message": {"role": "assistant", "content": ""}, "done": True, "eval_count": len(pieces)})
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # il client chiude appena il JSON è completo
+                self.close_connection = True
+
+        def _chunk(self, obj: dict) -> None:
+            data = json.dumps(obj).encode("utf-8") + b"\n"
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama /api/chat per benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="latenza totale media di una risposta")
+    parser.add_argument("--jitter-ms", type=float, default=200.0)
+    parser.add_argument("--ttft-ms", type=float, default=150.0, help="time-to-first-token in streaming")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="frazione di risposte 503")
+    parser.add_argument("--model", default="llama3.1")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args))
+    server.daemon_threads = True
+    print(f"Fake Ollama su http://{args.host}:{args.port}/api/chat (latency {args.latency_ms}±{args.jitter_ms} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+
+from app.core.paths import SESSIONS_DIR
+from app.core.session_state import turns_log_path, turns_path
+
+
+def migrate_session(session_dir, dry_run: bool = False) -> int:
+    """
+    turns.json (array) -> turns.jsonl (append-only).
+    I turni legacy vengono messi prima di quelli già presenti nel log;
+    il vecchio file resta come turns.json.bak.
+    Da eseguire a server fermo.
+    """
+    legacy = turns_path(session_dir)
+    if not legacy.exists():
+        return 0
+
+    turns = json.loads(legacy.read_text(encoding="utf-8"))
+    if dry_run:
+        return len(turns)
+
+    log = turns_log_path(session_dir)
+    existing = log.read_bytes() if log.exists() else b""
+
+    tmp = log.with_suffix(".jsonl.tmp")
+    with tmp.open("wb") as f:
+        for t in turns:
+            f.write((json.dumps(t, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+        f.write(existing)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, log)
+    os.replace(legacy, legacy.with_suffix(".json.bak"))
+    return len(turns)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Converte turns.json delle sessioni nel log append-only turns.jsonl")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    sessions = migrated = turns = 0
+    for session_dir in sorted(p for p in SESSIONS_DIR.iterdir() if p.is_dir()):
+        n = migrate_session(session_dir, dry_run=args.dry_run)
+        sessions += 1
+        if n:
+            migrated += 1
+            turns += n
+            print(f"{session_dir.name}: {n} turni")
+
+    action = "da migrare" if args.dry_run else "migrate"
+    print(f"Sessioni: {sessions}, {action}: {migrated}, turni: {turns}")
+
+
+if __name__ == "__main__":
+    main()
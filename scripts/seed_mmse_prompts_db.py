@@ -1,3 +1,7 @@
+import argparse
+import os
+import urllib.request
+
 from app.db import SessionLocal, init_db
 from app.models import PromptAssetDB
 
@@ -11,7 +15,25 @@ def mmse_prompts_it_spoken():
         (5, "Ripeta questa frase: tigre contro tigre."),
     ]
 
+def notify_server(base_url: str, token: str | None) -> None:
+    # il server tiene il catalogo in memoria: va ricaricato dopo il seed
+    req = urllib.request.Request(f"{base_url.rstrip('/')}/admin/catalog/reload", method="POST")
+    if token:
+        req.add_header("X-Admin-Token", token)
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        print(f"Catalogo ricaricato su {base_url}: {resp.read().decode('utf-8')}")
+
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--reload-url",
+        help="es. http://localhost:8000: ricarica il catalogo del server in esecuzione "
+        "(senza, il server vede i nuovi prompt solo al riavvio)",
+    )
+    parser.add_argument("--admin-token", default=os.getenv("ADMIN_TOKEN"), help="X-Admin-Token (default: $ADMIN_TOKEN)")
+    args = parser.parse_args()
+
     init_db()
 
     db = SessionLocal()
@@ -47,6 +69,11 @@ def main():
     finally:
         db.close()
 
+    if args.reload_url:
+        notify_server(args.reload_url, args.admin_token)
+    else:
+        print("Catalogo del server non ricaricato: usare --reload-url oppure riavviare il server.")
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
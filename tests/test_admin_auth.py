@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("numpy")
+pytest.importorskip("multipart")
+
+from fastapi import HTTPException
+
+from app.api import routes
+
+
+def request_from(host: str):
+    return SimpleNamespace(client=SimpleNamespace(host=host))
+
+
+def status(host: str, token: str | None = None) -> int:
+    try:
+        routes.require_admin(request_from(host), token)
+    except HTTPException as e:
+        return e.status_code
+    return 200
+
+
+def test_without_token_admin_is_disabled(monkeypatch):
+    monkeypatch.setattr(routes, "ADMIN_TOKEN", "")
+    monkeypatch.setattr(routes, "ADMIN_ALLOW_LOOPBACK", False)
+    # dietro un reverse proxy locale ogni richiesta arriva da loopback
+    assert status("127.0.0.1") == 403
+
+
+def test_loopback_only_with_explicit_opt_in(monkeypatch):
+    monkeypatch.setattr(routes, "ADMIN_TOKEN", "")
+    monkeypatch.setattr(routes, "ADMIN_ALLOW_LOOPBACK", True)
+    assert status("127.0.0.1") == 200
+    assert status("10.0.0.7") == 403
+
+
+def test_token_is_checked(monkeypatch):
+    monkeypatch.setattr(routes, "ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(routes, "ADMIN_ALLOW_LOOPBACK", True)
+    assert status("127.0.0.1") == 401
+    assert status("127.0.0.1", "sbagliato") == 401
+    assert status("10.0.0.7", "s3cret") == 200
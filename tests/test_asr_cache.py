@@ -0,0 +1,71 @@
+from app.services.asr_cache import AsrResultCache, asr_cache_key
+
+SEGMENTS = [{"start": 0.0, "end": 1.2, "text": "casa pane gatto"}]
+
+
+def key(audio: bytes) -> str:
+    return asr_cache_key(audio, "it", "small", "int8")
+
+
+def test_put_then_get(tmp_path):
+    cache = AsrResultCache(root=tmp_path)
+    cache.put(key(b"a"), "casa pane gatto", SEGMENTS, {"language": "it"})
+
+    assert cache.get(key(b"a")) == ("casa pane gatto", SEGMENTS, {"language": "it"})
+    assert cache.get(key(b"b")) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_key_depends_on_language_and_model():
+    assert asr_cache_key(b"a", "it", "small", "int8") != asr_cache_key(b"a", "en", "small", "int8")
+    assert asr_cache_key(b"a", "it", "small", "int8") != asr_cache_key(b"a", "it", "medium", "int8")
+
+
+def test_entry_written_by_another_worker_is_adopted(tmp_path):
+    worker_a = AsrResultCache(root=tmp_path)
+    worker_b = AsrResultCache(root=tmp_path)
+    worker_a.put(key(b"a"), "ciao", [], {})
+
+    assert worker_b.get(key(b"a")) == ("ciao", [], {})
+    stats = worker_b.stats()
+    assert stats["hits"] == 1
+    assert stats["adopted"] == 1
+    assert stats["entries"] == 1
+    assert stats["bytes"] > 0
+
+
+def test_entry_evicted_by_another_worker_is_a_miss(tmp_path):
+    worker_a = AsrResultCache(root=tmp_path)
+    worker_b = AsrResultCache(root=tmp_path)
+    worker_a.put(key(b"a"), "ciao", [], {})
+    assert worker_b.get(key(b"a")) is not None
+
+    (tmp_path / f"{key(b'a')}.json").unlink()
+    assert worker_b.get(key(b"a")) is None
+    assert worker_b.stats()["entries"] == 0
+    assert worker_b.stats()["bytes"] == 0
+
+
+def test_lru_eviction_respects_byte_bound(tmp_path):
+    probe = AsrResultCache(root=tmp_path / "probe")
+    probe.put("x", "t" * 100, [], {})
+    entry_size = probe.stats()["bytes"]
+
+    cache = AsrResultCache(root=tmp_path / "lru", max_bytes=2 * entry_size)
+    for name in ("a", "b"):
+        cache.put(key(name.encode()), "t" * 100, [], {})
+    cache.get(key(b"a"))  # "b" diventa la meno recente
+    cache.put(key(b"c"), "t" * 100, [], {})
+
+    assert cache.evictions == 1
+    assert cache.get(key(b"b")) is None
+    assert cache.get(key(b"a")) is not None
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+
+def test_index_is_rebuilt_from_disk(tmp_path):
+    AsrResultCache(root=tmp_path).put(key(b"a"), "ciao", [], {})
+    reopened = AsrResultCache(root=tmp_path)
+    assert reopened.stats()["entries"] == 1
+    assert reopened.get(key(b"a")) is not None
+    assert reopened.adopted == 0
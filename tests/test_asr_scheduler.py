@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("fastapi")
+
+from app.core import executors
+from app.services.asr_scheduler import AsrBatchScheduler
+
+
+class RecordingScheduler(AsrBatchScheduler):
+    """Batch registrati al posto dell'inferenza: un risultato per job con la dimensione del batch."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+
+    def _transcribe_batch(self, jobs, language):
+        self.batches.append(len(jobs))
+        return [(f"job {i}", [], {"batch_size": len(jobs)}) for i, _ in enumerate(jobs)]
+
+
+@pytest.fixture
+def scheduler():
+    return RecordingScheduler(window_ms=500, max_batch_size=4)
+
+
+def test_concurrent_submissions_share_one_batch(scheduler):
+    futures = [scheduler.submit(np.zeros(1600, dtype=np.float32)) for _ in range(4)]
+    results = [f.result(timeout=5) for f in futures]
+
+    assert scheduler.batches == [4]
+    assert [r[0] for r in results] == ["job 0", "job 1", "job 2", "job 3"]
+    assert scheduler.stats()["batch_size_histogram"] == {"4": 1}
+
+
+def test_stage_callers_reach_the_scheduler_together(scheduler, monkeypatch):
+    # stesso percorso di asr_pipeline: ogni chiamante blocca un thread dello stage asr
+    monkeypatch.setattr(executors, "_executors", {})
+    monkeypatch.setattr(executors, "_stage_min_slots", {})
+    monkeypatch.setattr(executors, "STAGE_DEFAULTS", {**executors.STAGE_DEFAULTS, "asr": (2, 2, 30.0)})
+    executors.require_stage_slots("asr", scheduler.max_batch_size)
+
+    def transcribe(audio):
+        return scheduler.submit(audio).result()
+
+    async def main():
+        audio = np.zeros(1600, dtype=np.float32)
+        return await asyncio.gather(*(executors.run_stage("asr", transcribe, audio) for _ in range(4)))
+
+    try:
+        results = asyncio.run(main())
+    finally:
+        executors._executors["asr"].shutdown()
+    assert len(results) == 4
+    assert scheduler.batches == [4]
+
+
+def test_require_stage_slots_after_start_is_an_error(monkeypatch):
+    monkeypatch.setattr(executors, "_executors", {})
+    monkeypatch.setattr(executors, "_stage_min_slots", {})
+    ex = executors.get_stage_executor("io")
+    try:
+        with pytest.raises(RuntimeError):
+            executors.require_stage_slots("io", 64)
+    finally:
+        ex.shutdown()
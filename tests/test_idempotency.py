@@ -0,0 +1,219 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException
+
+from app.services.idempotency import IDEMPOTENCY_KEY_MAX_LEN, IdempotencyRegistry, audio_idempotency_key
+
+
+def answered(step: int) -> dict:
+    return {"step_answered": step, "next_question": f"domanda {step + 1}"}
+
+
+def test_audio_key_is_stable():
+    assert audio_idempotency_key(2, b"abc") == audio_idempotency_key(2, b"abc")
+    assert audio_idempotency_key(2, b"abc") != audio_idempotency_key(2, b"abd")
+    assert audio_idempotency_key(2, b"abc") != audio_idempotency_key(4, b"abc")
+
+
+def test_completed_response_is_replayed(tmp_path):
+    reg = IdempotencyRegistry()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        return answered(0)
+
+    async def main():
+        first = await reg.run("s1", tmp_path, "k1", fn)
+        again = await reg.run("s1", tmp_path, "k1", fn)
+        return first, again
+
+    first, again = asyncio.run(main())
+    assert first == answered(0)
+    assert again == {**answered(0), "idempotent_replay": True}
+    assert len(calls) == 1
+    assert reg.stats()["replayed"] == 1
+
+
+def test_unanswered_result_is_not_stored(tmp_path):
+    reg = IdempotencyRegistry()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        return {"detail": "risposta vuota"}
+
+    async def main():
+        await reg.run("s1", tmp_path, "k1", fn)
+        await reg.run("s1", tmp_path, "k1", fn)
+
+    asyncio.run(main())
+    assert len(calls) == 2
+
+
+def test_concurrent_retry_waits_for_original(tmp_path):
+    reg = IdempotencyRegistry(wait_s=5)
+    calls = []
+
+    async def main():
+        entered = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow():
+            calls.append(1)
+            entered.set()
+            await release.wait()
+            return answered(1)
+
+        original = asyncio.create_task(reg.run("s1", tmp_path, "k1", slow))
+        await entered.wait()
+        retry = asyncio.create_task(reg.run("s1", tmp_path, "k1", slow))
+        await asyncio.sleep(0.1)
+        assert not retry.done()
+        release.set()
+        return await original, await retry
+
+    first, retried = asyncio.run(main())
+    assert first == answered(1)
+    assert retried["idempotent_replay"] is True
+    assert len(calls) == 1
+    assert reg.stats()["joined"] == 1
+
+
+def test_retry_gives_up_with_409(tmp_path):
+    reg = IdempotencyRegistry(wait_s=0.1)
+
+    async def main():
+        entered = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow():
+            entered.set()
+            await release.wait()
+            return answered(0)
+
+        original = asyncio.create_task(reg.run("s1", tmp_path, "k1", slow))
+        await entered.wait()
+        try:
+            with pytest.raises(HTTPException) as exc:
+                await reg.run("s1", tmp_path, "k1", slow)
+            assert exc.value.status_code == 409
+            assert "Retry-After" in exc.value.headers
+        finally:
+            release.set()
+            await original
+
+    asyncio.run(main())
+
+
+def test_retry_executes_when_original_failed(tmp_path):
+    reg = IdempotencyRegistry(wait_s=5)
+    calls = []
+
+    async def main():
+        entered = asyncio.Event()
+        release = asyncio.Event()
+
+        async def failing():
+            calls.append("original")
+            entered.set()
+            await release.wait()
+            raise RuntimeError("asr")
+
+        async def ok():
+            calls.append("retry")
+            return answered(2)
+
+        original = asyncio.create_task(reg.run("s1", tmp_path, "k1", failing))
+        await entered.wait()
+        retry = asyncio.create_task(reg.run("s1", tmp_path, "k1", ok))
+        await asyncio.sleep(0.1)
+        release.set()
+        with pytest.raises(RuntimeError):
+            await original
+        return await retry
+
+    result = asyncio.run(main())
+    assert result == answered(2)
+    assert calls == ["original", "retry"]
+    assert reg.stats()["in_flight"] == 0
+
+
+def test_unknown_session_is_404(tmp_path):
+    reg = IdempotencyRegistry()
+
+    async def fn():
+        return answered(0)
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(reg.run("nope", tmp_path / "nope", "k1", fn))
+    assert exc.value.status_code == 404
+    assert not (tmp_path / "nope").exists()
+
+
+def test_key_too_long_is_400(tmp_path):
+    reg = IdempotencyRegistry()
+
+    async def fn():
+        return answered(0)
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(reg.run("s1", tmp_path, "x" * (IDEMPOTENCY_KEY_MAX_LEN + 1), fn))
+    assert exc.value.status_code == 400
+
+
+class FakeUpload:
+    filename = "risposta.webm"
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def read(self, size: int = -1) -> bytes:
+        return self.data
+
+    async def close(self) -> None:
+        pass
+
+
+def test_same_audio_on_a_later_step_advances_the_session(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    from app.core.executors import run_stage
+    from app.core.session_state import SessionState
+    from app.core.session_store import session_store
+    from app.services import interview
+
+    steps = [SimpleNamespace(step_id=f"s{i}") for i in range(6)]
+    monkeypatch.setattr(interview, "SESSIONS_DIR", tmp_path)
+    monkeypatch.setattr(interview, "get_protocol_steps", lambda protocol, lang="it": steps)
+
+    async def fake_finish_turn(ctx, input_path, audio_bytes, **kwargs):
+        answered_step = ctx.state.current_step
+        await run_stage("io", interview._advance_state, ctx)
+        return {"session_id": ctx.session_id, **answered(answered_step)}
+
+    monkeypatch.setattr(interview, "finish_turn", fake_finish_turn)
+
+    session_dir = tmp_path / "s1"
+    session_dir.mkdir()
+    session_store.create(session_dir, SessionState(protocol="mmse_v1", current_step=2, completed=False))
+
+    async def answer() -> dict:
+        return await interview.handle_answer_audio("s1", FakeUpload(b"casa pane gatto"))
+
+    async def main():
+        first = await answer()
+        # step 3 con un audio diverso, poi di nuovo lo stesso clip allo step 4
+        await interview.handle_answer_audio("s1", FakeUpload(b"novantatre"))
+        later = await answer()
+        return first, later
+
+    first, later = asyncio.run(main())
+    assert first["step_answered"] == 2
+    assert later["step_answered"] == 4
+    assert "idempotent_replay" not in later
+    assert session_store.get(session_dir).current_step == 5
@@ -0,0 +1,137 @@
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app.repositories import message_writer as mw
+from app.repositories.message_writer import MessageWriter
+
+
+class FakeDB:
+    """Sostituisce MessageWriter._write: registra i batch, fallisce a comando."""
+
+    def __init__(self):
+        self.batches = []
+        self.fail_next = 0
+        self.poison = set()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, batch):
+        self.gate.wait(timeout=5)
+        if self.fail_next:
+            self.fail_next -= 1
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        if any(row["text"] in self.poison for row in batch):
+            raise IntegrityError("INSERT", {}, Exception("constraint failed"))
+        self.batches.append([row["text"] for row in batch])
+
+    @property
+    def texts(self):
+        return [t for b in self.batches for t in b]
+
+
+@pytest.fixture(autouse=True)
+def fast_retry(monkeypatch):
+    monkeypatch.setattr(mw, "MESSAGE_FLUSH_RETRY_S", 0.01)
+
+
+@pytest.fixture
+def writer(tmp_path):
+    w = MessageWriter(interval_ms=10, max_batch=8, max_attempts=2, dead_letter_path=tmp_path / "dead.jsonl")
+    w._write = FakeDB()
+    yield w
+    w._write.gate.set()
+    w.stop(timeout=2)
+
+
+def test_flush_commits_everything_enqueued(writer):
+    for i in range(5):
+        writer.enqueue("s1", "user", f"m{i}")
+
+    assert writer.flush(timeout=2)
+    assert writer._write.texts == [f"m{i}" for i in range(5)]
+    assert not writer.has_pending("s1")
+    assert writer.stats()["queue_depth"] == 0
+
+
+def test_batches_are_capped_at_max_batch(writer):
+    writer._write.gate.clear()
+    for i in range(20):
+        writer.enqueue("s1", "user", f"m{i}")
+    writer._write.gate.set()
+
+    assert writer.flush(timeout=2)
+    assert len(writer._write.texts) == 20
+    assert max(len(b) for b in writer._write.batches) <= 8
+
+
+def test_failed_commit_is_retried(writer):
+    writer._write.fail_next = 1
+    writer.enqueue("s1", "user", "ciao")
+
+    assert writer.flush(timeout=2)
+    assert writer._write.texts == ["ciao"]
+    assert writer.stats()["errors"] == 1
+    assert writer.stats()["dead_lettered"] == 0
+
+
+def test_flush_timeout_returns_false(writer):
+    writer._write.gate.clear()
+    writer.enqueue("s1", "user", "lento")
+
+    assert writer.flush(timeout=0.05) is False
+    assert writer.has_pending("s1")
+    writer._write.gate.set()
+    assert writer.flush(timeout=2)
+
+
+def test_poison_row_goes_to_dead_letter(writer, tmp_path):
+    writer._write.poison = {"bad"}
+    for text in ("a", "bad", "b"):
+        writer.enqueue("s1", "user", text)
+
+    assert writer.flush(timeout=5)
+    assert writer._write.texts == ["a", "b"]
+    assert writer.stats()["dead_lettered"] == 1
+
+    lines = (tmp_path / "dead.jsonl").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record["text"] == "bad"
+    assert record["session_id"] == "s1"
+    assert "constraint failed" in record["error"]
+
+
+def test_unrelated_error_in_row_mode_keeps_rows_pending(writer):
+    # due fallimenti (max_attempts) poi uno anche riga per riga: nulla va nel dead-letter
+    writer._write.fail_next = 3
+    writer.enqueue("s1", "user", "a")
+    writer.enqueue("s1", "user", "b")
+
+    assert writer.flush(timeout=5)
+    assert writer._write.texts == ["a", "b"]
+    assert writer.stats()["dead_lettered"] == 0
+
+
+def test_multi_worker_turn_commits_messages_before_returning(writer, monkeypatch):
+    pytest.importorskip("fastapi")
+    from app.repositories import db_repo
+
+    monkeypatch.setattr(db_repo, "message_writer", writer)
+    writer._write.gate.clear()
+    writer.enqueue("s1", "user", "risposta")
+
+    monkeypatch.setattr(db_repo, "MULTIPROCESS", False)
+    assert db_repo.db_sync_messages()
+    assert writer.has_pending("s1")
+
+    writer._write.gate.set()
+    monkeypatch.setattr(db_repo, "MULTIPROCESS", True)
+    assert db_repo.db_sync_messages()
+    assert not writer.has_pending("s1")
+    assert writer._write.texts == ["risposta"]
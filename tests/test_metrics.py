@@ -0,0 +1,78 @@
+import time
+
+from app.core.metrics import (
+    MetricsRegistry,
+    current_timings,
+    current_trace_id,
+    record_timing,
+    start_trace,
+    timed,
+)
+
+
+def test_counter_render_with_labels_and_escaping():
+    reg = MetricsRegistry()
+    c = reg.counter("t_requests_total", "Richieste", ("outcome",))
+    c.inc(outcome="ok")
+    c.inc(2, outcome="ok")
+    c.inc(outcome='er"r')
+
+    lines = reg.render().splitlines()
+    assert lines[:2] == ["# HELP t_requests_total Richieste", "# TYPE t_requests_total counter"]
+    assert 't_requests_total{outcome="ok"} 3' in lines
+    assert 't_requests_total{outcome="er\\"r"} 1' in lines
+
+
+def test_histogram_buckets_are_cumulative():
+    reg = MetricsRegistry()
+    h = reg.histogram("t_seconds", "Durata", ("stage",), buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 0.5, 3.0):
+        h.observe(v, stage="asr")
+
+    text = reg.render()
+    assert 't_seconds_bucket{stage="asr",le="0.1"} 1' in text
+    assert 't_seconds_bucket{stage="asr",le="1"} 3' in text
+    assert 't_seconds_bucket{stage="asr",le="+Inf"} 4' in text
+    assert 't_seconds_sum{stage="asr"} 4.05' in text
+    assert 't_seconds_count{stage="asr"} 4' in text
+
+
+def test_gauge_reads_callback_at_scrape():
+    reg = MetricsRegistry()
+    value = [1]
+    reg.gauge("t_depth", "Coda", lambda: value[0])
+    value[0] = 7
+    assert "t_depth 7" in reg.render()
+
+
+def test_gauge_with_failing_callback_is_skipped():
+    reg = MetricsRegistry()
+
+    def broken():
+        raise RuntimeError("n/d")
+
+    reg.gauge("t_broken", "Rotto", broken)
+    lines = reg.render().splitlines()
+    assert "# TYPE t_broken gauge" in lines
+    assert not any(line.startswith("t_broken ") for line in lines)
+
+
+def test_register_returns_existing_metric():
+    reg = MetricsRegistry()
+    a = reg.counter("t_total", "A")
+    b = reg.counter("t_total", "B")
+    assert a is b
+
+
+def test_timed_accumulates_per_request_timings():
+    trace_id = start_trace("abc123")
+    assert current_trace_id() == trace_id == "abc123"
+
+    with timed("t.stage"):
+        time.sleep(0.01)
+    record_timing("t.stage", 0.5)
+
+    timings = current_timings()
+    assert timings["t.stage"] >= 0.51
+    start_trace()
+    assert current_timings() == {}
@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip("httpx")
+
+from app.services.ollama_client import JsonObjectScanner
+
+
+def feed_all(pieces):
+    scanner = JsonObjectScanner()
+    done_at = None
+    for i, piece in enumerate(pieces):
+        if scanner.feed(piece) and done_at is None:
+            done_at = i
+    return scanner, done_at
+
+
+def test_stops_at_end_of_first_object():
+    scanner, done_at = feed_all(['{"score": ', "2, ", '"reason": "ok"}', "\n\ntesto extra"])
+    assert done_at == 2
+    assert scanner.text() == '{"score": 2, "reason": "ok"}'
+
+
+def test_braces_inside_strings_are_ignored():
+    scanner, done_at = feed_all(['{"reason": "usa } e {', ' e \\"}\\""', ', "score": 1}'])
+    assert done_at == 2
+    assert scanner.text() == '{"reason": "usa } e { e \\"}\\"", "score": 1}'
+
+
+def test_nested_objects_and_leading_text():
+    scanner, done_at = feed_all(["Ecco: ", '{"a": {"b": 1}', ', "c": 2}', "}"])
+    assert done_at == 2
+    assert scanner.text() == '{"a": {"b": 1}, "c": 2}'
+
+
+def test_incomplete_object_returns_stripped_text():
+    scanner, done_at = feed_all(['  {"score": 1', ', "reason": "tronc'])
+    assert done_at is None
+    assert scanner.text() == '{"score": 1, "reason": "tronc'
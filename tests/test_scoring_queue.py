@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from app.services import scoring_queue as sq
+from app.services.scoring_queue import PENDING_FILE, SCORE_FILE, ScoringJob, ScoringQueue, read_session_scores
+
+
+@pytest.fixture
+def fake_score(monkeypatch):
+    scores = {}
+
+    async def score_answer(step_id, question, transcript):
+        if transcript == "errore":
+            raise RuntimeError("llm non disponibile")
+        scores[step_id] = transcript
+        return {"score": 1, "max_score": 1, "reason": transcript}
+
+    monkeypatch.setattr(sq, "score_answer", score_answer)
+    return scores
+
+
+def make_job(session_dir, step_index: int, transcript: str = "ok") -> ScoringJob:
+    out_dir = session_dir / "out" / f"step{step_index:02d}_{step_index}"
+    out_dir.mkdir(parents=True)
+    return ScoringJob(
+        session_id=session_dir.name,
+        session_dir=str(session_dir),
+        out_dir=str(out_dir),
+        step_index=step_index,
+        step_id=str(step_index),
+        question="domanda",
+        transcript=transcript,
+        turn={"step_index": step_index},
+    )
+
+
+def test_job_writes_score_and_clears_pending(tmp_path, fake_score):
+    session_dir = tmp_path / "s1"
+
+    async def main():
+        q = ScoringQueue(workers=1)
+        q.start()
+        job = make_job(session_dir, 0)
+        await q.submit(job)
+        assert (session_dir / "out" / "step00_0" / PENDING_FILE).exists()
+        await q.stop()
+        return q
+
+    q = asyncio.run(main())
+    out = session_dir / "out" / "step00_0"
+    assert json.loads((out / SCORE_FILE).read_text(encoding="utf-8"))["score"] == 1
+    assert not (out / PENDING_FILE).exists()
+    assert read_session_scores(session_dir)[0]["status"] == "done"
+    assert q.stats()["completed"] == 1
+
+
+def test_failed_scoring_writes_fallback(tmp_path, fake_score):
+    session_dir = tmp_path / "s1"
+
+    async def main():
+        q = ScoringQueue(workers=1)
+        q.start()
+        await q.submit(make_job(session_dir, 3, transcript="errore"))
+        await q.stop()
+        return q
+
+    q = asyncio.run(main())
+    score = json.loads((session_dir / "out" / "step03_3" / SCORE_FILE).read_text(encoding="utf-8"))
+    assert score["score"] == 0
+    assert "Errore scoring" in score["reason"]
+    assert q.stats()["failed"] == 1
+
+
+def test_waiters_are_woken_and_bookkeeping_is_released(tmp_path, fake_score):
+    session_dir = tmp_path / "s1"
+
+    async def main():
+        q = ScoringQueue(workers=1)
+        job = make_job(session_dir, 1)
+        await q.submit(job)
+        assert q.is_pending("s1")
+
+        ev = q.update_event("s1")
+        q.start()
+        woken = await q.wait_for_update(ev, timeout=2)
+        q.release_event("s1")
+        await q.stop()
+        return q, woken
+
+    q, woken = asyncio.run(main())
+    assert woken
+    assert not q.is_pending("s1")
+    assert q._pending == {}
+    assert q._events == {}
+    assert q.stats()["waiters"] == 0
+
+
+def test_event_is_kept_until_last_waiter_leaves():
+    q = ScoringQueue(workers=1)
+    a = q.update_event("s1")
+    b = q.update_event("s1")
+    assert a is b
+    q.release_event("s1")
+    assert "s1" in q._events
+    q.release_event("s1")
+    assert "s1" not in q._events
@@ -0,0 +1,95 @@
+from datetime import datetime
+
+import pytest
+
+from app.services import scoring_rules
+from app.services.llm_ollama import temporal_ground_truth
+from app.services.scoring_rules import (
+    HIGH,
+    LOW,
+    extract_numbers,
+    parse_numbers,
+    score_phrase_repetition,
+    score_serial_sevens,
+    score_temporal_orientation,
+    score_with_rules,
+    score_word_list,
+)
+
+
+@pytest.fixture
+def fixed_date(monkeypatch):
+    # mercoledì 18 marzo 2026, primavera
+    gt = temporal_ground_truth(datetime(2026, 3, 18))
+    monkeypatch.setattr(scoring_rules, "temporal_ground_truth", lambda: gt)
+    return gt
+
+
+def test_extract_numbers_digits_and_words():
+    assert extract_numbers("93, ottantasei e settantanove") == [93, 86, 79]
+    assert extract_numbers("novantatré") == [93]
+
+
+def test_parse_numbers_joins_split_tens_and_units():
+    numbers, splits = parse_numbers("settanta due sessanta cinque")
+    assert numbers == [72, 65]
+    assert splits == 2
+
+
+def test_parse_numbers_keeps_separate_tokens_without_merge():
+    assert parse_numbers("duemila ventisei") == ([2000, 26], 0)
+    assert parse_numbers("duemila ventisei", merge_compound=True) == ([2026], 0)
+
+
+def test_serial_sevens_all_correct_is_confident():
+    r = score_serial_sevens("cento meno sette: novantatre ottantasei settantanove settantadue sessantacinque", 5)
+    assert r.score == 5
+    assert r.confidence == HIGH
+
+
+def test_serial_sevens_split_numbers_defer_to_llm():
+    r = score_serial_sevens("novantatre ottantasei settantanove settanta due sessanta cinque", 5)
+    assert r.score == 5
+    assert r.confidence == LOW
+
+
+def test_serial_sevens_incomplete_answer_is_low_confidence():
+    r = score_serial_sevens("novantatre ottantasei", 5)
+    assert r.score == 2
+    assert r.confidence == LOW
+
+
+def test_serial_sevens_counts_from_previous_answer():
+    # 93 giusto, 85 sbagliato, 78 = 85 - 7 giusto
+    r = score_serial_sevens("93 85 78 71 64", 5)
+    assert r.score == 4
+
+
+def test_temporal_orientation_all_correct(fixed_date):
+    r = score_temporal_orientation("oggi è mercoledì diciotto marzo duemilaventisei, primavera", 5)
+    assert r.score == 5
+    assert r.confidence == HIGH
+
+
+def test_temporal_orientation_missing_item_defers(fixed_date):
+    r = score_temporal_orientation("mercoledì diciotto marzo", 5)
+    assert r.score == 3
+    assert r.confidence == LOW
+    assert "anno" in r.reason and "stagione" in r.reason
+
+
+def test_word_list_fuzzy_match():
+    r = score_word_list("casa, pane e gato", 3)
+    assert r.score == 3
+    assert r.confidence == HIGH
+
+
+def test_phrase_repetition():
+    assert score_phrase_repetition("Tigre contro tigre.", 1).score == 1
+    assert score_phrase_repetition("non ricordo", 1).score == 0
+
+
+def test_score_with_rules_dispatch():
+    assert score_with_rules("1", "Roma") is None
+    r = score_with_rules("5", "tigre contro tigre")
+    assert r.to_dict()["scorer"] == "rules"
@@ -0,0 +1,108 @@
+import asyncio
+from dataclasses import replace
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException
+
+from app.core.session_state import SessionState, load_state, save_state
+from app.core.session_store import SessionStore, StateConflict
+
+
+def new_state() -> SessionState:
+    return SessionState(protocol="mmse_v1", current_step=0, completed=False)
+
+
+def test_compare_and_swap_bumps_version(tmp_path):
+    store = SessionStore()
+    created = store.create(tmp_path, new_state())
+    assert created.version == 0
+
+    stored = store.compare_and_swap(tmp_path, 0, replace(created, current_step=1))
+    assert stored.version == 1
+    assert load_state(tmp_path).current_step == 1
+    assert store.get(tmp_path) == stored
+
+
+def test_stale_version_conflicts(tmp_path):
+    store = SessionStore()
+    state = store.create(tmp_path, new_state())
+    store.compare_and_swap(tmp_path, state.version, replace(state, current_step=1))
+
+    with pytest.raises(StateConflict):
+        store.compare_and_swap(tmp_path, state.version, replace(state, current_step=2))
+    assert store.conflicts == 1
+    assert load_state(tmp_path).current_step == 1
+
+
+def test_get_returns_a_copy(tmp_path):
+    store = SessionStore()
+    store.create(tmp_path, new_state())
+    state = store.get(tmp_path)
+    state.current_step = 5
+    assert store.get(tmp_path).current_step == 0
+    assert store.hits == 2
+
+
+def test_lru_eviction(tmp_path):
+    store = SessionStore(max_entries=2)
+    dirs = [tmp_path / str(i) for i in range(3)]
+    for d in dirs:
+        d.mkdir()
+        store.create(d, new_state())
+    assert not store.is_cached(dirs[0])
+    assert store.is_cached(dirs[2])
+
+
+def test_multiprocess_sees_writes_from_other_workers(tmp_path):
+    store = SessionStore(multiprocess=True)
+    state = store.create(tmp_path, new_state())
+    # un altro worker avanza la sessione scrivendo direttamente state.json
+    save_state(tmp_path, replace(state, current_step=12, version=1))
+
+    assert store.get(tmp_path).current_step == 12
+    with pytest.raises(StateConflict):
+        store.compare_and_swap(tmp_path, 0, replace(state, current_step=1))
+
+
+def test_turn_serializes_and_rejects_after_wait(tmp_path):
+    store = SessionStore()
+
+    async def main():
+        entered = asyncio.Event()
+        release = asyncio.Event()
+
+        async def first():
+            async with store.turn(tmp_path):
+                entered.set()
+                await release.wait()
+
+        task = asyncio.create_task(first())
+        await entered.wait()
+        with pytest.raises(HTTPException) as exc:
+            async with store.turn(tmp_path, wait_s=0.05):
+                pass
+        assert exc.value.status_code == 409
+
+        release.set()
+        await task
+        async with store.turn(tmp_path, wait_s=0.05):
+            pass
+        assert store.stats()["active_turns"] == 0
+
+    asyncio.run(main())
+
+
+def test_turn_for_unknown_session_is_404(tmp_path):
+    store = SessionStore()
+
+    async def main():
+        with pytest.raises(HTTPException) as exc:
+            async with store.turn(tmp_path / "missing", wait_s=0.05):
+                pass
+        assert exc.value.status_code == 404
+
+    asyncio.run(main())
+    assert not (tmp_path / "missing").exists()
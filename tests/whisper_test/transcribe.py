@@ -1,22 +1,32 @@
-from faster_whisper import WhisperModel
+import sys
+from pathlib import Path
 
-model = WhisperModel(
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parents[1]))  # root progetto, per importare app.*
+
+from app.services.asr_models import get_model_pool
+
+pool = get_model_pool(
     "small",
     device="cpu",
     compute_type="int8"
 )
 
-segments, info = model.transcribe(
-    "input2.wav",
-    language="it"
-)
+with pool.model() as model:
+    segments, info = model.transcribe(
+        str(HERE / "input2.wav"),
+        language="it"
+    )
+    segments = list(segments)
 
 print("Lingua rilevata:", info.language)
 
-with open("transcript.txt", "w", encoding="utf-8") as f:
+with open(HERE / "transcript.txt", "w", encoding="utf-8") as f:
     f.write(f"Lingua rilevata: {info.language}\n")
     for segment in segments:
         f.write(f"[{segment.start:.2f}s -> {segment.end:.2f}s] {segment.text}\n")
 
 for segment in segments:
     print(f"[{segment.start:.2f}s -> {segment.end:.2f}s] {segment.text}")
+
+print("Pool:", pool.stats())